@@ -99,10 +99,12 @@ class MarketDataClient:
                     main_logger.info(
                         "Main",
                         "Market data client started (Press Ctrl+C to exit)...")
-                    wait_for_exit()
-                    # 停止控制器
-                    if ctp_ctr:
-                        ctp_ctr.stop()
+                    try:
+                        wait_for_exit()
+                    finally:
+                        # 停止控制器并关闭数据收集器（异常退出时同样执行）
+                        if ctp_ctr:
+                            ctp_ctr.stop()
                     main_logger.info("Main", "Stopping market data resources...")
         except KeyboardInterrupt:
             # 确保Ctrl+C能够立即中断并退出
@@ -89,6 +89,23 @@ class TradeClient:
         if not ctp_ctr.semaphore.acquire(timeout=10):
             raise TimeoutError("登录超时")
 
+    def _query_instruments(self, ctp_ctr):
+        """
+        查询全部合约，OnRspQryInstrument把各合约的最小变动价位写入
+        appfiles/price_tick_cache.yml，供行情收集的紧凑存储使用
+        :param ctp_ctr: TradeController实例
+        """
+        if not ctp_ctr.is_logged_in:
+            return
+        main_logger.info("Main", "Querying all instruments for price ticks...")
+        res = ctp_ctr.QryInstrument()
+        if res != 0:
+            main_logger.error("Main", f"Instrument query failed: {res}")
+            return
+        # 全部合约逐条返回，最后一条返回后释放信号量（30秒超时）
+        if not ctp_ctr.semaphore.acquire(timeout=30):
+            main_logger.error("Main", "Instrument query timed out")
+
     def _execute_business_operations(self, ctp_ctr):
         """
         执行业务操作
@@ -97,18 +114,12 @@ class TradeClient:
         if ctp_ctr.is_logged_in:
             main_logger.info("Main",
                              "Login successful, starting business operations")
-            # 1. 查询合约
-            ctp_ctr.QryInstrument(exchangeid="SHFE",
-                                  instrumentid=DEFAULT_INSTRUMENT_STR)
-            ctp_ctr.semaphore.acquire(timeout=5)
-            time.sleep(0.5)
-
-            # 2. 查询持仓
+            # 1. 查询持仓（合约已在登录后查询）
             ctp_ctr.QryPosition(instrumentid=DEFAULT_INSTRUMENT_STR)
             ctp_ctr.semaphore.acquire(timeout=5)
             time.sleep(0.5)
 
-            # 3. 下单
+            # 2. 下单
             ctp_ctr.OrderInsert(ORDER_PARAMS_DEFAULT)
             ctp_ctr.semaphore.acquire(timeout=5)
             time.sleep(0.5)
@@ -138,6 +149,7 @@ class TradeClient:
                 self._start_api(ctp_ctr)
                 try:
                     self._login(ctp_ctr)
+                    self._query_instruments(ctp_ctr)
                     self._execute_business_operations(ctp_ctr)
                 except TimeoutError as e:
                     main_logger.error("Main", f"Login failed: {e}")
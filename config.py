@@ -127,9 +127,63 @@ DATA_COLLECTION_CONFIG = APP_CONFIG.get("data_collection", {})
 # 数据库类型（默认hdf5）
 DB_TYPE = DATA_COLLECTION_CONFIG.get("db_type", "hdf5").lower()
 
+# 各数据库处理器的额外参数（按数据库类型区分）
+DB_OPTIONS = {
+    db_type.lower(): options or {}
+    for db_type, options in DATA_COLLECTION_CONFIG.get("db_options",
+                                                       {}).items()
+}
+
 # 缓冲区大小（默认128）
 BUFFER_SIZE = DATA_COLLECTION_CONFIG.get("buffer_size", 128)
 
+# 缓冲区模式（默认list，可选columnar）
+BUFFER_MODE = DATA_COLLECTION_CONFIG.get("buffer_mode", "list").lower()
+
+# 异步写入模式（默认关闭）及其队列容量、写线程数、背压策略
+ASYNC_MODE = DATA_COLLECTION_CONFIG.get("async_mode", False)
+QUEUE_SIZE = DATA_COLLECTION_CONFIG.get("queue_size", 64)
+WRITER_THREADS = DATA_COLLECTION_CONFIG.get("writer_threads", 1)
+BACKPRESSURE = DATA_COLLECTION_CONFIG.get("backpressure", "block").lower()
+
+# 刷新策略：缓冲区估算字节数上限和最早记录的最长缓冲时间（秒），null表示不限制
+FLUSH_MAX_BYTES = DATA_COLLECTION_CONFIG.get("flush_max_bytes")
+FLUSH_MAX_AGE = DATA_COLLECTION_CONFIG.get("flush_max_age")
+
+# 缓冲区个数（默认1）：2为双缓冲、3为三缓冲，flush时换上空缓冲区由写线程落盘，非异步模式时生效
+BUFFER_COUNT = DATA_COLLECTION_CONFIG.get("buffer_count", 1)
+
+# 进程内共享写线程池的线程数（默认0，不使用）和每个交易所的写入队列深度（批次数）
+WRITER_POOL_SIZE = DATA_COLLECTION_CONFIG.get("writer_pool_size", 0)
+WRITER_QUEUE_DEPTH = DATA_COLLECTION_CONFIG.get("writer_queue_depth", 4)
+
+# 扇出写入（默认不启用）：同时写入的其他数据库类型（如["compressed"]），
+# 每个副本有独立写线程，最多落后主数据库sink_max_lag个批次，超过时按sink_backpressure处理
+SINKS = [
+    sink.lower() for sink in DATA_COLLECTION_CONFIG.get("sinks") or []
+]
+SINK_MAX_LAG = DATA_COLLECTION_CONFIG.get("sink_max_lag", 8)
+SINK_BACKPRESSURE = DATA_COLLECTION_CONFIG.get("sink_backpressure",
+                                               "block").lower()
+
+# 进程内全部收集器共享的内存预算（MB，默认null不限制）：已flush未写完的批次超出预算时溢写到本地文件
+MEMORY_BUDGET_MB = DATA_COLLECTION_CONFIG.get("memory_budget_mb")
+
+# 预写日志（默认关闭）：缓冲中的行情每N毫秒组提交到本地日志并fsync，启动时重放未落盘的数据
+JOURNAL = DATA_COLLECTION_CONFIG.get("journal", False)
+JOURNAL_COMMIT_MS = DATA_COLLECTION_CONFIG.get("journal_commit_ms", 10)
+
+# 自适应批次大小（默认关闭）：在上下限内调整批次记录数，使单次写入耗时接近目标值（秒）
+ADAPTIVE_BUFFER = DATA_COLLECTION_CONFIG.get("adaptive_buffer", False)
+BUFFER_MIN_SIZE = DATA_COLLECTION_CONFIG.get("buffer_min_size", 16)
+BUFFER_MAX_SIZE = DATA_COLLECTION_CONFIG.get("buffer_max_size", 8192)
+FLUSH_TARGET_LATENCY = DATA_COLLECTION_CONFIG.get("flush_target_latency",
+                                                  0.05)
+
+# 单文件存储是否按交易日分区，交易日切换时自动滚动到新文件（默认关闭）
+PARTITION_BY_TRADING_DAY = DATA_COLLECTION_CONFIG.get(
+    "partition_by_trading_day", False)
+
 # 数据收集器进程数量（默认1）
 COLLECTOR_COUNT = DATA_COLLECTION_CONFIG.get("collector_count", 1)
 
@@ -142,6 +196,12 @@ if not os.path.exists(DB_PATH):
     os.makedirs(DB_PATH)
     print(f"创建文件夹: {DB_PATH}")
 
+# 背压策略为spill或超出内存预算时的溢写文件目录
+SPILL_PATH = os.path.join(DB_PATH, "spill")
+
+# 预写日志目录，其下按交易所分目录
+JOURNAL_PATH = os.path.join(DB_PATH, "journal")
+
 # ===================== 工具函数 =====================
 
 
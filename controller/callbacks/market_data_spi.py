@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 """行情数据SPI回调处理类"""
 from openctp_ctp import thostmduserapi as mdapi
-from model.market_data import MarketData
+from model.market_data import Tick
 from utils.signal import EXIT_FLAG
 from utils.logger import main_logger
 
@@ -40,11 +40,11 @@ class MarketDataSpi(mdapi.CThostFtdcMdSpi):
             main_logger.error("MDController",
                               "Market data push: pDepthMarketData is None")
             return
-        # 将行情对象转换为MarketData实例
-        market_data = MarketData(pDepthMarketData)
+        # 一次性提取行情字段为紧凑的Tick，不再逐条构造字典
+        tick = Tick.from_ctp(pDepthMarketData)
 
         # 将行情数据添加到数据收集器
-        self.controller.process_market_data(market_data.to_dict())
+        self.controller.process_market_data(tick)
 
     def OnRspSubMarketData(self, pSpecificInstrument, pRspInfo, nRequestID,
                            bIsLast):
@@ -3,6 +3,7 @@
 from openctp_ctp import thosttraderapi as tdapi
 from utils.signal import EXIT_FLAG
 from utils.logger import main_logger
+from db.price_tick import save_price_tick_cache, update_price_tick
 
 
 class TradeSpi(tdapi.CThostFtdcTraderSpi):
@@ -33,3 +34,18 @@ class TradeSpi(tdapi.CThostFtdcTraderSpi):
 
         # 登录成功后可以执行其他操作，如查询投资者持仓、资金等
         self.controller.semaphore.release(bIsLast)
+
+    def OnRspQryInstrument(self, pInstrument, pRspInfo, nRequestID, bIsLast):
+        """查询合约响应，缓存合约的最小变动价位供紧凑存储使用"""
+        # 查询成功时pRspInfo通常为None，只在返回了错误信息时检查
+        if pRspInfo is not None and self.controller.check_response_error(
+                "TradeController", pRspInfo, "QryInstrument"):
+            self.controller.semaphore.release(bIsLast)
+            return
+
+        if pInstrument and pInstrument.PriceTick > 0:
+            update_price_tick(pInstrument.InstrumentID, pInstrument.PriceTick)
+        if bIsLast:
+            # 全部合约返回后一次写入缓存文件
+            save_price_tick_cache()
+        self.controller.semaphore.release(bIsLast)
@@ -5,10 +5,18 @@ import os
 from openctp_ctp import thostmduserapi as mdapi
 from . import BaseController
 from .callbacks import MarketDataSpi
-from model.market_data import MarketData
+from model.market_data import Tick
 from utils.misc import set_req_fields
-from db import create_data_collector
-from config import DB_TYPE, BUFFER_SIZE, DB_PATH
+from db import (AdaptiveBatchSizer, FlushPolicy, MemoryBudget, WriterPool,
+                create_data_collector)
+from config import (DB_TYPE, DB_OPTIONS, BUFFER_SIZE, BUFFER_MODE, DB_PATH,
+                    ASYNC_MODE, QUEUE_SIZE, WRITER_THREADS, BACKPRESSURE,
+                    SPILL_PATH, PARTITION_BY_TRADING_DAY, FLUSH_MAX_BYTES,
+                    FLUSH_MAX_AGE, ADAPTIVE_BUFFER, BUFFER_MIN_SIZE,
+                    BUFFER_MAX_SIZE, FLUSH_TARGET_LATENCY, BUFFER_COUNT,
+                    WRITER_POOL_SIZE, WRITER_QUEUE_DEPTH, JOURNAL,
+                    JOURNAL_COMMIT_MS, JOURNAL_PATH, MEMORY_BUDGET_MB,
+                    SINKS, SINK_MAX_LAG, SINK_BACKPRESSURE)
 from utils.logger import main_logger
 from controller.tools import generate_contract_dict, generate_contract_exchange_map, init_contract_exchange_map
 # 直接导入整个tools模块，以确保我们使用的是全局变量的引用
@@ -64,6 +72,17 @@ class MarketDataController(BaseController):
         # 去重并确保交易所名称有效
         self.exchanges = list(set(self.exchanges))
 
+        # 各交易所收集器共用的写线程池
+        self.writer_pool = (WriterPool(threads=WRITER_POOL_SIZE,
+                                       queue_size=WRITER_QUEUE_DEPTH)
+                            if WRITER_POOL_SIZE > 0 and not ASYNC_MODE else
+                            None)
+
+        # 各交易所收集器共用的内存预算
+        self.memory_budget = (MemoryBudget(int(MEMORY_BUDGET_MB * 1024 * 1024),
+                                           spill_dir=SPILL_PATH)
+                              if MEMORY_BUDGET_MB else None)
+
         # 初始化数据收集器字典，按交易所存储
         self.data_collectors = {}
         for exch in self.exchanges:
@@ -71,10 +90,42 @@ class MarketDataController(BaseController):
             self.data_collectors[exch] = create_data_collector(
                 db_type=DB_TYPE,
                 buffer_size=BUFFER_SIZE,
+                buffer_mode=BUFFER_MODE,
                 # 确保数据库文件保存在appfiles/mydb/{db_type}/目录下
                 db_path=os.path.join(DB_PATH, DB_TYPE.lower()),
                 db_name=f"{exch}.{DB_TYPE.lower()}"
-                if DB_TYPE != "CSV" else None)
+                if DB_TYPE != "CSV" else None,
+                async_mode=ASYNC_MODE,
+                queue_size=QUEUE_SIZE,
+                writer_threads=WRITER_THREADS,
+                backpressure=BACKPRESSURE,
+                spill_dir=SPILL_PATH,
+                db_options=DB_OPTIONS.get(DB_TYPE.lower()),
+                partition_by_trading_day=PARTITION_BY_TRADING_DAY,
+                flush_policy=FlushPolicy(max_records=BUFFER_SIZE,
+                                         max_bytes=FLUSH_MAX_BYTES,
+                                         max_age=FLUSH_MAX_AGE),
+                # 每个交易所独立调整批次大小
+                batch_sizer=AdaptiveBatchSizer(
+                    min_records=BUFFER_MIN_SIZE,
+                    max_records=BUFFER_MAX_SIZE,
+                    target_latency=FLUSH_TARGET_LATENCY)
+                if ADAPTIVE_BUFFER else None,
+                buffer_count=BUFFER_COUNT,
+                writer_pool=self.writer_pool,
+                journal_dir=os.path.join(JOURNAL_PATH, exch)
+                if JOURNAL else None,
+                journal_commit_interval=JOURNAL_COMMIT_MS / 1000,
+                memory_budget=self.memory_budget,
+                # 扇出副本与主数据库并列存放在appfiles/mydb/{sink}/目录下
+                sinks=[{
+                    "db_type": sink,
+                    "db_path": os.path.join(DB_PATH, sink),
+                    "db_name": f"{exch}.{sink}",
+                    "db_options": DB_OPTIONS.get(sink)
+                } for sink in SINKS],
+                sink_max_lag=SINK_MAX_LAG,
+                sink_backpressure=SINK_BACKPRESSURE)
 
         # 创建并注册行情数据SPI回调
         self.spi = MarketDataSpi(self)
@@ -111,10 +162,13 @@ class MarketDataController(BaseController):
         )
         self.api.SubscribeMarketData(instrument_list, len(instrument_list))
 
-    def process_market_data(self, market_data_dict):
-        """处理行情数据"""
+    def process_market_data(self, market_data):
+        """处理行情数据（Tick或字典）"""
         # 获取合约代码
-        instrument_id = market_data_dict.get("InstrumentID")
+        if isinstance(market_data, Tick):
+            instrument_id = market_data.InstrumentID
+        else:
+            instrument_id = market_data.get("InstrumentID")
         if not instrument_id:
             main_logger.error("MDController",
                               "Market data without InstrumentID")
@@ -130,8 +184,36 @@ class MarketDataController(BaseController):
 
         # 将数据添加到对应的交易所数据收集器
         if exchange in self.data_collectors:
-            self.data_collectors[exchange].add_data(market_data_dict)
+            self.data_collectors[exchange].add_data(market_data)
         else:
             main_logger.error(
                 "MDController",
                 f"No data collector found for exchange {exchange}")
+
+    def stop(self):
+        """停止API并关闭所有数据收集器，确保缓冲区和写入队列中的数据落盘"""
+        was_running = self.is_running
+        super().stop()
+        if not was_running:
+            return
+        for exch, collector in self.data_collectors.items():
+            try:
+                collector.close()
+            except Exception as e:
+                main_logger.error(
+                    "MDController",
+                    f"Failed to close data collector for {exch}: {e}")
+        if self.writer_pool is not None:
+            self.writer_pool.close()
+
+    def get_writer_stats(self):
+        """各交易所收集器的缓冲和写入统计，以及共享写线程池和内存预算的状态"""
+        stats = {
+            exch: collector.get_stats()
+            for exch, collector in self.data_collectors.items()
+        }
+        if self.writer_pool is not None:
+            stats["writer_pool"] = self.writer_pool.stats()
+        if self.memory_budget is not None:
+            stats["memory_budget"] = self.memory_budget.stats()
+        return stats
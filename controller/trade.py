@@ -26,3 +26,13 @@ class TradeController(BaseController):
             },
             "ReqUserLogin"
         )
+
+    def QryInstrument(self, exchangeid="", instrumentid=""):
+        """查询合约，交易所和合约代码为空时查询全部合约"""
+        return self.send_request(
+            "QryInstrument", {
+                "ExchangeID": exchangeid,
+                "InstrumentID": instrumentid
+            },
+            "ReqQryInstrument"
+        )
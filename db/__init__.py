@@ -1,8 +1,18 @@
 from db.interface import DatabaseInterface
-from db.handlers import CSVHandler, SQLiteHandler, HDF5Handler
+from db.handlers import (CSVHandler, SQLiteHandler, HDF5Handler,
+                         ParquetHandler, MemmapHandler, SplayedHandler,
+                         CompressedHandler)
 from db.collector import DataCollector, create_data_collector
+from db.fanout import FanoutHandler
+from db.flush import AdaptiveBatchSizer, FlushPolicy, FlushTimer
+from db.journal import TickJournal
+from db.partition import TradingDayHandler
+from db.writer import AsyncWriter, MemoryBudget, PooledWriter, WriterPool
 
 __all__ = [
     'DatabaseInterface', 'CSVHandler', 'SQLiteHandler', 'HDF5Handler',
-    'DataCollector', 'create_data_collector'
+    'ParquetHandler', 'MemmapHandler', 'SplayedHandler', 'CompressedHandler',
+    'TradingDayHandler', 'DataCollector', 'create_data_collector', 'AsyncWriter',
+    'FlushPolicy', 'FlushTimer', 'AdaptiveBatchSizer', 'PooledWriter',
+    'WriterPool', 'TickJournal', 'MemoryBudget', 'FanoutHandler'
 ]
@@ -0,0 +1,346 @@
+import numpy as np
+import pandas as pd
+from typing import (Any, Callable, Dict, Iterable, Iterator, List, Optional,
+                    Tuple, Union)
+from model.market_data import (DAY_MS, EXCHANGE_UTC_OFFSET_MS,
+                               MARKET_DATA_DTYPE, MARKET_DATA_FIELDS,
+                               RECEIVE_COLUMN, TIMESTAMP_COLUMN, Tick,
+                               tick_epoch_ms)
+from utils.logger import main_logger
+
+
+class TickBatch:
+    """
+    列式行情批次
+    基于结构化数组的视图，各列可直接作为NumPy数组使用，无需逐条构造字典
+    """
+
+    def __init__(self, data: np.ndarray):
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.data.dtype.names)
+
+    def column(self, name: str) -> np.ndarray:
+        """返回某一列的零拷贝视图"""
+        return self.data[name]
+
+    def group_by_instrument(self) -> Dict[str, np.ndarray]:
+        """按InstrumentID分组，保持合约内原有顺序"""
+        instrument_ids = self.data["InstrumentID"]
+        first = instrument_ids[0]
+        if (instrument_ids == first).all():
+            # 单一合约的批次直接返回视图
+            return {str(first): self.data}
+        uniques, inverse = np.unique(instrument_ids, return_inverse=True)
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.searchsorted(inverse[order], np.arange(len(uniques) + 1))
+        return {
+            str(uniques[i]): self.data[order[bounds[i]:bounds[i + 1]]]
+            for i in range(len(uniques))
+        }
+
+    def split(self, key_func: Callable[[str], Any]) -> Dict[Any, "TickBatch"]:
+        """按合约映射出的键拆分批次（如写线程分片），保持合约内顺序"""
+        keys = {}
+        for instrument_id in np.unique(self.data["InstrumentID"]):
+            keys.setdefault(key_func(str(instrument_id)),
+                            []).append(instrument_id)
+        if len(keys) == 1:
+            return {next(iter(keys)): self}
+        return {
+            key: TickBatch(self.data[np.isin(self.data["InstrumentID"], ids)])
+            for key, ids in keys.items()
+        }
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """转换为字典列表（仅用于兼容，热路径上不要使用）"""
+        return to_frame(self.data).to_dict("records")
+
+
+def to_frame(data: np.ndarray) -> pd.DataFrame:
+    """将结构化数组按列转换为DataFrame，数值列直接使用数组数据"""
+    return pd.DataFrame({name: data[name] for name in data.dtype.names})
+
+
+def instrument_id_of(item: Any) -> str:
+    """获取单条记录（Tick或字典）的InstrumentID"""
+    if isinstance(item, Tick):
+        return item.InstrumentID
+    return item.get("InstrumentID")
+
+
+def trading_day_of(data: Union[List[Any], TickBatch]) -> Optional[str]:
+    """获取批次中最后一条记录的TradingDay，没有该字段时返回None"""
+    if not len(data):
+        return None
+    if isinstance(data, TickBatch):
+        return str(data.column("TradingDay")[-1])
+    last = data[-1]
+    if isinstance(last, Tick):
+        return last.TradingDay
+    return last.get("TradingDay")
+
+
+# 夜盘时段（交易所时间18:00至次日06:00），按当日0点起的毫秒数
+_NIGHT_START_MS = 18 * 3600 * 1000
+_NIGHT_END_MS = 6 * 3600 * 1000
+
+
+def session_trading_days(trading_days, epoch_ms) -> np.ndarray:
+    """
+    按交易所时间修正夜盘行情的交易日，返回交易日字符串数组
+    郑商所夜盘的TradingDay为自然日，早于实际交易日（夜盘开始那天之后的下一个工作日，
+    节假日前没有夜盘）；只把早于该日的TradingDay推后，已填下一交易日的其他交易所不受影响。
+    epoch_ms为0或TradingDay为空的记录保持不变
+    """
+    trading_days = np.asarray(trading_days, dtype="U8")
+    epoch_ms = np.asarray(epoch_ms, dtype=np.int64)
+    days, clock = np.divmod(epoch_ms + EXCHANGE_UTC_OFFSET_MS, DAY_MS)
+    after_midnight = clock < _NIGHT_END_MS
+    night = ((epoch_ms != 0) & (trading_days != "") &
+             ((clock >= _NIGHT_START_MS) | after_midnight))
+    if not night.any():
+        return trading_days
+    # 凌晨的行情属于前一自然日开始的夜盘
+    evening = (days[night] - after_midnight[night]).astype("datetime64[D]")
+    expected = np.char.replace(
+        np.datetime_as_string(np.busday_offset(evening, 1, roll="backward")),
+        "-", "")
+    lagging = trading_days[night] < expected
+    if not lagging.any():
+        return trading_days
+    trading_days = trading_days.copy()
+    trading_days[np.flatnonzero(night)[lagging]] = expected[lagging]
+    return trading_days
+
+
+def split_by_trading_day(
+        data: Union[List[Any], TickBatch]
+) -> List[Tuple[str, Union[List[Any], TickBatch]]]:
+    """
+    按交易日拆分批次，返回[(交易日, 子批次)]，保持原有顺序和记录类型
+    交易日取TradingDay，郑商所夜盘按session_trading_days修正（记录本身不修改）；
+    通常一个批次只有一个交易日，此时直接返回原批次；没有该字段的记录交易日为空字符串
+    """
+    if isinstance(data, TickBatch):
+        trading_days = session_trading_days(data.column("TradingDay"),
+                                            data.column(TIMESTAMP_COLUMN))
+        first = trading_days[0]
+        if (trading_days == first).all():
+            return [(str(first), data)]
+        uniques = np.unique(trading_days)
+        return [(str(day), TickBatch(data.data[trading_days == day]))
+                for day in uniques]
+    if isinstance(data[0], Tick):
+        trading_days = [item.TradingDay for item in data]
+        epoch_ms = [item.epoch_ms for item in data]
+    else:
+        trading_days = [item.get("TradingDay") or "" for item in data]
+        epoch_ms = [item.get(TIMESTAMP_COLUMN) or 0 for item in data]
+    parts: Dict[str, List[Any]] = {}
+    for trading_day, item in zip(
+            session_trading_days(trading_days, epoch_ms).tolist(), data):
+        parts.setdefault(trading_day, []).append(item)
+    return sorted(parts.items())
+
+
+def group_by_instrument(
+        data: Union[List[Any], TickBatch],
+        component: str) -> Dict[str, Union[List[Any], np.ndarray]]:
+    """
+    按InstrumentID分组，保持合约内原有顺序
+    列式批次每组为结构化数组，字典/Tick列表每组为原始记录列表
+    """
+    if isinstance(data, TickBatch):
+        return data.group_by_instrument()
+
+    # 按InstrumentID分组数据
+    data_by_instrument = {}
+    for item in data:
+        # 检查InstrumentID是否存在
+        instrument_id = instrument_id_of(item)
+        if not instrument_id:
+            main_logger.error(component, f"缺失InstrumentID的记录: {item}")
+            continue
+        if instrument_id not in data_by_instrument:
+            data_by_instrument[instrument_id] = []
+        data_by_instrument[instrument_id].append(item)
+    return data_by_instrument
+
+
+def iter_instrument_frames(
+        data: Union[List[Dict[str, Any]], TickBatch],
+        component: str) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """
+    按InstrumentID分组并生成(合约, DataFrame)
+    同时支持字典列表、Tick列表和列式批次，后两者不经过字典→DataFrame转换
+    """
+    for instrument_id, rows in group_by_instrument(data, component).items():
+        if isinstance(rows, np.ndarray):
+            yield instrument_id, to_frame(rows)
+        elif isinstance(rows[0], Tick):
+            # Tick本身就是按字段顺序排列的元组，直接按行构造
+            yield instrument_id, pd.DataFrame.from_records(
+                rows, columns=MARKET_DATA_FIELDS)
+        else:
+            yield instrument_id, pd.DataFrame(rows)
+
+
+def epoch_ms_of(df: pd.DataFrame) -> np.ndarray:
+    """取DataFrame中每行的epoch毫秒，优先使用已保存的epoch_ms列，为空的行按时间字段计算"""
+    if TIMESTAMP_COLUMN not in df.columns:
+        return tick_epoch_ms(df["ActionDay"], df["UpdateTime"],
+                             df["UpdateMillisec"])
+    epoch_ms = df[TIMESTAMP_COLUMN].to_numpy(dtype=np.int64)
+    missing = epoch_ms == 0
+    if missing.any():
+        epoch_ms = epoch_ms.copy()
+        epoch_ms[missing] = tick_epoch_ms(
+            *(df[name].to_numpy()[missing] for name in _TIME_FIELDS[:3]))
+    return epoch_ms
+
+
+_TIME_FIELDS = ("ActionDay", "UpdateTime", "UpdateMillisec", RECEIVE_COLUMN)
+_TICK_TIMESTAMP_INDEX = MARKET_DATA_FIELDS.index(TIMESTAMP_COLUMN)
+
+
+def stamp_epoch_ms(
+        data: Union[List[Any], TickBatch]) -> Union[List[Any], TickBatch]:
+    """
+    为批次中epoch_ms为空（0或缺失）的记录批量计算交易所时间戳，并修正夜盘日期
+    列式批次原地填充，Tick列表返回新的列表，字典原地添加epoch_ms；没有ActionDay的记录保持为空
+    （同一批次中的记录类型一致，按第一条判断）
+    """
+    if not len(data):
+        return data
+    if isinstance(data, TickBatch):
+        records = data.data
+        missing = ((records[TIMESTAMP_COLUMN] == 0) &
+                   (records["ActionDay"] != ""))
+        if missing.any():
+            records[TIMESTAMP_COLUMN][missing] = tick_epoch_ms(
+                *(records[name][missing] for name in _TIME_FIELDS))
+        return data
+
+    if isinstance(data[0], Tick):
+        if all(row.epoch_ms or not row.ActionDay for row in data):
+            return data
+        epoch_ms = tick_epoch_ms(*([getattr(row, name) for row in data]
+                                   for name in _TIME_FIELDS)).tolist()
+        # Tick为不可变元组，替换epoch_ms字段后重新构造
+        return [
+            row if row.epoch_ms or not row.ActionDay else tuple.__new__(
+                Tick, row[:_TICK_TIMESTAMP_INDEX] + (value, ) +
+                row[_TICK_TIMESTAMP_INDEX + 1:])
+            for row, value in zip(data, epoch_ms)
+        ]
+
+    rows = [
+        row for row in data
+        if not row.get(TIMESTAMP_COLUMN) and row.get("ActionDay")
+    ]
+    if rows:
+        epoch_ms = tick_epoch_ms(*([row.get(name, 0) for row in rows]
+                                   for name in _TIME_FIELDS))
+        for row, value in zip(rows, epoch_ms.tolist()):
+            row[TIMESTAMP_COLUMN] = value
+    return data
+
+
+def select_frames(chunks: Iterable[pd.DataFrame],
+                  limit: Optional[int] = None,
+                  columns: Optional[List[str]] = None,
+                  start_ms: Optional[int] = None,
+                  end_ms: Optional[int] = None) -> pd.DataFrame:
+    """
+    逐块筛选数据：按时间范围过滤、投影列，并只保留最后limit行
+    内存占用只与块大小和limit有关，与表的大小无关
+    """
+    selected: List[pd.DataFrame] = []
+    kept = 0
+    for chunk in chunks:
+        if start_ms is not None or end_ms is not None:
+            epoch_ms = epoch_ms_of(chunk)
+            mask = np.ones(len(chunk), dtype=bool)
+            if start_ms is not None:
+                mask &= epoch_ms >= start_ms
+            if end_ms is not None:
+                mask &= epoch_ms < end_ms
+            chunk = chunk[mask]
+        if columns:
+            chunk = chunk[columns]
+        if not len(chunk):
+            continue
+        selected.append(chunk)
+        kept += len(chunk)
+        if limit:
+            # 丢弃已不可能落在最后limit行内的块
+            while kept - len(selected[0]) >= limit:
+                kept -= len(selected.pop(0))
+    if not selected:
+        return pd.DataFrame(columns=columns) if columns else pd.DataFrame()
+    df = pd.concat(selected)
+    if limit:
+        df = df.tail(limit)
+    return df
+
+
+class ColumnarBuffer:
+    """
+    预分配的列式行情缓冲区
+    追加时直接写入结构化数组对应的行，取出时整体交给处理器
+    """
+
+    def __init__(self, capacity: int, dtype: np.dtype = MARKET_DATA_DTYPE):
+        self.capacity = capacity
+        self.dtype = dtype
+        self._fields = dtype.names
+        # 字典记录缺失字段时使用的默认值
+        self._defaults = tuple("" if dtype[name].kind == "U" else 0
+                               for name in self._fields)
+        self._data = np.zeros(capacity, dtype=dtype)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, record: Any) -> None:
+        """追加一条记录，支持字典或与字段顺序一致的元组（如Tick）"""
+        if self._size >= self.capacity:
+            self._grow()
+        if isinstance(record, dict):
+            record = tuple(
+                record.get(name, default)
+                for name, default in zip(self._fields, self._defaults))
+        self._data[self._size] = record
+        self._size += 1
+
+    def _grow(self) -> None:
+        # 异常情况下（如未及时flush）扩容，保证不丢数据
+        data = np.zeros(self.capacity * 2, dtype=self.dtype)
+        data[:self._size] = self._data[:self._size]
+        self._data = data
+        self.capacity *= 2
+
+    def take(self) -> TickBatch:
+        """取出当前数据作为批次，并切换到新分配的数组"""
+        batch = TickBatch(self._data[:self._size])
+        self._data = np.zeros(self.capacity, dtype=self.dtype)
+        self._size = 0
+        return batch
+
+    def restore(self, batch: TickBatch) -> None:
+        """把取出后写入失败的批次放回缓冲区最前面，保持记录顺序"""
+        records = np.concatenate([batch.data, self._data[:self._size]])
+        self.capacity = max(self.capacity, len(records))
+        self._data = np.zeros(self.capacity, dtype=self.dtype)
+        self._data[:len(records)] = records
+        self._size = len(records)
+
+    def clear(self) -> None:
+        self._size = 0
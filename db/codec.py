@@ -0,0 +1,290 @@
+import struct
+import numpy as np
+from typing import List, Optional, Tuple
+from model.market_data import MARKET_DATA_SCHEMA
+
+# 列编码方式
+CODEC_RAW = 0  # 原始字节
+CODEC_DELTA_OF_DELTA = 1  # 整数二阶差分（时间戳）
+CODEC_DELTA = 2  # 整数一阶差分（累计成交量等）
+CODEC_QUANTIZED = 3  # 浮点数按10^k放大为整数后差分（按最小变动价位变化的价格）
+CODEC_XOR = 4  # 浮点数与前值按位异或（无法量化的浮点列）
+CODEC_DICTIONARY = 5  # 字符串字典 + 编号差分
+# 量化 + 例外值：无效价格（CTP用DBL_MAX表示）等无法量化的值按位置单独保存，其余值量化
+CODEC_QUANTIZED_EXCEPTIONS = 6
+
+# 量化浮点列时尝试的最大小数位数
+MAX_DECIMALS = 4
+# 绝对值不小于该值（及NaN、无穷大）的浮点数不参与量化，作为例外值保存
+MAX_QUANTIZED = 2**50
+_COLUMN_HEADER = struct.Struct("<BI")
+_DICTIONARY_HEADER = struct.Struct("<I")
+_SECTION_HEADER = struct.Struct("<I")
+
+# 五档盘口字段，盘口增量编码时第i个字段对应位掩码的第i位
+DEPTH_FIELDS = [
+    name for name, _ in MARKET_DATA_SCHEMA
+    if name.startswith(("BidPrice", "BidVolume", "AskPrice", "AskVolume"))
+]
+
+
+def zigzag_encode(values: np.ndarray) -> np.ndarray:
+    """有符号整数映射为无符号整数，绝对值小的数映射后也小"""
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def zigzag_decode(values: np.ndarray) -> np.ndarray:
+    values = values.astype(np.uint64)
+    return ((values >> np.uint64(1)).view(np.int64) ^
+            -(values & np.uint64(1)).view(np.int64))
+
+
+def varint_encode(values: np.ndarray) -> bytes:
+    """向量化的LEB128变长编码，每字节7位，最高位表示后面还有字节"""
+    values = values.astype(np.uint64)
+    if not len(values):
+        return b""
+    # 每个值需要的字节数
+    lengths = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        lengths += values >= np.uint64(1 << (7 * k))
+    offsets = np.cumsum(lengths) - lengths
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for k in range(int(lengths.max())):
+        mask = lengths > k
+        chunk = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        more = (lengths[mask] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[offsets[mask] + k] = chunk | more
+    return out.tobytes()
+
+
+def varint_decode(data: bytes, count: int) -> np.ndarray:
+    """向量化解码count个LEB128变长整数"""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(raw < 0x80)[:count]
+    starts = np.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts + 1
+    values = np.zeros(len(ends), dtype=np.uint64)
+    for k in range(int(lengths.max()) if len(lengths) else 0):
+        mask = lengths > k
+        values[mask] |= ((raw[starts[mask] + k] & 0x7f).astype(np.uint64) <<
+                         np.uint64(7 * k))
+    return values
+
+
+def _delta(values: np.ndarray) -> np.ndarray:
+    return np.diff(values, prepend=values.dtype.type(0))
+
+
+def _quantize(values: np.ndarray) -> Tuple[int, np.ndarray, np.ndarray]:
+    """
+    找到能把整列无损放大为整数的最小小数位数，找不到时返回-1
+    非有限值和绝对值过大的值（如CTP表示无效价格的DBL_MAX）作为例外值不参与量化，
+    返回(小数位数, 其余值放大后的整数, 例外值掩码)
+    """
+    with np.errstate(invalid="ignore"):
+        exceptions = ~(np.abs(values) < MAX_QUANTIZED)
+    regular = values[~exceptions] if exceptions.any() else values
+    for decimals in range(MAX_DECIMALS + 1):
+        scale = 10.0**decimals
+        scaled = np.rint(regular * scale)
+        if np.array_equal(scaled / scale, regular):
+            return decimals, scaled.astype(np.int64), exceptions
+    return -1, values, exceptions
+
+
+def _xor_encode(values: np.ndarray) -> bytes:
+    """Gorilla式异或：相近的值异或后高位为0，变长编码更短"""
+    bits = np.ascontiguousarray(values, dtype=np.float64).view(np.uint64)
+    return varint_encode(bits ^ np.concatenate(
+        [np.zeros(1, dtype=np.uint64), bits[:-1]]))
+
+
+def _xor_decode(data: bytes, count: int) -> np.ndarray:
+    return np.bitwise_xor.accumulate(varint_decode(data, count)).view(
+        np.float64)
+
+
+def _section(payload: bytes) -> bytes:
+    return _SECTION_HEADER.pack(len(payload)) + payload
+
+
+def _read_section(data: bytes, offset: int) -> Tuple[bytes, int]:
+    (length, ) = _SECTION_HEADER.unpack_from(data, offset)
+    offset += _SECTION_HEADER.size
+    return data[offset:offset + length], offset + length
+
+
+def encode_column(values: np.ndarray, timestamp: bool = False) -> bytes:
+    """按列的类型选择编码方式，返回 编码方式+长度+数据"""
+    kind = values.dtype.kind
+    if kind == "i" and timestamp:
+        codec = CODEC_DELTA_OF_DELTA
+        payload = varint_encode(zigzag_encode(_delta(_delta(values))))
+    elif kind == "i":
+        codec = CODEC_DELTA
+        payload = varint_encode(zigzag_encode(_delta(values)))
+    elif kind == "f":
+        decimals, scaled, exceptions = _quantize(values)
+        count = int(exceptions.sum())
+        if decimals >= 0 and not count:
+            codec = CODEC_QUANTIZED
+            payload = bytes([decimals]) + varint_encode(
+                zigzag_encode(_delta(scaled)))
+        elif decimals >= 0 and count < len(values):
+            # 例外值的位置差分编码、原值异或编码（连续的DBL_MAX每个只占1字节），
+            # 其余值跳过例外值后量化差分
+            codec = CODEC_QUANTIZED_EXCEPTIONS
+            positions = np.flatnonzero(exceptions)
+            payload = (bytes([decimals]) +
+                       _section(varint_encode(_delta(positions))) +
+                       _section(_xor_encode(values[exceptions])) +
+                       varint_encode(zigzag_encode(_delta(scaled))))
+        else:
+            codec = CODEC_XOR
+            payload = _xor_encode(values)
+    elif kind == "S":
+        codec = CODEC_DICTIONARY
+        uniques, inverse = np.unique(values, return_inverse=True)
+        dictionary = b"\0".join(uniques.tolist())
+        payload = (_DICTIONARY_HEADER.pack(len(dictionary)) + dictionary +
+                   varint_encode(zigzag_encode(_delta(inverse))))
+    else:
+        codec = CODEC_RAW
+        payload = np.ascontiguousarray(values).tobytes()
+    return _COLUMN_HEADER.pack(codec, len(payload)) + payload
+
+
+def decode_column(data: bytes, offset: int, dtype: np.dtype,
+                  count: int) -> Tuple[np.ndarray, int]:
+    """从data的offset处解码一列，返回(数组, 下一列的偏移)"""
+    codec, length = _COLUMN_HEADER.unpack_from(data, offset)
+    offset += _COLUMN_HEADER.size
+    payload = data[offset:offset + length]
+    if codec == CODEC_DELTA_OF_DELTA:
+        values = np.cumsum(np.cumsum(zigzag_decode(
+            varint_decode(payload, count))))
+    elif codec == CODEC_DELTA:
+        values = np.cumsum(zigzag_decode(varint_decode(payload, count)))
+    elif codec == CODEC_QUANTIZED:
+        scaled = np.cumsum(zigzag_decode(varint_decode(payload[1:], count)))
+        values = scaled / 10.0**payload[0]
+    elif codec == CODEC_QUANTIZED_EXCEPTIONS:
+        section, start = _read_section(payload, 1)
+        # 位置个数不超过该段的字节数，按字节数解码即可取出全部位置
+        positions = np.cumsum(
+            varint_decode(section, len(section)).astype(np.int64))
+        section, start = _read_section(payload, start)
+        regular = np.ones(count, dtype=bool)
+        regular[positions] = False
+        values = np.empty(count, dtype=np.float64)
+        values[positions] = _xor_decode(section, len(positions))
+        scaled = np.cumsum(
+            zigzag_decode(varint_decode(payload[start:], int(regular.sum()))))
+        values[regular] = scaled / 10.0**payload[0]
+    elif codec == CODEC_XOR:
+        values = _xor_decode(payload, count)
+    elif codec == CODEC_DICTIONARY:
+        (size, ) = _DICTIONARY_HEADER.unpack_from(payload)
+        start = _DICTIONARY_HEADER.size
+        uniques = np.array(payload[start:start + size].split(b"\0"),
+                           dtype=dtype)
+        inverse = np.cumsum(
+            zigzag_decode(varint_decode(payload[start + size:], count)))
+        values = uniques[inverse]
+    else:
+        values = np.frombuffer(payload, dtype=dtype, count=count)
+    return values.astype(dtype, copy=False), offset + length
+
+
+def _changed(values: np.ndarray) -> np.ndarray:
+    """每行相对上一行是否变化，按位比较（NaN与NaN视为相同）"""
+    bits = np.ascontiguousarray(values).view(f"u{values.dtype.itemsize}")
+    changed = np.empty(len(bits), dtype=bool)
+    changed[0] = True
+    np.not_equal(bits[1:], bits[:-1], out=changed[1:])
+    return changed
+
+
+def encode_depth(records: np.ndarray, snapshot_interval: int) -> bytes:
+    """
+    盘口增量编码：每snapshot_interval行保存一次全部盘口字段（快照），
+    其余行只保存变化字段的位掩码，各字段只按列编码变化后的新值
+    """
+    changed = np.column_stack([_changed(records[name])
+                               for name in DEPTH_FIELDS])
+    changed[::snapshot_interval] = True
+    masks = (changed.astype(np.uint64) <<
+             np.arange(len(DEPTH_FIELDS), dtype=np.uint64)).sum(axis=1)
+    encoded_masks = varint_encode(masks)
+    return (_SECTION_HEADER.pack(len(encoded_masks)) + encoded_masks +
+            b"".join(
+                encode_column(records[name][changed[:, i]])
+                for i, name in enumerate(DEPTH_FIELDS)))
+
+
+def decode_depth(data: bytes, offset: int, records: np.ndarray,
+                 columns: Optional[List[str]] = None) -> int:
+    """
+    解码盘口增量编码的字段并写入records，返回下一段的偏移
+    每行取该字段最近一次变化的值，按变化次数的累加和向量化还原
+    """
+    (length, ) = _SECTION_HEADER.unpack_from(data, offset)
+    offset += _SECTION_HEADER.size
+    masks = varint_decode(data[offset:offset + length], len(records))
+    offset += length
+    for i, name in enumerate(DEPTH_FIELDS):
+        if columns is not None and name not in columns:
+            _, length = _COLUMN_HEADER.unpack_from(data, offset)
+            offset += _COLUMN_HEADER.size + length
+            continue
+        changed = ((masks >> np.uint64(i)) & np.uint64(1)).astype(bool)
+        values, offset = decode_column(data, offset, records.dtype[name],
+                                       int(changed.sum()))
+        records[name] = values[np.cumsum(changed) - 1]
+    return offset
+
+
+def encode_block(records: np.ndarray,
+                 timestamp_column: str,
+                 snapshot_interval: Optional[int] = None) -> bytes:
+    """
+    把一批结构化数组记录按列编码为一个数据块
+    snapshot_interval指定时五档盘口字段改用盘口增量编码，附加在其余各列之后
+    """
+    names = records.dtype.names
+    if snapshot_interval:
+        names = [name for name in names if name not in DEPTH_FIELDS]
+    block = b"".join(
+        encode_column(records[name], timestamp=name == timestamp_column)
+        for name in names)
+    if snapshot_interval:
+        block += encode_depth(records, snapshot_interval)
+    return block
+
+
+def decode_block(data: bytes,
+                 dtype: np.dtype,
+                 count: int,
+                 columns: List[str] = None,
+                 depth_delta: bool = False) -> np.ndarray:
+    """解码一个数据块，columns指定时只解码这些列，depth_delta表示盘口为增量编码"""
+    records = np.zeros(count, dtype=dtype)
+    offset = 0
+    for name in dtype.names:
+        if depth_delta and name in DEPTH_FIELDS:
+            continue
+        if columns is not None and name not in columns:
+            # 跳过不需要的列
+            _, length = _COLUMN_HEADER.unpack_from(data, offset)
+            offset += _COLUMN_HEADER.size + length
+            continue
+        records[name], offset = decode_column(data, offset, dtype[name],
+                                              count)
+    if depth_delta and (columns is None
+                        or not set(columns).isdisjoint(DEPTH_FIELDS)):
+        decode_depth(data, offset, records, columns)
+    return records
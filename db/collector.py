@@ -1,10 +1,25 @@
+import collections
 import os
+import threading
+import time
 import pandas as pd
-from typing import List, Dict, Any, Optional
-from db.handlers import CSVHandler, SQLiteHandler, HDF5Handler
+from typing import List, Dict, Any, Optional, Union
+from db.buffer import ColumnarBuffer, TickBatch, stamp_epoch_ms
+from db.handlers import (CSVHandler, SQLiteHandler, HDF5Handler,
+                         ParquetHandler, MemmapHandler, SplayedHandler,
+                         CompressedHandler)
+from db.fanout import FanoutHandler
+from db.flush import AdaptiveBatchSizer, FlushPolicy, flush_timer
+from db.journal import TickJournal
+from db.partition import TradingDayHandler
+from db.writer import (AsyncWriter, BACKPRESSURE_BLOCK,
+                       BACKPRESSURE_DROP_OLDEST, MemoryBudget, SpillFile,
+                       WriterPool)
+from model.market_data import MARKET_DATA_DTYPE, Tick
 from utils.logger import main_logger
 
 # 数据库类型映射表：将配置中的小写数据库类型映射到对应的处理器类和默认扩展名
+# trading_day_partitioned表示处理器自身已按交易日分目录存储，不需要再包装
 DB_TYPE_MAPPING = {
     "csv": {
         "handler": CSVHandler,
@@ -17,9 +32,71 @@ DB_TYPE_MAPPING = {
     "hdf5": {
         "handler": HDF5Handler,
         "default_extension": "h5"
+    },
+    "parquet": {
+        "handler": ParquetHandler,
+        "default_extension": None,  # 按exchange=/symbol=/trading_day=分区，不需要文件名
+        "trading_day_partitioned": True
+    },
+    "memmap": {
+        "handler": MemmapHandler,
+        "default_extension": None,  # 每个合约每个交易日一个定长二进制文件
+        "trading_day_partitioned": True
+    },
+    "splayed": {
+        "handler": SplayedHandler,
+        "default_extension": "splayed",  # 目录名，其下为交易日/合约/列.npy
+        "trading_day_partitioned": True
+    },
+    "compressed": {
+        "handler": CompressedHandler,
+        "default_extension": None,  # 每个合约每个交易日一个按列压缩的文件
+        "trading_day_partitioned": True
     }
 }
 
+# 缓冲区模式：list为字典列表，columnar为预分配的NumPy结构化数组
+BUFFER_MODES = ("list", "columnar")
+
+
+def create_db_handler(db_type: str,
+                      db_path: str,
+                      db_name: Optional[str] = None,
+                      db_options: Optional[Dict[str, Any]] = None,
+                      partition_by_trading_day: bool = False):
+    """按数据库类型创建处理器，db_options作为处理器的额外参数"""
+    # 检查数据库类型是否支持
+    if db_type not in DB_TYPE_MAPPING:
+        supported_types = ', '.join(DB_TYPE_MAPPING.keys())
+        raise ValueError(
+            f"Unsupported database type: {db_type}. Supported types: {supported_types}"
+        )
+
+    # 获取对应的处理器类和默认扩展名
+    db_config = DB_TYPE_MAPPING[db_type]
+    handler_class = db_config["handler"]
+    default_extension = db_config["default_extension"]
+
+    db_options = db_options or {}
+    if default_extension is not None and db_name is None:
+        # 其他数据库类型需要文件名参数
+        raise ValueError(
+            f"Database type {db_type} requires a db_name parameter.")
+
+    def create_handler(path: str):
+        if default_extension is None:
+            # CSV不需要文件名参数
+            return handler_class(path, **db_options)
+        return handler_class(path, db_name, **db_options)
+
+    # 按交易日分区：单文件存储每个交易日写入db_path/交易日/，交易日切换时自动滚动
+    if (partition_by_trading_day
+            and not db_config.get("trading_day_partitioned")):
+        return TradingDayHandler(create_handler,
+                                 db_path,
+                                 thread_safe=handler_class.thread_safe)
+    return create_handler(db_path)
+
 
 class DataCollector:
     """数据收集器，支持多种数据库和缓冲区功能"""
@@ -28,76 +105,421 @@ class DataCollector:
                  db_type: str = "hdf5",
                  buffer_size: int = 128,
                  db_path: str = "db",
-                 db_name: str = None):
+                 db_name: str = None,
+                 async_mode: bool = False,
+                 queue_size: int = 64,
+                 writer_threads: int = 1,
+                 backpressure: str = BACKPRESSURE_BLOCK,
+                 spill_dir: Optional[str] = None,
+                 buffer_mode: str = "list",
+                 db_options: Optional[Dict[str, Any]] = None,
+                 partition_by_trading_day: bool = False,
+                 flush_policy: Optional[FlushPolicy] = None,
+                 batch_sizer: Optional[AdaptiveBatchSizer] = None,
+                 buffer_count: int = 1,
+                 writer_pool: Optional[WriterPool] = None,
+                 journal_dir: Optional[str] = None,
+                 journal_commit_interval: float = 0.01,
+                 memory_budget: Optional[MemoryBudget] = None,
+                 sinks: Optional[List[Dict[str, Any]]] = None,
+                 sink_max_lag: int = 8,
+                 sink_backpressure: str = BACKPRESSURE_BLOCK):
         self.buffer_size = buffer_size
-        self.buffer: List[Dict[str, Any]] = []
         self.db_path = db_path
+        # 刷新策略，默认只按buffer_size条刷新
+        self.flush_policy = flush_policy or FlushPolicy(max_records=buffer_size)
+        # 字节数上限按每条记录的结构化数组大小估算，与记录数上限合并为一个阈值
+        self._flush_records = (self.flush_policy.record_limit(
+            MARKET_DATA_DTYPE.itemsize) or float("inf"))
+        # 自适应批次大小：按实测写入耗时在上下限内调整记录数阈值，内存上限仍按max_bytes
+        self.batch_sizer = batch_sizer
+        if batch_sizer is not None:
+            self._flush_records = batch_sizer.start(
+                buffer_size,
+                FlushPolicy(max_records=None,
+                            max_bytes=self.flush_policy.max_bytes).record_limit(
+                                MARKET_DATA_DTYPE.itemsize),
+                self.flush_policy.max_age)
+        # 缓冲区中最早一条记录的追加时间（单调时钟）
+        self._oldest = 0.0
+        # 行情线程追加与定时刷新线程之间互斥
+        self._lock = threading.Lock()
+
+        # 列式模式下追加直接写入结构化数组，flush时处理器拿到零拷贝的列式批次
+        buffer_mode = buffer_mode.lower()
+        if buffer_mode not in BUFFER_MODES:
+            raise ValueError(
+                f"Unsupported buffer mode: {buffer_mode}. "
+                f"Supported modes: {', '.join(BUFFER_MODES)}")
+        self.buffer_mode = buffer_mode
+        if buffer_mode == "columnar":
+            self.buffer = ColumnarBuffer(buffer_size)
+        else:
+            self.buffer: List[Dict[str, Any]] = []
 
         # 将数据库类型转换为小写，确保与配置保持一致
         db_type = db_type.lower()
+        sinks = sinks or []
+        sink_types = [sink["db_type"].lower() for sink in sinks]
+        for i, sink_type in enumerate(sink_types):
+            if sink_type == db_type or sink_type in sink_types[:i]:
+                raise ValueError(f"Duplicate sink database type: {sink_type}")
+        self.db_handler = create_db_handler(db_type, db_path, db_name,
+                                            db_options,
+                                            partition_by_trading_day)
 
-        # 检查数据库类型是否支持
-        if db_type not in DB_TYPE_MAPPING:
-            supported_types = ', '.join(DB_TYPE_MAPPING.keys())
-            raise ValueError(
-                f"Unsupported database type: {db_type}. Supported types: {supported_types}"
-            )
+        # 扇出：同一批次再写入sinks中的副本处理器（如研究用的压缩列式存储），
+        # 每个副本有各自的写线程，最多落后sink_max_lag个批次
+        if sinks:
+            sink_handlers = {
+                sink_type: create_db_handler(sink_type, sink["db_path"],
+                                             sink.get("db_name"),
+                                             sink.get("db_options"),
+                                             partition_by_trading_day)
+                for sink_type, sink in zip(sink_types, sinks)
+            }
+            self.db_handler = FanoutHandler(self.db_handler,
+                                            sink_handlers,
+                                            max_lag=sink_max_lag,
+                                            backpressure=sink_backpressure,
+                                            spill_dir=spill_dir)
 
-        # 获取对应的处理器类和默认扩展名
-        db_config = DB_TYPE_MAPPING[db_type]
-        handler_class = db_config["handler"]
-        default_extension = db_config["default_extension"]
+        if (memory_budget is not None and async_mode
+                and backpressure == BACKPRESSURE_DROP_OLDEST):
+            raise ValueError(
+                "memory budget cannot account for batches dropped by "
+                "drop_oldest backpressure")
 
-        # 创建数据库处理器实例
-        if default_extension is None:
-            # CSV不需要文件名参数
-            self.db_handler = handler_class(db_path)
-        else:
-            # 其他数据库类型需要文件名参数
-            if db_name is None:
+        # 预写日志：缓冲中的行情定期组提交到本地日志，崩溃后重启时重放；
+        # 日志段按flush顺序释放，因此要求批次按顺序写入且不丢弃
+        self.journal: Optional[TickJournal] = None
+        self._journal_segments: collections.deque = collections.deque()
+        if journal_dir is not None:
+            if async_mode and (writer_threads > 1
+                               or backpressure == BACKPRESSURE_DROP_OLDEST):
                 raise ValueError(
-                    f"Database type {db_type} requires a db_name parameter.")
-            self.db_handler = handler_class(db_path, db_name)
+                    "journal requires ordered writes: use a single writer "
+                    "thread and a backpressure other than drop_oldest")
+            journal_name = db_name or db_type
+            self._replay_journal(journal_dir, journal_name)
+            self.journal = TickJournal(journal_dir,
+                                       journal_name,
+                                       commit_interval=journal_commit_interval)
+
+        # 异步模式：缓冲区满时只把批次交给后台写线程，不在调用线程上落盘
+        self.writer: Optional[AsyncWriter] = None
+        if async_mode:
+            self.writer = AsyncWriter(self._save_queued,
+                                      queue_size=queue_size,
+                                      writer_threads=writer_threads,
+                                      backpressure=backpressure,
+                                      spill_dir=spill_dir,
+                                      thread_safe=self.db_handler.thread_safe,
+                                      name=f"DataCollector[{db_name or db_type}]")
 
+        # 多缓冲模式（buffer_count>=2，非异步模式时生效）：flush时换上空缓冲区，
+        # 满缓冲区交给单个写线程按提交顺序写入；同时在写的缓冲区最多buffer_count-1个，
+        # 全部在写时flush阻塞等待，保证内存有界
+        self._in_flight: Optional[threading.BoundedSemaphore] = None
+        if buffer_count < 1:
+            raise ValueError("buffer_count must be at least 1")
+        if writer_pool is not None and buffer_count > 1 and not async_mode:
+            # 两者都决定在写的缓冲区数，避免其中一个被静默忽略
+            raise ValueError(
+                "buffer_count cannot be combined with writer_pool: the pool's "
+                "queue_size limits the in-flight buffers per collector")
+        if writer_pool is not None and not async_mode:
+            # 共享写线程池：与其他交易所的收集器并发写入，本收集器的批次按提交顺序写入，
+            # 在写的缓冲区数由池的每队列深度限制
+            self.writer = writer_pool.writer(
+                self._save_queued, name=f"DataCollector[{db_name or db_type}]")
+        elif buffer_count > 1 and not async_mode:
+            self._in_flight = threading.BoundedSemaphore(buffer_count - 1)
+            self.writer = AsyncWriter(self._save_queued,
+                                      queue_size=buffer_count - 1,
+                                      writer_threads=1,
+                                      backpressure=BACKPRESSURE_BLOCK,
+                                      name=f"DataCollector[{db_name or db_type}]")
+
+        # 进程内共享的内存预算（有写入方时生效）：已flush未写完的批次超出预算时溢写到本地文件，
+        # 写入方空闲后按flush顺序回放；同步模式下flush即写入，不占用预算
+        self.memory_budget = memory_budget if self.writer is not None else None
+        self._spill_prefix = f"DataCollector_{db_name or db_type}"
+        self._spill: Optional[SpillFile] = None
+        self._spill_cond = threading.Condition()
+        # 已交给写入方尚未写完的记录数
+        self._reserved_records = 0
+        # 正在回放溢写批次，回放结束前新批次继续溢写
+        self._replaying = False
+        self._stop_replay = False
+
+        if async_mode:
+            mode_info = (f", async mode ({writer_threads} writer threads, "
+                         f"queue size {queue_size}, backpressure {backpressure})")
+        elif writer_pool is not None:
+            mode_info = f", shared writer pool (queue size {self.writer.queue_size})"
+        elif buffer_count > 1:
+            mode_info = f", {buffer_count} buffers"
+        else:
+            mode_info = ""
         main_logger.info(
             "DataCollector",
-            f"initialized with {db_type} database and buffer size {buffer_size}"
-        )
+            f"initialized with {db_type} database, {buffer_mode} buffer "
+            f"and buffer size {buffer_size}, {self.flush_policy}{mode_info}")
+
+        # 设置了存活时间上限时由进程内共享的定时线程检查刷新
+        if self.flush_policy.max_age is not None:
+            flush_timer.register(self)
 
-    def add_data(self, data: Dict[str, Any]) -> None:
-        """添加数据到缓冲区"""
-        self.buffer.append(data)
-        # print(f"buffer_length: {self.buffer_size}")
-        # 当缓冲区满时，保存数据
-        if len(self.buffer) >= self.buffer_size:
-            self.flush()
+    def add_data(self, data: Union[Tick, Dict[str, Any]]) -> None:
+        """添加数据（Tick或字典）到缓冲区"""
+        with self._lock:
+            if not len(self.buffer):
+                self._oldest = time.monotonic()
+            self.buffer.append(data)
+            if self.journal is not None:
+                self.journal.append(data)
+            # 当缓冲区达到记录数或字节数上限时，保存数据
+            if len(self.buffer) >= self._flush_records:
+                self._flush()
+
+    def flush_stale(self, now: float) -> None:
+        """缓冲区中最早的记录超过max_age时刷新（由定时线程调用）"""
+        with self._lock:
+            if (len(self.buffer)
+                    and now - self._oldest >= self.flush_policy.max_age):
+                self._flush()
+
+    def _take_buffer(self):
+        """取出缓冲区中的全部数据并换上空缓冲区"""
+        if self.buffer_mode == "columnar":
+            return self.buffer.take()
+        batch, self.buffer = self.buffer, []
+        return batch
+
+    def _restore_buffer(self, batch: Union[List[Any], TickBatch]) -> None:
+        """把同步写入失败的批次放回缓冲区最前面，下次flush时连同新数据一起重试"""
+        if self.buffer_mode == "columnar":
+            self.buffer.restore(batch)
+        else:
+            self.buffer[:0] = batch
 
     def flush(self) -> None:
         """将缓冲区中的数据写入数据库"""
-        if self.buffer:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not len(self.buffer):
+            return
+        if self.batch_sizer is not None:
+            self.batch_sizer.observe_arrival(len(self.buffer),
+                                             time.monotonic() - self._oldest)
+        if self.journal is not None:
+            # 缓冲区对应的日志段随批次按顺序交给写入方
+            self._journal_segments.append(self.journal.rotate())
+        if self.writer is not None:
+            # 交换出满缓冲区交给写线程，调用线程立即返回
+            batch = self._take_buffer()
+            if self.memory_budget is not None:
+                batch = self._admit(batch)
+                if batch is None:
+                    return
+            self._submit(batch)
+            return
+        main_logger.info("DataCollector",
+                         f"Flushing {len(self.buffer)} records to database")
+        batch = self._take_buffer()
+        try:
+            self._save(batch)
+        except Exception:
+            self._restore_buffer(batch)
+            raise
+        if self.journal is not None:
+            # 放回重试过的批次跨越多个日志段，写入成功后一并释放
+            while self._journal_segments:
+                self.journal.release(self._journal_segments.popleft())
+
+    def _submit(self, batch: Union[List[Any], TickBatch]) -> None:
+        if self._in_flight is not None:
+            # 多缓冲模式：所有缓冲区都在写时等待其中一个写完
+            self._in_flight.acquire()
+        self.writer.submit(batch)
+
+    def _spill_pending(self) -> bool:
+        return self._spill is not None and self._spill.pending > 0
+
+    def _admit(self, batch: Union[List[Any], TickBatch]
+               ) -> Optional[Union[List[Any], TickBatch]]:
+        """
+        按内存预算处理flush出的批次，返回应交给写入方的批次，None表示已溢写。
+        溢写文件有积压时新批次也溢写，保证按flush顺序写入
+        """
+        nbytes = len(batch) * MARKET_DATA_DTYPE.itemsize
+        with self._spill_cond:
+            if (not self._replaying and not self._spill_pending()
+                    and self.memory_budget.reserve(nbytes)):
+                self._reserved_records += len(batch)
+                return batch
+            if self._spill is None:
+                self._spill = self.memory_budget.spill_file(self._spill_prefix)
+            self._spill.append(batch)
+            self.memory_budget.count_spill(len(batch), nbytes)
+            # 写入方空闲时由本线程开始回放
+            return self._next_spilled()
+
+    def _next_spilled(self) -> Optional[Union[List[Any], TickBatch]]:
+        """写入方空闲时读回最早的溢写批次并强制预留内存（调用方持有_spill_cond）"""
+        if self._reserved_records or self._stop_replay:
+            return None
+        if not self._spill_pending():
+            self._replaying = False
+            return None
+        batch = self._spill.pop()
+        nbytes = len(batch) * MARKET_DATA_DTYPE.itemsize
+        self.memory_budget.count_spill(len(batch), -nbytes)
+        self.memory_budget.reserve(nbytes, force=True)
+        self._reserved_records += len(batch)
+        self._replaying = True
+        return batch
+
+    def _save_queued(self, data: Union[List[Any], TickBatch]) -> Optional[int]:
+        """
+        写入方调用：写入一个批次，归还其内存预算，写入方空闲时回放下一个溢写批次。
+        返回处理器实际写入的记录数（None表示全部写入）
+        """
+        try:
+            if self._in_flight is not None:
+                return self._save_in_flight(data)
+            return self._save_batch(data)
+        finally:
+            if self.memory_budget is not None:
+                self._release_budget(len(data))
+
+    def _release_budget(self, records: int) -> None:
+        self.memory_budget.release(records * MARKET_DATA_DTYPE.itemsize)
+        with self._spill_cond:
+            self._reserved_records -= records
+            batch = self._next_spilled()
+            self._spill_cond.notify_all()
+        if batch is not None:
+            # 此时写入队列为空，提交不会阻塞写线程
+            self._submit(batch)
+
+    def _drain_spill(self) -> None:
+        """close时停止回放，等写入方写完后在调用线程上按顺序写入剩余的溢写批次"""
+        with self._spill_cond:
+            self._stop_replay = True
+            self._spill_cond.wait_for(lambda: not self._reserved_records)
+        while self._spill_pending():
+            batch = self._spill.pop()
+            self.memory_budget.count_spill(
+                len(batch), -len(batch) * MARKET_DATA_DTYPE.itemsize)
+            try:
+                self._save_batch(batch)
+            except Exception as e:
+                main_logger.error(
+                    "DataCollector",
+                    f"Failed to write {len(batch)} spilled records: {e}")
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def _replay_journal(self, journal_dir: str, journal_name: str) -> None:
+        """把上次运行遗留在日志中的行情写入数据库，成功后删除对应日志段"""
+        for path, batch in TickJournal.replay(journal_dir, journal_name):
+            try:
+                self._save(batch)
+            except Exception as e:
+                main_logger.error(
+                    "DataCollector",
+                    f"Failed to replay journal {path}, keeping it: {e}")
+                continue
+            os.remove(path)
             main_logger.info(
                 "DataCollector",
-                f"Flushing {len(self.buffer)} records to database")
-            self.db_handler.save(self.buffer)
-            self.buffer.clear()
+                f"Replayed {len(batch)} journaled records from {path}")
+
+    def _save_batch(self, data: Union[List[Any], TickBatch]) -> Optional[int]:
+        """写入一个flush出的缓冲区，成功后释放其日志段（失败时保留，下次启动重放）"""
+        if self.journal is None:
+            return self._save(data)
+        segment_id = self._journal_segments.popleft()
+        written = self._save(data)
+        self.journal.release(segment_id)
+        return written
+
+    def _save(self, data: Union[List[Any], TickBatch]) -> Optional[int]:
+        """批量补充交易所时间戳后写入数据库（异步模式下在写线程上执行）"""
+        if self.batch_sizer is None:
+            return self.db_handler.save(stamp_epoch_ms(data))
+        start = time.perf_counter()
+        written = self.db_handler.save(stamp_epoch_ms(data))
+        self._flush_records = self.batch_sizer.observe_save(
+            len(data), time.perf_counter() - start)
+        return written
+
+    def _save_in_flight(self,
+                        data: Union[List[Any], TickBatch]) -> Optional[int]:
+        """多缓冲模式的写线程：写完后释放一个在写缓冲区名额"""
+        try:
+            return self._save_batch(data)
+        finally:
+            self._in_flight.release()
 
     def save(self, data: List[Dict[str, Any]]) -> None:
         """直接保存数据到数据库"""
-        self.db_handler.save(data)
+        self._save(data)
 
     def load(self,
              table_name: str,
-             limit: Optional[int] = None) -> pd.DataFrame:
-        """从数据库加载数据"""
-        return self.db_handler.load(table_name, limit)
+             limit: Optional[int] = None,
+             columns: Optional[List[str]] = None,
+             start_ms: Optional[int] = None,
+             end_ms: Optional[int] = None) -> pd.DataFrame:
+        """从数据库加载数据，可指定列和时间范围（epoch毫秒，左闭右开）"""
+        return self.db_handler.load(table_name, limit, columns, start_ms,
+                                    end_ms)
 
     def get_tables(self) -> List[str]:
         """获取数据库中的所有表名"""
         return self.db_handler.get_tables()
 
+    def get_stats(self) -> Dict[str, int]:
+        """
+        获取收集器计数器：缓冲区记录数，异步模式下还包括队列深度和丢弃记录数，
+        自适应批次大小时还包括当前批次大小、到达速率、写入耗时和调整次数，
+        使用内存预算时还包括已预留的记录数和溢写文件中的批次数，
+        扇出写入时sinks为各副本的写入统计
+        """
+        stats = {"buffered_records": len(self.buffer)}
+        if self.batch_sizer is not None:
+            stats.update(self.batch_sizer.stats())
+        if self.writer is not None:
+            stats.update(self.writer.stats())
+        if self.journal is not None:
+            stats.update(self.journal.stats())
+        if isinstance(self.db_handler, FanoutHandler):
+            stats["sinks"] = self.db_handler.stats()
+        if self.memory_budget is not None:
+            with self._spill_cond:
+                stats["budget_reserved_records"] = self._reserved_records
+                stats["budget_spill_depth"] = (self._spill.pending
+                                               if self._spill is not None else
+                                               0)
+        return stats
+
     def close(self) -> None:
         """关闭数据库连接，确保缓冲区中的数据被保存"""
+        flush_timer.unregister(self)
         self.flush()
+        if self.memory_budget is not None:
+            self._drain_spill()
+        if self.writer is not None:
+            self.writer.close()
+        if self.journal is not None:
+            # 所有批次已写完，最后一次提交时删除已释放的日志段
+            self.journal.close()
         self.db_handler.close()
         main_logger.info("DataCollector", "closed")
 
@@ -108,6 +530,7 @@ class DataCollector:
 def create_data_collector(db_type: str = "hdf5",
                           buffer_size: int = 128,
                           db_path: str = "db",
-                          db_name: str = None) -> DataCollector:
-    """创建数据收集器实例"""
-    return DataCollector(db_type, buffer_size, db_path, db_name)
+                          db_name: str = None,
+                          **kwargs) -> DataCollector:
+    """创建数据收集器实例，kwargs透传给DataCollector（如async_mode等）"""
+    return DataCollector(db_type, buffer_size, db_path, db_name, **kwargs)
@@ -0,0 +1,71 @@
+import pandas as pd
+from typing import Any, Dict, List, Optional, Union
+from db.buffer import TickBatch
+from db.interface import DatabaseInterface
+from db.writer import AsyncWriter, BACKPRESSURE_BLOCK
+
+
+class FanoutHandler(DatabaseInterface):
+    """
+    扇出处理器：同一个批次写入主处理器和多个副本处理器
+    主处理器在调用线程（收集器的写线程）上同步写入，load/get_tables都从主处理器读取；
+    每个副本有各自的写线程，主处理器写入成功后把同一个批次对象交给副本。副本共享的是
+    已补充epoch_ms的批次（列式缓冲区时为零拷贝的结构化数组），各处理器仍按自己的存储格式
+    编码（定长记录/DataFrame/Arrow等）。副本最多落后max_lag个批次，超过时按backpressure处理：block时等待该副本，
+    spill时溢写到本地文件不等待，drop_oldest时丢弃该副本最旧的批次。
+    副本写入失败只记录日志和failed_records，不影响主处理器
+    """
+
+    def __init__(self,
+                 primary: DatabaseInterface,
+                 sinks: Dict[str, DatabaseInterface],
+                 max_lag: int = 8,
+                 backpressure: str = BACKPRESSURE_BLOCK,
+                 spill_dir: Optional[str] = None):
+        if max_lag < 1:
+            raise ValueError("max_lag must be at least 1")
+        self.primary = primary
+        self.sinks = dict(sinks)
+        self.max_lag = max_lag
+        self.thread_safe = primary.thread_safe
+        self.writers = {
+            name: AsyncWriter(sink.save,
+                              queue_size=max_lag,
+                              writer_threads=1,
+                              backpressure=backpressure,
+                              spill_dir=spill_dir,
+                              thread_safe=sink.thread_safe,
+                              name=f"Sink[{name}]")
+            for name, sink in self.sinks.items()
+        }
+
+    def save(self, data: Union[List[Dict[str, Any]],
+                               TickBatch]) -> Optional[int]:
+        """同步写入主处理器，成功后交给各副本的写线程（主处理器失败时副本也不写入）"""
+        written = self.primary.save(data)
+        for writer in self.writers.values():
+            writer.submit(data)
+        return written
+
+    def load(self,
+             table_name: str,
+             limit: Optional[int] = None,
+             columns: Optional[List[str]] = None,
+             start_ms: Optional[int] = None,
+             end_ms: Optional[int] = None) -> pd.DataFrame:
+        return self.primary.load(table_name, limit, columns, start_ms, end_ms)
+
+    def get_tables(self) -> List[str]:
+        return self.primary.get_tables()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """各副本的写入统计，queue_depth为落后主处理器的批次数"""
+        return {name: writer.stats() for name, writer in self.writers.items()}
+
+    def close(self) -> None:
+        """等待各副本写完后关闭全部处理器"""
+        for writer in self.writers.values():
+            writer.close()
+        for sink in self.sinks.values():
+            sink.close()
+        self.primary.close()
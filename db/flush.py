@@ -0,0 +1,192 @@
+import threading
+import time
+from typing import Dict, Optional, Set
+from utils.logger import main_logger
+
+# 定时刷新线程的检查间隔上下限（秒）
+MIN_TICK_INTERVAL = 0.01
+MAX_TICK_INTERVAL = 1.0
+
+
+class FlushPolicy:
+    """
+    缓冲区刷新策略
+    记录数、估算字节数、最早一条缓冲记录的存活时间任一达到上限即刷新，为None的限制不生效。
+    记录数和字节数在追加时检查，存活时间由进程内唯一的FlushTimer定时检查
+    """
+
+    def __init__(self,
+                 max_records: Optional[int] = 128,
+                 max_bytes: Optional[int] = None,
+                 max_age: Optional[float] = None):
+        for name, value in (("max_records", max_records),
+                            ("max_bytes", max_bytes), ("max_age", max_age)):
+            if value is not None and value <= 0:
+                raise ValueError(f"{name} must be positive")
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def record_limit(self, record_bytes: int) -> Optional[int]:
+        """
+        把记录数和字节数上限换算为单一的记录数上限（每条记录record_bytes字节），
+        追加时只需比较一次长度
+        """
+        limits = []
+        if self.max_records is not None:
+            limits.append(self.max_records)
+        if self.max_bytes is not None:
+            limits.append(max(1, self.max_bytes // max(1, record_bytes)))
+        return min(limits) if limits else None
+
+    def __repr__(self) -> str:
+        return (f"FlushPolicy(max_records={self.max_records}, "
+                f"max_bytes={self.max_bytes}, max_age={self.max_age})")
+
+
+class AdaptiveBatchSizer:
+    """
+    自适应批次大小
+    根据每次写入的实测耗时调整批次记录数，使单次写入耗时接近target_latency：
+    耗时明显高于目标时按比例缩小，明显低于目标时按比例放大，每次最多翻倍或减半。
+    批次大小限制在[min_records, max_records]内，并且不超过内存上限；
+    设置了max_age时也不超过max_age内按到达速率能攒满的记录数（更大的批次总是被定时刷新）
+    """
+
+    # 耗时在目标的±25%以内时不调整
+    TOLERANCE = 0.25
+    # 到达速率的指数平滑系数
+    SMOOTHING = 0.2
+
+    def __init__(self,
+                 min_records: int = 16,
+                 max_records: int = 8192,
+                 target_latency: float = 0.05):
+        if min_records < 1 or max_records < min_records:
+            raise ValueError(
+                "batch size bounds must satisfy 1 <= min_records <= max_records")
+        if target_latency <= 0:
+            raise ValueError("target_latency must be positive")
+        self.min_records = min_records
+        self.max_records = max_records
+        self.target_latency = target_latency
+        self.batch_size = min_records
+        # 内存上限和max_age换算出的记录数上限，由收集器根据刷新策略设置
+        self.limit: Optional[int] = None
+        self.max_age: Optional[float] = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "arrival_rate": 0.0,  # 记录/秒，指数平滑
+            "flush_latency_ms": 0.0,  # 最近一次写入耗时
+            "batch_grows": 0,
+            "batch_shrinks": 0,
+        }
+
+    def start(self, batch_size: int, limit: Optional[int],
+              max_age: Optional[float]) -> int:
+        """设置初始批次大小和上限，返回调整到范围内的初始批次大小"""
+        self.limit = limit
+        self.max_age = max_age
+        self.batch_size = self._clamp(batch_size)
+        return self.batch_size
+
+    def _clamp(self, size: float) -> int:
+        upper = self.max_records
+        if self.limit is not None:
+            upper = min(upper, self.limit)
+        rate = self._stats["arrival_rate"]
+        if self.max_age is not None and rate > 0:
+            upper = min(upper, int(rate * self.max_age) + 1)
+        return int(max(self.min_records, min(upper, size)))
+
+    def observe_arrival(self, records: int, seconds: float) -> None:
+        """记录一个批次从第一条到刷新经过的时间，更新到达速率"""
+        if records <= 0 or seconds <= 0:
+            return
+        with self._lock:
+            rate = records / seconds
+            previous = self._stats["arrival_rate"]
+            self._stats["arrival_rate"] = (rate if previous == 0 else
+                                           previous + self.SMOOTHING *
+                                           (rate - previous))
+
+    def observe_save(self, records: int, seconds: float) -> int:
+        """记录一次写入的记录数和耗时，返回调整后的批次大小"""
+        with self._lock:
+            self._stats["flush_latency_ms"] = seconds * 1000
+            size = self.batch_size
+            if records > 0 and seconds > 0:
+                # 按实际写入的记录数估算目标耗时对应的记录数，未满的批次（定时刷新）同样适用
+                ratio = self.target_latency / seconds
+                if ratio > 1 + self.TOLERANCE:
+                    size = min(size * 2, max(size, records * ratio))
+                elif ratio < 1 - self.TOLERANCE:
+                    size = max(size / 2, min(size, records * ratio))
+            size = self._clamp(size)
+            if size > self.batch_size:
+                self._stats["batch_grows"] += 1
+            elif size < self.batch_size:
+                self._stats["batch_shrinks"] += 1
+            self.batch_size = size
+            return size
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["batch_size"] = self.batch_size
+        return stats
+
+
+class FlushTimer:
+    """
+    进程内唯一的定时刷新线程
+    周期性检查所有注册的收集器，刷新存活时间超过各自max_age的缓冲区；
+    检查间隔为注册收集器中最小max_age的一半，因此数据最长延迟约为1.5倍max_age。
+    没有注册的收集器时线程退出，再次注册时重新启动
+    """
+
+    def __init__(self):
+        self._collectors: Set = set()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def _interval(self) -> float:
+        ages = [collector.flush_policy.max_age for collector in self._collectors]
+        return min(MAX_TICK_INTERVAL, max(MIN_TICK_INTERVAL, min(ages) / 2))
+
+    def register(self, collector) -> None:
+        """注册收集器，其flush_policy.max_age必须已设置"""
+        with self._cond:
+            self._collectors.add(collector)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="FlushTimer",
+                                                daemon=True)
+                self._thread.start()
+            # 唤醒线程按新的最小max_age调整检查间隔
+            self._cond.notify()
+
+    def unregister(self, collector) -> None:
+        with self._cond:
+            self._collectors.discard(collector)
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._collectors:
+                    self._thread = None
+                    return
+                self._cond.wait(self._interval())
+                collectors = list(self._collectors)
+            now = time.monotonic()
+            for collector in collectors:
+                try:
+                    collector.flush_stale(now)
+                except Exception as e:
+                    main_logger.error("FlushTimer",
+                                      f"Failed to flush stale buffer: {e}")
+
+
+# 进程内共享的定时刷新线程
+flush_timer = FlushTimer()
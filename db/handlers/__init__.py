@@ -1,5 +1,12 @@
 from db.handlers.csv import CSVHandler
 from db.handlers.sqlite import SQLiteHandler
 from db.handlers.hdf5 import HDF5Handler
+from db.handlers.parquet import ParquetHandler
+from db.handlers.memmap import MemmapHandler
+from db.handlers.splayed import SplayedHandler
+from db.handlers.compressed import CompressedHandler
 
-__all__ = ['CSVHandler', 'SQLiteHandler', 'HDF5Handler']
+__all__ = [
+    'CSVHandler', 'SQLiteHandler', 'HDF5Handler', 'ParquetHandler',
+    'MemmapHandler', 'SplayedHandler', 'CompressedHandler'
+]
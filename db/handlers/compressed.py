@@ -0,0 +1,202 @@
+import glob
+import os
+import struct
+import threading
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional, Tuple, Union
+from db.buffer import TickBatch, group_by_instrument
+from db.codec import decode_block, encode_block
+from db.handlers.memmap import (RECORD_DTYPE, pack_records, records_to_frame,
+                                split_records)
+from db.interface import DatabaseInterface
+from model.market_data import TIMESTAMP_COLUMN
+from utils.logger import main_logger
+
+# 数据块头：魔数、记录数、数据长度、块内首末epoch毫秒（按时间范围读取时据此跳过整块）
+# 魔数区分盘口是否为增量编码，同一文件中两种数据块可以混合
+BLOCK_MAGIC = b"TKZ1"
+DEPTH_BLOCK_MAGIC = b"TKZ2"
+_BLOCK_HEADER = struct.Struct("<4sIIqq")
+FILE_EXTENSION = ".tkz"
+
+
+def read_block_index(
+        path: str) -> List[Tuple[int, int, int, int, int, bool]]:
+    """
+    读取文件中各数据块的
+    (数据偏移, 数据长度, 记录数, 首条epoch毫秒, 末条epoch毫秒, 盘口是否增量编码)
+    末尾不完整的数据块会被忽略
+    """
+    index = []
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        offset = 0
+        while offset + _BLOCK_HEADER.size <= size:
+            f.seek(offset)
+            magic, count, length, first_ms, last_ms = _BLOCK_HEADER.unpack(
+                f.read(_BLOCK_HEADER.size))
+            data_offset = offset + _BLOCK_HEADER.size
+            if (magic not in (BLOCK_MAGIC, DEPTH_BLOCK_MAGIC)
+                    or data_offset + length > size):
+                break
+            index.append((data_offset, length, count, first_ms, last_ms,
+                          magic == DEPTH_BLOCK_MAGIC))
+            offset = data_offset + length
+    return index
+
+
+class CompressedHandler(DatabaseInterface):
+    """
+    压缩行情文件实现
+    每个合约每个交易日一个文件（交易日/合约.tkz），每次flush按列编码为一个数据块追加：
+    时间戳二阶差分、价格按最小变动量化后差分（无法量化时与前值异或）、成交量差分，
+    均为变长整数；读取时按块头跳过时间范围外的块，向量化解码需要的列。
+    depth_delta=True时五档盘口改为增量编码：每snapshot_interval条保存一次全部盘口，
+    其余记录只保存变化字段的位掩码和新值
+    """
+
+    def __init__(self,
+                 db_path: str = "db",
+                 depth_delta: bool = False,
+                 snapshot_interval: int = 100):
+        self.db_path = db_path
+        os.makedirs(db_path, exist_ok=True)
+        self.snapshot_interval = (max(1, snapshot_interval)
+                                  if depth_delta else None)
+        # (合约, 交易日) -> 追加写入的文件
+        self._files: Dict[Tuple[str, str], Any] = {}
+        # 合约 -> 当前交易日，交易日切换时关闭旧文件
+        self._trading_days: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _path_of(self, instrument_id: str, trading_day: str) -> str:
+        return os.path.join(self.db_path, trading_day,
+                            instrument_id + FILE_EXTENSION)
+
+    def _open(self, instrument_id: str, trading_day: str):
+        """获取合约当日文件的追加句柄"""
+        key = (instrument_id, trading_day)
+        f = self._files.get(key)
+        if f is not None:
+            return f
+        # 交易日切换，关闭旧交易日的文件
+        previous_day = self._trading_days.get(instrument_id)
+        if previous_day is not None and previous_day != trading_day:
+            old = self._files.pop((instrument_id, previous_day), None)
+            if old is not None:
+                old.close()
+        self._trading_days[instrument_id] = trading_day
+
+        path = self._path_of(instrument_id, trading_day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            # 截掉上次异常退出时残留的不完整数据块
+            index = read_block_index(path)
+            whole = index[-1][0] + index[-1][1] if index else 0
+            if os.path.getsize(path) != whole:
+                main_logger.error(
+                    "CompressedHandler",
+                    f"Truncating {os.path.getsize(path) - whole} bytes of "
+                    f"partial block in {path}")
+                os.truncate(path, whole)
+        f = open(path, "ab")
+        self._files[key] = f
+        return f
+
+    def save(self, data: Union[List[Dict[str, Any]], TickBatch]) -> None:
+        if not len(data):
+            return
+        with self._lock:
+            for instrument_id, rows in group_by_instrument(
+                    data, "CompressedHandler").items():
+                for trading_day, part in split_records(pack_records(rows)):
+                    epoch_ms = part[TIMESTAMP_COLUMN]
+                    payload = encode_block(part, TIMESTAMP_COLUMN,
+                                           self.snapshot_interval)
+                    magic = (DEPTH_BLOCK_MAGIC
+                             if self.snapshot_interval else BLOCK_MAGIC)
+                    f = self._open(instrument_id, trading_day)
+                    f.write(
+                        _BLOCK_HEADER.pack(magic, len(part),
+                                           len(payload), int(epoch_ms.min()),
+                                           int(epoch_ms.max())) + payload)
+                    f.flush()
+
+    def _files_of(self, instrument_id: str) -> List[str]:
+        """合约所有交易日的文件，按交易日排序"""
+        return sorted(
+            glob.glob(
+                os.path.join(self.db_path, "*",
+                             instrument_id + FILE_EXTENSION)))
+
+    def load(self,
+             table_name: str,
+             limit: Optional[int] = None,
+             columns: Optional[List[str]] = None,
+             start_ms: Optional[int] = None,
+             end_ms: Optional[int] = None) -> pd.DataFrame:
+        files = self._files_of(table_name)
+        if not files:
+            raise KeyError(f"Table {table_name} not found")
+
+        # 先根据块头筛选需要解码的数据块
+        blocks = []
+        for path in files:
+            for (data_offset, length, count, first_ms, last_ms,
+                 depth_delta) in read_block_index(path):
+                if start_ms is not None and last_ms < start_ms:
+                    continue
+                if end_ms is not None and first_ms >= end_ms:
+                    continue
+                blocks.append((path, data_offset, length, count, depth_delta))
+
+        time_range = start_ms is not None or end_ms is not None
+        decode_columns = None
+        if columns:
+            decode_columns = set(columns)
+            if time_range:
+                decode_columns.add(TIMESTAMP_COLUMN)
+
+        slices = []
+        rows = 0
+        # 只取最后limit行时从最后一个数据块向前解码
+        for path, data_offset, length, count, depth_delta in (
+                reversed(blocks) if limit else blocks):
+            with open(path, "rb") as f:
+                f.seek(data_offset)
+                data = f.read(length)
+            records = decode_block(data, RECORD_DTYPE, count, decode_columns,
+                                   depth_delta)
+            if time_range:
+                epoch_ms = records[TIMESTAMP_COLUMN]
+                mask = np.ones(len(records), dtype=bool)
+                if start_ms is not None:
+                    mask &= epoch_ms >= start_ms
+                if end_ms is not None:
+                    mask &= epoch_ms < end_ms
+                records = records[mask]
+            if limit:
+                records = records[max(len(records) - (limit - rows), 0):]
+                slices.insert(0, records)
+            else:
+                slices.append(records)
+            rows += len(records)
+            if limit and rows >= limit:
+                break
+
+        return records_to_frame(slices, columns)
+
+    def get_tables(self) -> List[str]:
+        tables = set()
+        for path in glob.glob(
+                os.path.join(self.db_path, "*", "*" + FILE_EXTENSION)):
+            tables.add(os.path.basename(path)[:-len(FILE_EXTENSION)])
+        return sorted(tables)
+
+    def close(self) -> None:
+        # 关闭所有追加写入的文件
+        with self._lock:
+            for f in self._files.values():
+                f.close()
+            self._files.clear()
@@ -1,76 +1,162 @@
+import csv
+import io
 import os
+import threading
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Any, Optional
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Union
+from db.buffer import TickBatch, group_by_instrument, select_frames
 from db.interface import DatabaseInterface
+from db.partition import exchange_of, symbol_of
+from model.market_data import MARKET_DATA_FIELDS, Tick
 from utils.logger import main_logger
 
+# 分块读取CSV时每块的行数
+READ_CHUNK_ROWS = 50000
+# 从文件末尾向前查找最后N行时每次读取的字节数
+TAIL_BLOCK_SIZE = 64 * 1024
+# 行情字段的固定表头
+_TICK_FIELDS = list(MARKET_DATA_FIELDS)
+
+
+def _fields_of(rows: Union[List[Any], np.ndarray]) -> List[str]:
+    """新文件的表头：行情记录使用固定字段，字典使用首条记录的键"""
+    if isinstance(rows, np.ndarray):
+        return list(rows.dtype.names)
+    if isinstance(rows[0], Tick):
+        return _TICK_FIELDS
+    return list(rows[0].keys())
+
+
+def _row_values(rows: Union[List[Any], np.ndarray],
+                fields: List[str]) -> Iterable[Any]:
+    """按表头字段顺序生成每行的值"""
+    if isinstance(rows, np.ndarray):
+        names = rows.dtype.names
+        if list(names) == fields:
+            return rows.tolist()
+        columns = [rows[field].tolist() if field in names else
+                   [""] * len(rows) for field in fields]
+        return zip(*columns)
+    if isinstance(rows[0], Tick):
+        if fields == _TICK_FIELDS:
+            # Tick本身就是按字段顺序排列的元组
+            return rows
+        rows = [row._asdict() for row in rows]
+    return ([row.get(field, "") for field in fields] for row in rows)
+
+
+class _CSVFile:
+    """一个合约CSV文件的追加句柄及其表头字段"""
+
+    def __init__(self, path: str, fields: List[str]):
+        self.file = open(path, 'a', newline='')
+        # 与pandas to_csv写出的已有文件一致，使用LF换行
+        self.writer = csv.writer(self.file, lineterminator="\n")
+        self.fields = fields
+
 
 class CSVHandler(DatabaseInterface):
-    """CSV文件数据库实现"""
+    """
+    CSV文件数据库实现
+    合约文件路径解析后缓存，追加句柄放在LRU池中复用，超过max_open_files时关闭最久未用的句柄；
+    行数据由csv模块直接序列化，不经过DataFrame
+    """
 
-    def __init__(self, db_path: str = "db"):
+    # 句柄池自带锁，多个写线程可以直接并发调用save
+    thread_safe = True
+
+    def __init__(self, db_path: str = "db", max_open_files: int = 256):
         self.db_path = db_path
         os.makedirs(db_path, exist_ok=True)
+        self.max_open_files = max(1, max_open_files)
+        # 合约 -> 文件路径（目录已创建）
+        self._paths: Dict[str, str] = {}
+        # 合约 -> 打开的追加句柄，按最近使用排序
+        self._files: "OrderedDict[str, _CSVFile]" = OrderedDict()
+        # 多个写线程共用句柄池，需要加锁
+        self._lock = threading.Lock()
+
+    @property
+    def open_files(self) -> int:
+        """当前打开的文件句柄数"""
+        return len(self._files)
 
-    def save(self, data: List[Dict[str, Any]]) -> None:
-        if not data:
-            return
-        # 按InstrumentID分组数据
-        data_by_instrument = {}
-        for item in data:
-            # 检查InstrumentID是否存在
-            instrument_id = item.get("InstrumentID")
-            if not instrument_id:
-                main_logger.error("CSVHandler", f"缺失InstrumentID的记录: {item}")
-                continue
-            if instrument_id not in data_by_instrument:
-                data_by_instrument[instrument_id] = []
-            data_by_instrument[instrument_id].append(item)
-        # 为每个InstrumentID单独保存
-        import controller.tools
-        # 确保contract_exchange_map已初始化
-        if controller.tools.contract_exchange_map is None:
-            controller.tools.init_contract_exchange_map()
-        for instrument_id, instrument_data in data_by_instrument.items():
-            # 获取合约对应的交易所，必须存在于instrument.yml中
-            exchange = controller.tools.contract_exchange_map.get(
-                instrument_id)
-            if not exchange:
-                main_logger.error("CSVHandler",
-                                  f"合约{instrument_id}不在instrument.yml配置中")
-                continue
-            # 提取品种前缀（字母部分）作为目录名
-            symbol = ''.join([c for c in instrument_id if c.isalpha()])
-            if not symbol:
-                main_logger.error("CSVHandler", f"合约{instrument_id}无法提取品种前缀")
-                continue
-            # 创建交易所目录
-            exchange_path = os.path.join(self.db_path, exchange)
-            os.makedirs(exchange_path, exist_ok=True)
-            # 创建品种目录
-            symbol_path = os.path.join(exchange_path, symbol)
-            os.makedirs(symbol_path, exist_ok=True)
-            # 创建合约文件
-            file_path = os.path.join(symbol_path, f"{instrument_id}.csv")
-            df = pd.DataFrame(instrument_data)
-            # 如果文件不存在，写入表头
-            if not os.path.exists(file_path):
-                df.to_csv(file_path, index=False, header=True)
-            else:
-                df.to_csv(file_path, index=False, header=False, mode='a')
+    def _resolve_path(self, instrument_id: str) -> Optional[str]:
+        """解析合约文件路径并创建目录，结果缓存"""
+        file_path = self._paths.get(instrument_id)
+        if file_path is not None:
+            return file_path
+        exchange = exchange_of(instrument_id, "CSVHandler")
+        if not exchange:
+            return None
+        # 品种前缀作为目录名
+        symbol = symbol_of(instrument_id)
+        if not symbol:
+            main_logger.error("CSVHandler", f"合约{instrument_id}无法提取品种前缀")
+            return None
+        # 创建交易所/品种目录
+        symbol_path = os.path.join(self.db_path, exchange, symbol)
+        os.makedirs(symbol_path, exist_ok=True)
+        file_path = os.path.join(symbol_path, f"{instrument_id}.csv")
+        self._paths[instrument_id] = file_path
+        return file_path
+
+    def _get_file(self, instrument_id: str, file_path: str,
+                  rows: Union[List[Any], np.ndarray]) -> _CSVFile:
+        """从句柄池中取出合约文件，必要时打开并关闭最久未用的句柄"""
+        csv_file = self._files.get(instrument_id)
+        if csv_file is not None:
+            self._files.move_to_end(instrument_id)
+            return csv_file
+        while len(self._files) >= self.max_open_files:
+            _, evicted = self._files.popitem(last=False)
+            evicted.file.close()
+        if os.path.exists(file_path) and os.path.getsize(file_path):
+            # 已有文件沿用其表头
+            with open(file_path, newline='') as f:
+                fields = next(csv.reader(f))
+            csv_file = _CSVFile(file_path, fields)
+        else:
+            # 新文件写入表头
+            fields = _fields_of(rows)
+            csv_file = _CSVFile(file_path, fields)
+            csv_file.writer.writerow(fields)
+        self._files[instrument_id] = csv_file
+        return csv_file
+
+    def save(self, data: Union[List[Dict[str, Any]], TickBatch]) -> int:
+        """返回实际写入的记录数，不在instrument.yml中的合约被跳过"""
+        written = 0
+        if not len(data):
+            return written
+        with self._lock:
+            # 为每个InstrumentID单独保存
+            for instrument_id, rows in group_by_instrument(
+                    data, "CSVHandler").items():
+                file_path = self._resolve_path(instrument_id)
+                if file_path is None:
+                    continue
+                csv_file = self._get_file(instrument_id, file_path, rows)
+                csv_file.writer.writerows(_row_values(rows, csv_file.fields))
+                # 每次flush后把数据刷到文件，使读取方可见
+                csv_file.file.flush()
+                written += len(rows)
+        return written
 
     def load(self,
              table_name: str,
-             limit: Optional[int] = None) -> pd.DataFrame:
+             limit: Optional[int] = None,
+             columns: Optional[List[str]] = None,
+             start_ms: Optional[int] = None,
+             end_ms: Optional[int] = None) -> pd.DataFrame:
         # 获取合约对应的交易所，必须存在于instrument.yml中
-        from controller.tools import contract_exchange_map
-        exchange = contract_exchange_map.get(table_name)
+        exchange = exchange_of(table_name, "CSVHandler")
         if not exchange:
-            main_logger.error("CSVHandler",
-                              f"合约{table_name}不在instrument.yml配置中")
             raise ValueError(f"合约{table_name}不在instrument.yml配置中")
         # 提取品种前缀（字母部分）作为目录名
-        symbol = ''.join([c for c in table_name if c.isalpha()])
+        symbol = symbol_of(table_name)
         if not symbol:
             main_logger.error("CSVHandler", f"合约{table_name}无法提取品种前缀")
             raise ValueError(f"合约{table_name}无法提取品种前缀")
@@ -80,11 +166,48 @@ class CSVHandler(DatabaseInterface):
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"Table {table_name} not found")
 
-        df = pd.read_csv(file_path)
-        if limit:
-            df = df.tail(limit)
+        time_range = start_ms is not None or end_ms is not None
+        if limit and not time_range:
+            # 只取最后N行：从文件末尾向前定位，只解析表头和这N行
+            return self._read_tail(file_path, limit, columns)
+
+        # 分块读取，只保留需要的行和列，内存占用与文件大小无关
+        chunks = pd.read_csv(file_path,
+                             usecols=None if time_range else columns,
+                             chunksize=READ_CHUNK_ROWS)
+        return select_frames(chunks,
+                             limit=limit,
+                             columns=columns,
+                             start_ms=start_ms,
+                             end_ms=end_ms)
 
-        return df
+    @staticmethod
+    def _read_tail(file_path: str,
+                   limit: int,
+                   columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """从文件末尾向前按块读取，直到找到最后limit行"""
+        with open(file_path, 'rb') as f:
+            header = f.readline()
+            header_end = f.tell()
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            blocks = []
+            newlines = 0
+            # 末尾的换行符也会被计数，多找一行才能保证第一行完整
+            while position > header_end and newlines <= limit:
+                size = min(TAIL_BLOCK_SIZE, position - header_end)
+                position -= size
+                f.seek(position)
+                block = f.read(size)
+                blocks.append(block)
+                newlines += block.count(b"\n")
+        data = b"".join(reversed(blocks))
+        if position > header_end:
+            # 没有读到表头处，丢弃第一行不完整的部分
+            data = data[data.index(b"\n") + 1:]
+        lines = data.splitlines(keepends=True)[-limit:]
+        return pd.read_csv(io.BytesIO(header + b"".join(lines)),
+                           usecols=columns)
 
     def get_tables(self) -> List[str]:
         tables = []
@@ -101,5 +224,8 @@ class CSVHandler(DatabaseInterface):
         return tables
 
     def close(self) -> None:
-        # CSV不需要关闭连接
-        pass
+        # 关闭句柄池中的所有文件
+        with self._lock:
+            for csv_file in self._files.values():
+                csv_file.file.close()
+            self._files.clear()
@@ -1,64 +1,251 @@
 import os
+import threading
+import time
 import pandas as pd
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Set, Union
+from db.buffer import (TickBatch, iter_instrument_frames, select_frames,
+                       trading_day_of)
 from db.interface import DatabaseInterface
+from model.market_data import TIMESTAMP_COLUMN, tick_epoch_ms
 from utils.logger import main_logger
 
+# 按时间范围分块扫描时每块的行数
+READ_CHUNK_ROWS = 50000
+# data_columns索引的优化级别和类型（PyTables默认值）
+INDEX_OPTLEVEL = 6
+INDEX_KIND = "medium"
+
 
 class HDF5Handler(DatabaseInterface):
-    """HDF5数据库实现"""
+    """
+    HDF5数据库实现
+    keep_open=True时HDFStore在收集器生命周期内保持打开，
+    按记录数/时间间隔刷新到磁盘，交易日切换时自动重新打开。
+    支持压缩（complib/complevel）、按预期行数设置分块（expected_rows），
+    以及声明data_columns并在这些列上建立索引，供按条件选择性读取。
+    data_columns默认为epoch_ms，传入空列表则不建立索引；追加时不重建索引，
+    每个节点在关闭（含交易日切换）时建立一次，之后的追加由PyTables增量更新
+    """
 
-    def __init__(self, db_path: str, db_name: str):
+    def __init__(self,
+                 db_path: str,
+                 db_name: str,
+                 keep_open: bool = False,
+                 flush_records: int = 10000,
+                 flush_interval: float = 5.0,
+                 complib: Optional[str] = None,
+                 complevel: int = 0,
+                 expected_rows: Optional[int] = None,
+                 data_columns: Optional[List[str]] = None):
         self.db_path = db_path
         os.makedirs(db_path, exist_ok=True)
         # 为HDF5文件添加.h5扩展名
         if not db_name.endswith('.h5'):
             db_name += '.h5'
         self.db_file = os.path.join(db_path, db_name)
+        self.keep_open = keep_open
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        # 压缩、分块和索引列仅在新建节点时生效
+        self.complib = complib
+        self.complevel = complevel if complib else 0
+        self.expected_rows = expected_rows
+        self.data_columns = (list(data_columns) if data_columns is not None
+                             else [TIMESTAMP_COLUMN]) or None
+        # 节点 -> 已有表的列，追加时丢弃旧表中没有的列（如后来新增的字段）
+        self._table_columns: Dict[str, List[str]] = {}
+        # 上次建立索引后追加过数据的节点
+        self._unindexed: Set[str] = set()
+        self._store: Optional[pd.HDFStore] = None
+        # 写线程和查询线程共用打开的store，需要加锁
+        self._lock = threading.RLock()
+        self._unflushed_records = 0
+        self._last_flush_time = time.monotonic()
+        self._trading_day: Optional[str] = None
+
+    def _open_store(self) -> pd.HDFStore:
+        """获取长期打开的store，首次使用时打开"""
+        if self._store is None or not self._store.is_open:
+            self._store = pd.HDFStore(self.db_file, mode='a')
+            self._last_flush_time = time.monotonic()
+        return self._store
 
-    def save(self, data: List[Dict[str, Any]]) -> None:
-        if not data:
+    def _close_store(self) -> None:
+        if self._store is not None and self._store.is_open:
+            self._create_indexes(self._store)
+            self._store.close()
+        self._store = None
+        self._unflushed_records = 0
+
+    def _check_rollover(self, data: Union[List[Any], TickBatch]) -> None:
+        """
+        交易日切换时关闭并重新打开store
+        只在交易日前进时切换：郑商所夜盘的TradingDay为自然日，与其他交易所的下一交易日混在同一批次中，
+        批次最后一条记录的TradingDay来回变化不应反复关闭store
+        """
+        trading_day = trading_day_of(data)
+        if not trading_day:
+            return
+        if self._trading_day is not None and trading_day <= self._trading_day:
             return
+        if self._trading_day is not None:
+            main_logger.info(
+                "HDF5Handler",
+                f"Trading day changed {self._trading_day} -> {trading_day}, "
+                f"reopening {self.db_file}")
+            self._close_store()
+        self._trading_day = trading_day
 
-        # 按InstrumentID分组数据
-        data_by_instrument = {}
-        for item in data:
-            # 检查InstrumentID是否存在
-            instrument_id = item.get("InstrumentID")
-            if not instrument_id:
-                main_logger.error("HDF5Handler", f"缺失InstrumentID的记录: {item}")
+    def _maybe_flush(self, records: int) -> None:
+        """按记录数或时间间隔把store刷新到磁盘"""
+        self._unflushed_records += records
+        now = time.monotonic()
+        if (self._unflushed_records >= self.flush_records
+                or now - self._last_flush_time >= self.flush_interval):
+            self._store.flush()
+            self._unflushed_records = 0
+            self._last_flush_time = now
+
+    def _create_indexes(self, store: pd.HDFStore) -> None:
+        """为追加过数据的节点在data_columns上建立索引（已有相同索引时不重建）"""
+        for key in sorted(self._unindexed):
+            if key not in store:
                 continue
-            if instrument_id not in data_by_instrument:
-                data_by_instrument[instrument_id] = []
-            data_by_instrument[instrument_id].append(item)
+            # 旧版本创建的节点可能没有声明这些data_columns
+            declared = store.get_storer(key).data_columns or []
+            columns = [
+                column for column in self.data_columns if column in declared
+            ]
+            if columns:
+                store.create_table_index(key,
+                                         columns=columns,
+                                         optlevel=INDEX_OPTLEVEL,
+                                         kind=INDEX_KIND)
+        self._unindexed.clear()
+
+    def _prepare_frame(self, store: pd.HDFStore, key: str,
+                       df: pd.DataFrame) -> pd.DataFrame:
+        """补充尚未计算的时间戳列，并对齐到已有表的列"""
+        if (TIMESTAMP_COLUMN not in df.columns and "ActionDay" in df.columns
+                and "UpdateTime" in df.columns
+                and "UpdateMillisec" in df.columns):
+            df[TIMESTAMP_COLUMN] = tick_epoch_ms(df["ActionDay"],
+                                                 df["UpdateTime"],
+                                                 df["UpdateMillisec"])
+        columns = self._table_columns.get(key)
+        if columns is None and key in store:
+            storer = store.get_storer(key)
+            columns = [
+                column for axis in storer.non_index_axes
+                for column in axis[1]
+            ]
+            self._table_columns[key] = columns
+        if columns is not None and list(df.columns) != columns:
+            df = df[[column for column in columns if column in df.columns]]
+        return df
 
+    def _append(self, store: pd.HDFStore,
+                data: Union[List[Any], TickBatch]) -> None:
         # 为每个InstrumentID单独保存数据
-        with pd.HDFStore(self.db_file, mode='a') as store:
-            for instrument_id, instrument_data in data_by_instrument.items():
-                df = pd.DataFrame(instrument_data)
-                # 写入HDF5文件
-                store.append(instrument_id, df, format='table', append=True)
+        for instrument_id, df in iter_instrument_frames(data, "HDF5Handler"):
+            # 写入HDF5文件，索引在关闭时统一建立，避免每次追加都重建
+            store.append(instrument_id,
+                         self._prepare_frame(store, instrument_id, df),
+                         format='table',
+                         append=True,
+                         complib=self.complib,
+                         complevel=self.complevel,
+                         expectedrows=self.expected_rows,
+                         data_columns=self.data_columns,
+                         index=False)
+            if self.data_columns:
+                self._unindexed.add(instrument_id)
+
+    def save(self, data: Union[List[Dict[str, Any]], TickBatch]) -> None:
+        if not len(data):
+            return
+
+        if not self.keep_open:
+            # 每次flush打开并关闭文件
+            with pd.HDFStore(self.db_file, mode='a') as store:
+                self._append(store, data)
+            return
+
+        with self._lock:
+            self._check_rollover(data)
+            self._append(self._open_store(), data)
+            self._maybe_flush(len(data))
 
     def load(self,
              table_name: str,
-             limit: Optional[int] = None) -> pd.DataFrame:
-        with pd.HDFStore(self.db_file, mode='r') as store:
-            if table_name not in store:
-                raise KeyError(f"Table {table_name} not found")
+             limit: Optional[int] = None,
+             columns: Optional[List[str]] = None,
+             start_ms: Optional[int] = None,
+             end_ms: Optional[int] = None) -> pd.DataFrame:
+        with self._lock:
+            if self._store is not None and self._store.is_open:
+                # 复用已打开的store，读到的数据包含尚未flush的部分
+                return self._read(self._store, table_name, limit, columns,
+                                  start_ms, end_ms)
+            with pd.HDFStore(self.db_file, mode='r') as store:
+                return self._read(store, table_name, limit, columns,
+                                  start_ms, end_ms)
 
-            df = store[table_name]
+    @staticmethod
+    def _read(store: pd.HDFStore,
+              table_name: str,
+              limit: Optional[int] = None,
+              columns: Optional[List[str]] = None,
+              start_ms: Optional[int] = None,
+              end_ms: Optional[int] = None) -> pd.DataFrame:
+        if table_name not in store:
+            raise KeyError(f"Table {table_name} not found")
+
+        storer = store.get_storer(table_name)
+        if start_ms is None and end_ms is None:
+            # 按行号只读取最后limit行
+            start = max(storer.nrows - limit, 0) if limit else None
+            return store.select(table_name, start=start, columns=columns)
+
+        if TIMESTAMP_COLUMN in (storer.data_columns or []):
+            # epoch_ms已建立索引，直接用where条件查询
+            where = []
+            if start_ms is not None:
+                where.append(f"{TIMESTAMP_COLUMN} >= {int(start_ms)}")
+            if end_ms is not None:
+                where.append(f"{TIMESTAMP_COLUMN} < {int(end_ms)}")
             if limit:
-                df = df.tail(limit)
+                coordinates = store.select_as_coordinates(table_name,
+                                                          where=where)
+                return store.select(table_name,
+                                    where=coordinates[-limit:],
+                                    columns=columns)
+            return store.select(table_name, where=where, columns=columns)
 
-        return df
+        # 没有时间索引时分块扫描，内存占用与表大小无关
+        return select_frames(store.select(table_name,
+                                          chunksize=READ_CHUNK_ROWS),
+                             limit=limit,
+                             columns=columns,
+                             start_ms=start_ms,
+                             end_ms=end_ms)
 
     def get_tables(self) -> List[str]:
-        if not os.path.exists(self.db_file):
-            return []
-        with pd.HDFStore(self.db_file, mode='r') as store:
-            tables = list(store.keys())
+        with self._lock:
+            if self._store is not None and self._store.is_open:
+                tables = list(self._store.keys())
+            else:
+                if not os.path.exists(self.db_file):
+                    return []
+                with pd.HDFStore(self.db_file, mode='r') as store:
+                    tables = list(store.keys())
         return [table[1:] for table in tables]  # 去掉前面的'/'
 
     def close(self) -> None:
-        # HDF5不需要持久连接
-        pass
+        # 关闭长期打开的store，每次打开关闭的模式下重新打开一次以建立索引
+        with self._lock:
+            if self._unindexed and (self._store is None
+                                    or not self._store.is_open):
+                with pd.HDFStore(self.db_file, mode='a') as store:
+                    self._create_indexes(store)
+            self._close_store()
@@ -0,0 +1,395 @@
+import glob
+import os
+import struct
+import threading
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+from db.buffer import TickBatch, group_by_instrument, split_by_trading_day
+from db.interface import DatabaseInterface
+from db.price_tick import price_tick_of
+from model.market_data import (MARKET_DATA_SCHEMA, RECEIVE_COLUMN,
+                               TIMESTAMP_COLUMN, tick_epoch_ms)
+from utils.logger import main_logger
+
+# 定长记录：行情字段（字符串存为ASCII字节），含epoch_ms和recv_ns时间戳
+RECORD_DTYPE = np.dtype([(name, "S" + dtype[1:] if dtype[0] == "U" else dtype)
+                         for name, dtype in MARKET_DATA_SCHEMA])
+
+# 文件头：魔数、版本号、记录长度，读取时据此校验记录格式
+# （版本2增加了recv_ns列，版本1的文件记录长度不同，无法按当前格式读取）
+FILE_MAGIC = b"MYTTICK1"
+FILE_VERSION = 2
+_HEADER = struct.Struct("<8sII")
+HEADER_SIZE = _HEADER.size
+FILE_EXTENSION = ".ticks"
+# 缺少TradingDay字段时使用的目录名
+UNKNOWN_TRADING_DAY = "unknown"
+# 字典记录缺失字段时使用的默认值
+_FIELD_DEFAULTS = tuple(b"" if RECORD_DTYPE[name].kind == "S" else 0
+                        for name in RECORD_DTYPE.names)
+
+# 记录格式：full为上面的定长记录，compact为紧凑记录
+SCHEMA_FULL = "full"
+SCHEMA_COMPACT = "compact"
+SCHEMAS = (SCHEMA_FULL, SCHEMA_COMPACT)
+# 紧凑记录：价格存为相对最小变动价位的int32跳数，成交量存为int32
+# （AveragePrice为成交额除以成交量，不在价位上，仍为float64）
+PRICE_FIELDS = tuple(name for name, _ in MARKET_DATA_SCHEMA
+                     if "Price" in name and name != "AveragePrice")
+VOLUME_FIELDS = tuple(name for name, _ in MARKET_DATA_SCHEMA
+                      if "Volume" in name)
+COMPACT_DTYPE = np.dtype([
+    (name, "i4" if name in PRICE_FIELDS + VOLUME_FIELDS else RECORD_DTYPE[name])
+    for name in RECORD_DTYPE.names
+])
+# CTP用DBL_MAX表示无效价格，紧凑记录中记为NULL_TICKS，读取时还原为NaN
+CTP_INVALID_PRICE = np.finfo(np.float64).max
+NULL_TICKS = np.iinfo(np.int32).min
+# 紧凑记录的文件头在定长记录文件头之后附加该文件使用的最小变动价位
+COMPACT_MAGIC = b"MYTTICK2"
+_COMPACT_HEADER = struct.Struct("<8sIId")
+
+
+def _record_count(path: str,
+                  header_size: int = HEADER_SIZE,
+                  itemsize: int = RECORD_DTYPE.itemsize) -> int:
+    """文件中完整记录的条数，忽略末尾不完整的记录"""
+    return max(os.path.getsize(path) - header_size, 0) // itemsize
+
+
+def read_header(path: str) -> Tuple[np.dtype, int, Optional[float]]:
+    """读取文件头，返回(记录类型, 文件头长度, 最小变动价位)，定长记录的最小变动价位为None"""
+    with open(path, "rb") as f:
+        header = f.read(_COMPACT_HEADER.size)
+    if header[:len(COMPACT_MAGIC)] == COMPACT_MAGIC:
+        magic, version, itemsize, price_tick = _COMPACT_HEADER.unpack(header)
+        dtype, header_size = COMPACT_DTYPE, _COMPACT_HEADER.size
+    else:
+        magic, version, itemsize = _HEADER.unpack(header[:HEADER_SIZE])
+        dtype, header_size, price_tick = RECORD_DTYPE, HEADER_SIZE, None
+    if magic not in (FILE_MAGIC, COMPACT_MAGIC) or itemsize != dtype.itemsize:
+        raise ValueError(
+            f"{path} is not a tick file with the current record layout "
+            f"(version {version}, record size {itemsize})")
+    return dtype, header_size, price_tick
+
+
+def _map_file(path: str) -> Tuple[np.ndarray, Optional[float]]:
+    dtype, header_size, price_tick = read_header(path)
+    count = _record_count(path, header_size, dtype.itemsize)
+    if not count:
+        return np.empty(0, dtype=dtype), price_tick
+    return np.memmap(path,
+                     dtype=dtype,
+                     mode="r",
+                     offset=header_size,
+                     shape=(count, )), price_tick
+
+
+def open_memmap(path: str) -> np.ndarray:
+    """
+    以只读方式映射行情文件，返回结构化数组，各列均为零拷贝视图
+    紧凑记录文件返回COMPACT_DTYPE的数组，可用compact_columns还原价格
+    """
+    return _map_file(path)[0]
+
+
+def price_decimals(price_tick: float) -> int:
+    """最小变动价位的小数位数，还原价格时按此位数舍入"""
+    for decimals in range(10):
+        if round(price_tick, decimals) == price_tick:
+            return decimals
+    return 10
+
+
+def to_compact(packed: np.ndarray, price_tick: float) -> np.ndarray:
+    """
+    把定长记录转换为紧凑记录
+    价格不是最小变动价位的整数倍、或超出int32范围时抛出ValueError，保证还原后无损
+    """
+    compact = np.empty(len(packed), dtype=COMPACT_DTYPE)
+    decimals = price_decimals(price_tick)
+    limit = np.iinfo(np.int32).max
+    for name in COMPACT_DTYPE.names:
+        values = packed[name]
+        if name in PRICE_FIELDS:
+            null = np.isnan(values) | (values == CTP_INVALID_PRICE)
+            ticks = np.rint(np.where(null, 0.0, values) / price_tick)
+            if ((np.abs(ticks) > limit).any() or not np.array_equal(
+                    np.round(ticks * price_tick, decimals)[~null],
+                    values[~null])):
+                raise ValueError(
+                    f"{name} of {packed['InstrumentID'][0].decode()} is not "
+                    f"a multiple of PriceTick {price_tick}")
+            compact[name] = np.where(null, NULL_TICKS, ticks)
+        elif name in VOLUME_FIELDS:
+            if (np.abs(values) > limit).any():
+                raise ValueError(f"{name} exceeds the int32 range")
+            compact[name] = values
+        else:
+            compact[name] = values
+    return compact
+
+
+def compact_columns(records: np.ndarray, price_tick: float,
+                    names: List[str]) -> Dict[str, np.ndarray]:
+    """把紧凑记录的若干列还原为定长记录的类型，空值价格还原为NaN"""
+    decimals = price_decimals(price_tick)
+    columns = {}
+    for name in names:
+        values = records[name]
+        if name in PRICE_FIELDS:
+            prices = np.round(values * price_tick, decimals)
+            prices[values == NULL_TICKS] = np.nan
+            values = prices
+        else:
+            values = values.astype(RECORD_DTYPE[name], copy=False)
+        columns[name] = values
+    return columns
+
+
+def pack_records(rows: Union[List[Any], np.ndarray]) -> np.ndarray:
+    """把一个合约的记录打包为定长记录数组，补充尚未计算的epoch_ms"""
+    if isinstance(rows, np.ndarray):
+        packed = np.empty(len(rows), dtype=RECORD_DTYPE)
+        for name in RECORD_DTYPE.names:
+            packed[name] = rows[name]
+    elif isinstance(rows[0], dict):
+        packed = np.array([
+            tuple(row.get(name, default)
+                  for name, default in zip(RECORD_DTYPE.names,
+                                           _FIELD_DEFAULTS))
+            for row in rows
+        ], dtype=RECORD_DTYPE)
+    else:
+        # Tick本身就是按字段顺序排列的元组
+        packed = np.array(rows, dtype=RECORD_DTYPE)
+    # 没有时间字段的记录时间戳保持为0
+    missing = (packed[TIMESTAMP_COLUMN] == 0) & (packed["ActionDay"] != b"")
+    if missing.any():
+        packed[TIMESTAMP_COLUMN][missing] = tick_epoch_ms(
+            packed["ActionDay"][missing], packed["UpdateTime"][missing],
+            packed["UpdateMillisec"][missing], packed[RECEIVE_COLUMN][missing])
+    return packed
+
+
+def split_records(packed: np.ndarray) -> List[Tuple[str, np.ndarray]]:
+    """
+    按交易日拆分一个合约的定长记录，返回[(交易日, 记录)]
+    与TradingDayHandler共用split_by_trading_day（含郑商所夜盘修正），缺少TradingDay的为unknown
+    """
+    return [(trading_day or UNKNOWN_TRADING_DAY, part.data)
+            for trading_day, part in split_by_trading_day(TickBatch(packed))]
+
+
+def records_to_frame(slices: List[Union[np.ndarray, Dict[str, np.ndarray]]],
+                     columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """把若干段定长记录（或列名到数组的字典）拼接为DataFrame，字节串列解码为字符串"""
+    names = columns or list(RECORD_DTYPE.names)
+    frame = {}
+    for name in names:
+        column = (np.concatenate([records[name] for records in slices])
+                  if slices else np.empty(0, RECORD_DTYPE[name]))
+        if column.dtype.kind == "S":
+            column = column.astype(str)
+        frame[name] = column
+    return pd.DataFrame(frame, columns=names)
+
+
+class MemmapHandler(DatabaseInterface):
+    """
+    定长二进制行情文件实现
+    每个合约每个交易日一个文件（交易日/合约.ticks），记录为固定长度的结构化数组，
+    每次flush只对打包好的缓冲区调用一次write()；读取时np.memmap映射文件，
+    按epoch_ms二分查找时间范围，无需任何解析。
+    只保存行情字段，字典记录中的其他字段会被忽略。
+    schema="compact"时新文件使用紧凑记录，最小变动价位取自price_tick.yml并写入文件头，
+    合约没有配置最小变动价位时仍使用定长记录；价格不在最小变动价位上或成交量超出int32时，
+    把该文件改写为定长记录并记录日志，该合约此后的新文件也使用定长记录
+    """
+
+    def __init__(self, db_path: str = "db", schema: str = SCHEMA_FULL):
+        schema = schema.lower()
+        if schema not in SCHEMAS:
+            raise ValueError(f"Unsupported schema: {schema}. "
+                             f"Supported schemas: {', '.join(SCHEMAS)}")
+        self.db_path = db_path
+        self.schema = schema
+        os.makedirs(db_path, exist_ok=True)
+        # (合约, 交易日) -> (追加写入的文件描述符, 紧凑记录的最小变动价位)
+        self._fds: Dict[Tuple[str, str], Tuple[int, Optional[float]]] = {}
+        # 合约 -> 当前交易日，交易日切换时关闭旧文件
+        self._trading_days: Dict[str, str] = {}
+        # 无法使用紧凑记录的合约，新文件改用定长记录
+        self._full_layout: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def _path_of(self, instrument_id: str, trading_day: str) -> str:
+        return os.path.join(self.db_path, trading_day,
+                            instrument_id + FILE_EXTENSION)
+
+    def _open(self, instrument_id: str,
+              trading_day: str) -> Tuple[int, Optional[float]]:
+        """获取合约当日文件的追加描述符及其最小变动价位，新文件写入文件头"""
+        key = (instrument_id, trading_day)
+        opened = self._fds.get(key)
+        if opened is not None:
+            return opened
+        # 交易日切换，关闭旧交易日的文件
+        previous_day = self._trading_days.get(instrument_id)
+        if previous_day is not None and previous_day != trading_day:
+            old = self._fds.pop((instrument_id, previous_day), None)
+            if old is not None:
+                os.close(old[0])
+        self._trading_days[instrument_id] = trading_day
+
+        path = self._path_of(instrument_id, trading_day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        size = os.fstat(fd).st_size
+        if size == 0:
+            price_tick = (price_tick_of(instrument_id)
+                          if self.schema == SCHEMA_COMPACT
+                          and instrument_id not in self._full_layout else None)
+            if price_tick:
+                os.write(
+                    fd,
+                    _COMPACT_HEADER.pack(COMPACT_MAGIC, FILE_VERSION,
+                                         COMPACT_DTYPE.itemsize, price_tick))
+            else:
+                if (self.schema == SCHEMA_COMPACT
+                        and instrument_id not in self._full_layout):
+                    main_logger.error(
+                        "MemmapHandler",
+                        f"合约{instrument_id}没有配置最小变动价位，使用定长记录")
+                price_tick = None
+                os.write(
+                    fd,
+                    _HEADER.pack(FILE_MAGIC, FILE_VERSION,
+                                 RECORD_DTYPE.itemsize))
+        else:
+            dtype, header_size, price_tick = read_header(path)
+            # 截掉上次异常退出时残留的不完整记录
+            whole = header_size + _record_count(
+                path, header_size, dtype.itemsize) * dtype.itemsize
+            if size != whole:
+                main_logger.error(
+                    "MemmapHandler",
+                    f"Truncating {size - whole} bytes of partial record "
+                    f"in {path}")
+                os.ftruncate(fd, whole)
+        self._fds[key] = (fd, price_tick)
+        return fd, price_tick
+
+    def _to_full_layout(self, key: Tuple[str, str], fd: int,
+                        price_tick: float) -> int:
+        """把紧凑记录文件改写为定长记录（先写临时文件再替换），返回新的追加描述符"""
+        path = self._path_of(*key)
+        records, _ = _map_file(path)
+        full = np.empty(len(records), dtype=RECORD_DTYPE)
+        for name, values in compact_columns(records, price_tick,
+                                            list(RECORD_DTYPE.names)).items():
+            full[name] = values
+        # 定长记录保存CTP原值，无效价格还原为DBL_MAX
+        for name in PRICE_FIELDS:
+            full[name][np.isnan(full[name])] = CTP_INVALID_PRICE
+        del records
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(
+                _HEADER.pack(FILE_MAGIC, FILE_VERSION, RECORD_DTYPE.itemsize))
+            f.write(full.tobytes())
+        os.close(fd)
+        os.replace(tmp_path, path)
+        fd = os.open(path, os.O_RDWR | os.O_APPEND)
+        self._fds[key] = (fd, None)
+        self._full_layout.add(key[0])
+        return fd
+
+    @staticmethod
+    def _write(fd: int, packed: np.ndarray) -> None:
+        view = memoryview(packed.view(np.uint8))
+        while len(view):
+            written = os.write(fd, view)
+            view = view[written:]
+
+    def save(self, data: Union[List[Dict[str, Any]], TickBatch]) -> None:
+        if not len(data):
+            return
+        with self._lock:
+            for instrument_id, rows in group_by_instrument(
+                    data, "MemmapHandler").items():
+                for trading_day, part in split_records(pack_records(rows)):
+                    key = (instrument_id, trading_day)
+                    fd, price_tick = self._open(*key)
+                    if price_tick:
+                        try:
+                            part = to_compact(part, price_tick)
+                        except ValueError as e:
+                            # 不中断整批写入，该文件改用定长记录
+                            main_logger.error(
+                                "MemmapHandler",
+                                f"{e}, rewriting {self._path_of(*key)} "
+                                f"with full records")
+                            fd = self._to_full_layout(key, fd, price_tick)
+                    self._write(fd, part)
+
+    def _files_of(self, instrument_id: str) -> List[str]:
+        """合约所有交易日的文件，按交易日排序"""
+        return sorted(
+            glob.glob(
+                os.path.join(self.db_path, "*",
+                             instrument_id + FILE_EXTENSION)))
+
+    def load(self,
+             table_name: str,
+             limit: Optional[int] = None,
+             columns: Optional[List[str]] = None,
+             start_ms: Optional[int] = None,
+             end_ms: Optional[int] = None) -> pd.DataFrame:
+        files = self._files_of(table_name)
+        if not files:
+            raise KeyError(f"Table {table_name} not found")
+
+        names = columns or list(RECORD_DTYPE.names)
+        slices = []
+        rows = 0
+        # 只取最后limit行时从最后一个交易日向前读取
+        for path in reversed(files) if limit else files:
+            records, price_tick = _map_file(path)
+            if start_ms is not None or end_ms is not None:
+                # 同一文件内记录按时间顺序追加，二分查找得到零拷贝切片
+                epoch_ms = records[TIMESTAMP_COLUMN]
+                start = (np.searchsorted(epoch_ms, start_ms, side="left")
+                         if start_ms is not None else 0)
+                stop = (np.searchsorted(epoch_ms, end_ms, side="left")
+                        if end_ms is not None else len(records))
+                records = records[start:stop]
+            if limit:
+                records = records[max(len(records) - (limit - rows), 0):]
+            rows += len(records)
+            if price_tick:
+                records = compact_columns(records, price_tick, names)
+            if limit:
+                slices.insert(0, records)
+            else:
+                slices.append(records)
+            if limit and rows >= limit:
+                break
+
+        return records_to_frame(slices, columns)
+
+    def get_tables(self) -> List[str]:
+        tables = set()
+        for path in glob.glob(
+                os.path.join(self.db_path, "*", "*" + FILE_EXTENSION)):
+            tables.add(os.path.basename(path)[:-len(FILE_EXTENSION)])
+        return sorted(tables)
+
+    def close(self) -> None:
+        # 关闭所有追加写入的文件
+        with self._lock:
+            for fd, _ in self._fds.values():
+                os.close(fd)
+            self._fds.clear()
@@ -0,0 +1,354 @@
+import glob
+import os
+import re
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import Any, Dict, List, Optional, Tuple, Union
+from db.buffer import TickBatch, group_by_instrument, session_trading_days
+from db.interface import DatabaseInterface
+from db.partition import exchange_of, symbol_of
+from model.market_data import (MARKET_DATA_FIELDS, MARKET_DATA_SCHEMA,
+                               TIMESTAMP_COLUMN, Tick, tick_epoch_ms)
+from utils.logger import main_logger
+
+# 缺少TradingDay字段时使用的分区名
+UNKNOWN_TRADING_DAY = "unknown"
+PARQUET_COMPRESSIONS = ("none", "snappy", "gzip", "brotli", "lz4", "zstd")
+
+
+def _tick_schema() -> "pa.Schema":
+    """行情字段对应的Arrow类型"""
+    arrow_types = {"U": pa.string(), "i": pa.int64(), "f": pa.float64()}
+    return pa.schema([(name, arrow_types[dtype[0]])
+                      for name, dtype in MARKET_DATA_SCHEMA])
+
+
+# 文件名为 合约.序号.parquet（每次写入一个文件）或 合约.起始序号-结束序号.parquet（合并文件）
+_FILE_PATTERN = re.compile(
+    r"^(?P<instrument>.+)\.(?P<first>\d+)(?:-(?P<last>\d+))?\.parquet$")
+
+
+def partition_files(partition: str,
+                    instrument_id: str) -> List[Tuple[int, int, str]]:
+    """
+    分区目录中一个合约的文件[(起始序号, 结束序号, 路径)]，按序号排序。
+    合并文件写完后、源文件删除前，被合并文件覆盖的源文件不返回，读取方不会读到重复的行
+    """
+    files = []
+    for path in glob.glob(os.path.join(partition, f"{instrument_id}.*.parquet")):
+        match = _FILE_PATTERN.match(os.path.basename(path))
+        if match is None or match.group("instrument") != instrument_id:
+            continue
+        first = int(match.group("first"))
+        last = int(match.group("last") or first)
+        files.append((first, last, path))
+    merged = [(first, last) for first, last, _ in files]
+    return sorted(item for item in files if not any(
+        first <= item[0] and item[1] <= last and (first, last) != item[:2]
+        for first, last in merged))
+
+
+def _align(table: "pa.Table", schema: "pa.Schema") -> "pa.Table":
+    """把批次对齐到文件的schema：缺失的列补空值，多余的列丢弃"""
+    if table.schema.equals(schema):
+        return table
+    columns = [
+        table[field.name].cast(field.type) if field.name in
+        table.column_names else pa.nulls(table.num_rows, field.type)
+        for field in schema
+    ]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+class ParquetHandler(DatabaseInterface):
+    """
+    Parquet分区数据集实现
+    目录结构为 exchange=交易所/symbol=品种/trading_day=交易日/合约.序号.parquet，
+    每次写入时每个合约每个交易日写出一个完整的文件（先写临时文件再改名），save返回后
+    其他进程即可读取，进程崩溃也不会丢失已写入的数据。
+    同一分区累计compact_files个小文件、交易日切换或关闭时，把小文件合并为按row_group_size
+    分行组的文件。读取时只读需要的列，并按epoch_ms的行组统计信息跳过不在时间范围内的数据
+    """
+
+    def __init__(self,
+                 db_path: str = "db",
+                 row_group_size: int = 10000,
+                 compression: str = "zstd",
+                 compression_level: Optional[int] = None,
+                 use_dictionary: bool = True,
+                 compact_files: int = 64):
+        compression = (compression or "none").lower()
+        if compression not in PARQUET_COMPRESSIONS:
+            raise ValueError(
+                f"Unsupported parquet compression: {compression}. "
+                f"Supported compressions: {', '.join(PARQUET_COMPRESSIONS)}")
+        self.db_path = db_path
+        os.makedirs(db_path, exist_ok=True)
+        self.row_group_size = max(1, row_group_size)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.use_dictionary = use_dictionary
+        self.compact_files = max(2, compact_files)
+        self._tick_schema = _tick_schema()
+        # (合约, 交易日) -> 下一个文件序号
+        self._sequences: Dict[Tuple[str, str], int] = {}
+        # (合约, 交易日) -> 上次合并后新写入的小文件数
+        self._small_files: Dict[Tuple[str, str], int] = {}
+        # 合约 -> 当前交易日，交易日切换时合并旧分区的文件
+        self._trading_days: Dict[str, str] = {}
+        # 合约 -> 分区根目录（exchange=/symbol=）
+        self._roots: Dict[str, str] = {}
+        self._lock = threading.RLock()
+
+    def _root_of(self, instrument_id: str) -> Optional[str]:
+        """合约所在的exchange=/symbol=目录，结果缓存"""
+        root = self._roots.get(instrument_id)
+        if root is not None:
+            return root
+        exchange = exchange_of(instrument_id, "ParquetHandler")
+        if not exchange:
+            return None
+        symbol = symbol_of(instrument_id)
+        if not symbol:
+            main_logger.error("ParquetHandler",
+                              f"合约{instrument_id}无法提取品种前缀")
+            return None
+        root = os.path.join(self.db_path, f"exchange={exchange}",
+                            f"symbol={symbol}")
+        self._roots[instrument_id] = root
+        return root
+
+    def _to_table(self, rows: Union[List[Any], np.ndarray]) -> "pa.Table":
+        """把一个合约的记录转换为Arrow表，并补充epoch_ms列"""
+        if isinstance(rows, np.ndarray):
+            table = pa.table({name: rows[name] for name in rows.dtype.names})
+        elif isinstance(rows[0], Tick):
+            # Tick按字段顺序排列，转置后即为各列
+            table = pa.table(dict(zip(MARKET_DATA_FIELDS,
+                                      map(list, zip(*rows)))))
+        else:
+            table = pa.Table.from_pylist(rows)
+        names = table.column_names
+        if (TIMESTAMP_COLUMN not in names and "ActionDay" in names
+                and "UpdateTime" in names and "UpdateMillisec" in names):
+            epoch_ms = tick_epoch_ms(
+                table["ActionDay"].to_numpy(zero_copy_only=False),
+                table["UpdateTime"].to_numpy(zero_copy_only=False),
+                table["UpdateMillisec"].to_numpy(zero_copy_only=False))
+            table = table.append_column(TIMESTAMP_COLUMN, pa.array(epoch_ms))
+        # 行情字段统一为固定类型，避免不同批次推断出不同的类型
+        for i, name in enumerate(table.column_names):
+            index = self._tick_schema.get_field_index(name)
+            if index >= 0:
+                field = self._tick_schema.field(index)
+                if table.schema.field(i).type != field.type:
+                    table = table.set_column(i, field,
+                                             table[name].cast(field.type))
+        return table
+
+    @staticmethod
+    def _split_trading_days(
+            table: "pa.Table") -> List[Tuple[str, "pa.Table"]]:
+        """
+        按交易日拆分批次，通常一个批次只有一个交易日
+        与TradingDayHandler共用session_trading_days修正郑商所夜盘的交易日
+        """
+        if "TradingDay" not in table.column_names:
+            return [(UNKNOWN_TRADING_DAY, table)]
+        epoch_ms = (table[TIMESTAMP_COLUMN].fill_null(0).to_numpy()
+                    if TIMESTAMP_COLUMN in table.column_names else
+                    np.zeros(len(table), dtype=np.int64))
+        trading_days = session_trading_days(
+            table["TradingDay"].fill_null("").to_numpy(zero_copy_only=False),
+            epoch_ms)
+        first = trading_days[0]
+        if (trading_days == first).all():
+            return [(str(first) or UNKNOWN_TRADING_DAY, table)]
+        return [(str(trading_day) or UNKNOWN_TRADING_DAY,
+                 table.filter(pa.array(trading_days == trading_day)))
+                for trading_day in np.unique(trading_days)]
+
+    def _partition_of(self, instrument_id: str,
+                      trading_day: str) -> Optional[str]:
+        root = self._root_of(instrument_id)
+        if root is None:
+            return None
+        return os.path.join(root, f"trading_day={trading_day}")
+
+    def _write_file(self, path: str, table: "pa.Table") -> None:
+        """写出一个完整的文件：先写临时文件，完成后改名，读取方只会看到完整的文件"""
+        string_columns = [
+            field.name for field in table.schema
+            if pa.types.is_string(field.type)
+        ]
+        tmp_path = path + ".tmp"
+        pq.write_table(
+            table,
+            tmp_path,
+            row_group_size=self.row_group_size,
+            compression=self.compression,
+            compression_level=self.compression_level,
+            use_dictionary=string_columns if self.use_dictionary else False)
+        os.replace(tmp_path, path)
+
+    def _append(self, instrument_id: str, trading_day: str,
+                table: "pa.Table") -> bool:
+        """把一个合约一个交易日的行写为新文件，合约不在配置中时返回False"""
+        partition = self._partition_of(instrument_id, trading_day)
+        if partition is None:
+            return False
+        # 交易日切换，合并旧交易日的文件
+        previous_day = self._trading_days.get(instrument_id)
+        if previous_day is not None and previous_day != trading_day:
+            self.compact(instrument_id, previous_day)
+        self._trading_days[instrument_id] = trading_day
+
+        key = (instrument_id, trading_day)
+        sequence = self._sequences.get(key)
+        if sequence is None:
+            os.makedirs(partition, exist_ok=True)
+            files = partition_files(partition, instrument_id)
+            sequence = files[-1][1] + 1 if files else 0
+        self._write_file(
+            os.path.join(partition, f"{instrument_id}.{sequence:04d}.parquet"),
+            table)
+        self._sequences[key] = sequence + 1
+        self._small_files[key] = self._small_files.get(key, 0) + 1
+        if self._small_files[key] >= self.compact_files:
+            self.compact(instrument_id, trading_day, merged=False)
+        return True
+
+    def compact(self,
+                instrument_id: str,
+                trading_day: str,
+                merged: bool = True) -> None:
+        """
+        把一个分区中合约的文件合并为一个文件，merged为False时只合并上次合并后写入的小文件。
+        先写出合并文件（文件名包含覆盖的序号范围）再删除源文件，中途崩溃也不会丢失或重复数据
+        """
+        with self._lock:
+            self._small_files.pop((instrument_id, trading_day), None)
+            partition = self._partition_of(instrument_id, trading_day)
+            if partition is None:
+                return
+            sources = [
+                item for item in partition_files(partition, instrument_id)
+                if merged or item[0] == item[1]
+            ]
+            if len(sources) < 2:
+                return
+            tables = [pq.read_table(path) for _, _, path in sources]
+            schema = pa.unify_schemas([table.schema for table in tables])
+            table = pa.concat_tables(
+                [_align(table, schema) for table in tables])
+            first, last = sources[0][0], sources[-1][1]
+            self._write_file(
+                os.path.join(partition,
+                             f"{instrument_id}.{first:04d}-{last:04d}.parquet"),
+                table)
+            for _, _, path in sources:
+                os.remove(path)
+
+    def save(self, data: Union[List[Dict[str, Any]], TickBatch]) -> int:
+        """返回实际写入的记录数，不在instrument.yml中的合约被跳过"""
+        written = 0
+        if not len(data):
+            return written
+        with self._lock:
+            for instrument_id, rows in group_by_instrument(
+                    data, "ParquetHandler").items():
+                table = self._to_table(rows)
+                for trading_day, part in self._split_trading_days(table):
+                    if not self._append(instrument_id, trading_day, part):
+                        break
+                    written += part.num_rows
+        return written
+
+    def _files_of(self, instrument_id: str) -> List[str]:
+        """合约的所有文件，按交易日和序号排序"""
+        root = self._root_of(instrument_id)
+        if root is None:
+            return []
+        return [
+            path for partition in sorted(
+                glob.glob(os.path.join(root, "trading_day=*")))
+            for _, _, path in partition_files(partition, instrument_id)
+        ]
+
+    def load(self,
+             table_name: str,
+             limit: Optional[int] = None,
+             columns: Optional[List[str]] = None,
+             start_ms: Optional[int] = None,
+             end_ms: Optional[int] = None) -> pd.DataFrame:
+        # 持锁读取，避免合并文件时删除正在读取的源文件
+        with self._lock:
+            return self._load(table_name, limit, columns, start_ms, end_ms)
+
+    def _load(self, table_name: str, limit: Optional[int],
+              columns: Optional[List[str]], start_ms: Optional[int],
+              end_ms: Optional[int]) -> pd.DataFrame:
+        files = self._files_of(table_name)
+        if not files:
+            raise KeyError(f"Table {table_name} not found")
+
+        filters = []
+        if start_ms is not None:
+            filters.append((TIMESTAMP_COLUMN, ">=", int(start_ms)))
+        if end_ms is not None:
+            filters.append((TIMESTAMP_COLUMN, "<", int(end_ms)))
+
+        tables = []
+        rows = 0
+        # 只取最后limit行时从最后一个文件、最后一个行组向前读取
+        for path in reversed(files) if limit else files:
+            if filters:
+                parts = [
+                    pq.read_table(path, columns=columns, filters=filters)
+                ]
+            elif limit:
+                parquet_file = pq.ParquetFile(path)
+                parts = []
+                for i in reversed(range(parquet_file.num_row_groups)):
+                    parts.insert(0, parquet_file.read_row_group(
+                        i, columns=columns))
+                    if rows + sum(part.num_rows for part in parts) >= limit:
+                        break
+            else:
+                parts = [pq.read_table(path, columns=columns)]
+            if limit:
+                tables[:0] = parts
+            else:
+                tables.extend(parts)
+            rows += sum(part.num_rows for part in parts)
+            if limit and rows >= limit:
+                break
+
+        # 不同批次写出的文件列可能不同（如有无recv_ns），对齐后再拼接
+        schema = pa.unify_schemas([table.schema for table in tables])
+        table = pa.concat_tables([_align(table, schema) for table in tables])
+        if limit:
+            table = table.slice(max(table.num_rows - limit, 0))
+        return table.to_pandas()
+
+    def get_tables(self) -> List[str]:
+        tables = set()
+        for path in glob.glob(
+                os.path.join(self.db_path, "exchange=*", "symbol=*",
+                             "trading_day=*", "*.parquet")):
+            match = _FILE_PATTERN.match(os.path.basename(path))
+            if match is not None:
+                tables.add(match.group("instrument"))
+        return sorted(tables)
+
+    def close(self) -> None:
+        # 合并各合约当前交易日的小文件
+        with self._lock:
+            for instrument_id, trading_day in list(
+                    self._trading_days.items()):
+                self.compact(instrument_id, trading_day)
+            self._trading_days.clear()
+            self._sequences.clear()
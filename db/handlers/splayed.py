@@ -0,0 +1,256 @@
+import ast
+import glob
+import os
+import struct
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
+from db.buffer import TickBatch, group_by_instrument
+from db.handlers.memmap import RECORD_DTYPE, pack_records, split_records
+from db.interface import DatabaseInterface
+
+# 按列保存的字段：合约和交易日已体现在目录结构中
+SPLAYED_COLUMNS = [
+    name for name in RECORD_DTYPE.names
+    if name not in ("InstrumentID", "TradingDay")
+]
+# .npy文件头固定为128字节，追加后原地改写其中的行数
+NPY_HEADER_SIZE = 128
+_NPY_MAGIC = b"\x93NUMPY\x01\x00"
+# 写入时保持打开的列文件最多占用句柄上限的比例，其余留给查询时的内存映射（每个映射占用一个句柄）、
+# 日志、其他数据库和网络连接等
+COLUMN_FILE_HANDLE_SHARE = 0.5
+# 没有resource模块（Windows）时的句柄上限，C运行库低级I/O默认最多8192个
+DEFAULT_FILE_HANDLE_LIMIT = 8192
+
+
+def default_max_open_instruments() -> int:
+    """
+    按进程当前的文件句柄软上限计算能同时打开列文件的合约数：
+    取其中COLUMN_FILE_HANDLE_SHARE的句柄除以每个合约的列文件数（len(SPLAYED_COLUMNS)），至少为1。
+    这里只读取上限，提高软上限由进程启动时的utils.process.raise_file_limit完成；
+    上限1024时只能同时打开13个合约，65536时为862个。活跃合约较多时需提高硬上限
+    （ulimit -Hn或systemd的LimitNOFILE），或在boot.yml中配置max_open_instruments
+    """
+    try:
+        import resource
+    except ImportError:
+        limit = DEFAULT_FILE_HANDLE_LIMIT
+    else:
+        limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        if limit == resource.RLIM_INFINITY:
+            limit = DEFAULT_FILE_HANDLE_LIMIT
+    return max(1,
+               int(limit * COLUMN_FILE_HANDLE_SHARE) // len(SPLAYED_COLUMNS))
+
+
+def _npy_header(dtype: np.dtype, count: int) -> bytes:
+    """生成定长的.npy（1.0版）文件头"""
+    header = ("{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" %
+              (np.lib.format.dtype_to_descr(dtype), count))
+    header = header.ljust(NPY_HEADER_SIZE - len(_NPY_MAGIC) - 3) + "\n"
+    return _NPY_MAGIC + struct.pack("<H", len(header)) + header.encode(
+        "latin1")
+
+
+def _npy_count(header: bytes) -> int:
+    """从定长文件头中读取行数"""
+    return ast.literal_eval(header[len(_NPY_MAGIC) + 2:].decode(
+        "latin1"))["shape"][0]
+
+
+def column_count(path: str) -> int:
+    """列文件中的行数，只读取文件头"""
+    with open(path, "rb") as f:
+        return _npy_count(f.read(NPY_HEADER_SIZE))
+
+
+def load_column(path: str) -> np.ndarray:
+    """以只读内存映射方式加载一列"""
+    if not column_count(path):
+        return np.empty(0, dtype=RECORD_DTYPE[os.path.basename(path)[:-4]])
+    return np.load(path, mmap_mode="r")
+
+
+class _ColumnFiles:
+    """一个合约一个交易日目录下各列的.npy文件"""
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.files = {}
+        counts = []
+        for name in SPLAYED_COLUMNS:
+            path = os.path.join(directory, f"{name}.npy")
+            f = open(path, "r+b" if os.path.exists(path) else "w+b")
+            header = f.read(NPY_HEADER_SIZE)
+            if header:
+                counts.append(_npy_count(header))
+            self.files[name] = f
+        # 各列以行数最少的为准，截掉异常退出时多写的部分；
+        # 目录中原本没有的列（如后来新增的字段）补零到相同行数
+        self.count = min(counts) if counts else 0
+        for name, f in self.files.items():
+            itemsize = RECORD_DTYPE[name].itemsize
+            f.truncate(NPY_HEADER_SIZE + self.count * itemsize)
+            f.seek(0)
+            f.write(_npy_header(RECORD_DTYPE[name], self.count))
+
+    def append(self, packed: np.ndarray) -> None:
+        """把每列的数据追加到文件末尾，再改写文件头中的行数"""
+        count = self.count + len(packed)
+        for name, f in self.files.items():
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(packed[name]).tobytes())
+            f.seek(0)
+            f.write(_npy_header(RECORD_DTYPE[name], count))
+            f.flush()
+        self.count = count
+
+    def close(self) -> None:
+        for f in self.files.values():
+            f.close()
+
+
+class SplayedHandler(DatabaseInterface):
+    """
+    按列拆分的行情存储
+    每个合约每个交易日一个目录（交易日/合约/），每个字段一个.npy文件，另有epoch_ms时间戳列；
+    追加时各列文件分别扩展，读取时只内存映射需要的列，查询几列数据只会读取这几列的字节
+    """
+
+    def __init__(self,
+                 db_path: str,
+                 db_name: str,
+                 max_open_instruments: Optional[int] = None):
+        # 为存储目录添加.splayed扩展名
+        if not db_name.endswith('.splayed'):
+            db_name += '.splayed'
+        self.db_path = os.path.join(db_path, db_name)
+        os.makedirs(self.db_path, exist_ok=True)
+        # 每个合约需要同时打开所有列文件，按合约限制打开数量；
+        # 默认按文件句柄上限计算，使全部活跃合约的列文件在交易日内保持打开
+        if max_open_instruments is None:
+            max_open_instruments = default_max_open_instruments()
+        self.max_open_instruments = max(1, max_open_instruments)
+        # (合约, 交易日) -> 列文件，按最近使用排序
+        self._columns: "OrderedDict[Tuple[str, str], _ColumnFiles]" = (
+            OrderedDict())
+        self._lock = threading.Lock()
+
+    def _directory_of(self, instrument_id: str, trading_day: str) -> str:
+        return os.path.join(self.db_path, trading_day, instrument_id)
+
+    def _get_columns(self, instrument_id: str,
+                     trading_day: str) -> _ColumnFiles:
+        key = (instrument_id, trading_day)
+        columns = self._columns.get(key)
+        if columns is not None:
+            self._columns.move_to_end(key)
+            return columns
+        while len(self._columns) >= self.max_open_instruments:
+            _, evicted = self._columns.popitem(last=False)
+            evicted.close()
+        columns = _ColumnFiles(self._directory_of(instrument_id, trading_day))
+        self._columns[key] = columns
+        return columns
+
+    def save(self, data: Union[List[Dict[str, Any]], TickBatch]) -> None:
+        if not len(data):
+            return
+        with self._lock:
+            for instrument_id, rows in group_by_instrument(
+                    data, "SplayedHandler").items():
+                for trading_day, part in split_records(pack_records(rows)):
+                    self._get_columns(instrument_id, trading_day).append(part)
+
+    def read_day(self,
+                 trading_day: str,
+                 columns: List[str],
+                 instruments: Optional[List[str]] = None
+                 ) -> Dict[str, Dict[str, np.ndarray]]:
+        """
+        读取一个交易日所有（或指定）合约的若干列
+        返回 合约 -> 列名 -> 内存映射数组，只有这些列文件会被读取
+        """
+        day_path = os.path.join(self.db_path, trading_day)
+        if instruments is None:
+            instruments = (sorted(os.listdir(day_path))
+                           if os.path.isdir(day_path) else [])
+        result = {}
+        for instrument_id in instruments:
+            directory = os.path.join(day_path, instrument_id)
+            if os.path.isdir(directory):
+                result[instrument_id] = {
+                    name: load_column(os.path.join(directory, f"{name}.npy"))
+                    for name in columns
+                }
+        return result
+
+    def load(self,
+             table_name: str,
+             limit: Optional[int] = None,
+             columns: Optional[List[str]] = None,
+             start_ms: Optional[int] = None,
+             end_ms: Optional[int] = None) -> pd.DataFrame:
+        directories = sorted(
+            glob.glob(os.path.join(self.db_path, "*", table_name)))
+        if not directories:
+            raise KeyError(f"Table {table_name} not found")
+
+        names = columns or list(RECORD_DTYPE.names)
+        parts = {name: [] for name in names}
+        rows = 0
+        # 只取最后limit行时从最后一个交易日向前读取
+        for directory in reversed(directories) if limit else directories:
+            trading_day = os.path.basename(os.path.dirname(directory))
+            if start_ms is not None or end_ms is not None:
+                # 同一交易日内按时间顺序追加，二分查找时间范围
+                epoch_ms = load_column(os.path.join(directory, "epoch_ms.npy"))
+                start = (np.searchsorted(epoch_ms, start_ms, side="left")
+                         if start_ms is not None else 0)
+                stop = (np.searchsorted(epoch_ms, end_ms, side="left")
+                        if end_ms is not None else len(epoch_ms))
+            else:
+                start = 0
+                stop = column_count(os.path.join(directory, "epoch_ms.npy"))
+            if limit:
+                start = max(start, stop - (limit - rows))
+            for name in names:
+                if name == "InstrumentID":
+                    column = np.full(stop - start, table_name)
+                elif name == "TradingDay":
+                    column = np.full(stop - start, trading_day)
+                else:
+                    column = load_column(os.path.join(
+                        directory, f"{name}.npy"))[start:stop]
+                if limit:
+                    parts[name].insert(0, column)
+                else:
+                    parts[name].append(column)
+            rows += max(stop - start, 0)
+            if limit and rows >= limit:
+                break
+
+        frame = {}
+        for name in names:
+            column = np.concatenate(parts[name])
+            if column.dtype.kind == "S":
+                column = column.astype(str)
+            frame[name] = column
+        return pd.DataFrame(frame, columns=names)
+
+    def get_tables(self) -> List[str]:
+        tables = set()
+        for directory in glob.glob(os.path.join(self.db_path, "*", "*")):
+            if os.path.isdir(directory):
+                tables.add(os.path.basename(directory))
+        return sorted(tables)
+
+    def close(self) -> None:
+        # 关闭所有打开的列文件
+        with self._lock:
+            for columns in self._columns.values():
+                columns.close()
+            self._columns.clear()
@@ -1,73 +1,405 @@
 import os
 import sqlite3
+import threading
 import pandas as pd
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union, Tuple
+from db.buffer import TickBatch, instrument_id_of
 from db.interface import DatabaseInterface
+from model.market_data import (EXCHANGE_UTC_OFFSET_MS, MARKET_DATA_FIELDS,
+                                MARKET_DATA_SCHEMA, TIMESTAMP_COLUMN, Tick,
+                                exchange_epoch_ms)
 from utils.logger import main_logger
 
+# NumPy类型种类到SQLite列类型的映射
+SQLITE_TYPES = {"U": "TEXT", "S": "TEXT", "i": "INTEGER", "u": "INTEGER",
+                "f": "REAL", "b": "INTEGER"}
+# 行情字段对应的SQLite列类型
+TICK_COLUMN_TYPES = {
+    name: SQLITE_TYPES[kind]
+    for name, kind in ((name, dtype[0]) for name, dtype in MARKET_DATA_SCHEMA)
+}
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+# 表结构：per_instrument为每个合约一张表，ticks为所有合约共用一张按时间索引的表
+SCHEMA_PER_INSTRUMENT = "per_instrument"
+SCHEMA_TICKS = "ticks"
+SCHEMAS = (SCHEMA_PER_INSTRUMENT, SCHEMA_TICKS)
+
+# ticks表及其合约目录表
+TICKS_TABLE = "ticks"
+CATALOG_TABLE = "tick_catalog"
+TICKS_COLUMNS = (["InstrumentID", TIMESTAMP_COLUMN] + [
+    name for name in MARKET_DATA_FIELDS
+    if name not in ("InstrumentID", TIMESTAMP_COLUMN)
+])
+# 合约内的写入序号，与(InstrumentID, epoch_ms)组成主键，区分同一毫秒的多条行情
+SEQ_COLUMN = "seq"
+_TICKS_KEY_COLUMNS = TICKS_COLUMNS + [SEQ_COLUMN]
+_TICKS_COLUMN_TYPES = dict(TICK_COLUMN_TYPES, **{SEQ_COLUMN: "INTEGER"})
+_TICKS_COLUMN_DEFS = ", ".join(f'"{column}" {_TICKS_COLUMN_TYPES[column]}'
+                               for column in _TICKS_KEY_COLUMNS)
+_TICKS_INSERT_SQL = (
+    f"INSERT INTO {TICKS_TABLE} ({', '.join(_TICKS_KEY_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in _TICKS_KEY_COLUMNS)})")
+# 无法计算时间的记录epoch_ms为0，不计入合约目录的时间范围
+_CATALOG_UPSERT_SQL = (
+    f"INSERT INTO {CATALOG_TABLE} (InstrumentID, first_ms, last_ms, row_count) "
+    "VALUES (?, ?, ?, ?) ON CONFLICT(InstrumentID) DO UPDATE SET "
+    "first_ms = MIN(COALESCE(first_ms, excluded.first_ms), "
+    "COALESCE(excluded.first_ms, first_ms)), "
+    "last_ms = MAX(COALESCE(last_ms, excluded.last_ms), "
+    "COALESCE(excluded.last_ms, last_ms)), "
+    "row_count = row_count + excluded.row_count")
+_CATALOG_COUNT_SQL = (f"SELECT row_count FROM {CATALOG_TABLE} "
+                      "WHERE InstrumentID = ?")
+
+# 按合约分表的旧表没有epoch_ms列时，由ActionDay/UpdateTime/UpdateMillisec计算epoch毫秒的SQL表达式
+_EPOCH_MS_EXPR = (
+    "(CAST(strftime('%s', substr(ActionDay, 1, 4) || '-' || "
+    "substr(ActionDay, 5, 2) || '-' || substr(ActionDay, 7, 2) || ' ' || "
+    "UpdateTime) AS INTEGER) * 1000 + UpdateMillisec - "
+    f"{EXCHANGE_UTC_OFFSET_MS})")
+
+
+def _sqlite_type(column: str, value: Any) -> str:
+    """推断列的SQLite类型：行情字段使用固定类型，其他字段按值推断"""
+    if column in TICK_COLUMN_TYPES:
+        return TICK_COLUMN_TYPES[column]
+    if isinstance(value, bool) or isinstance(value, int):
+        return "INTEGER"
+    if isinstance(value, float):
+        return "REAL"
+    return "TEXT"
+
+
+def _record_epoch_ms(record: Tuple[Any, ...], day_positions: List[int],
+                     time_position: Optional[int],
+                     millisec_position: Optional[int]) -> int:
+    """
+    由ActionDay（为空时用TradingDay）和UpdateTime计算epoch毫秒
+    缺少日期或时间、格式错误时返回0，不影响同一事务中的其他记录
+    """
+    day = next((record[i] for i in day_positions if record[i]), None)
+    update_time = record[time_position] if time_position is not None else None
+    if not day or not update_time:
+        return 0
+    millisec = record[millisec_position] if millisec_position is not None else 0
+    try:
+        return exchange_epoch_ms(day, update_time, millisec or 0)
+    except (ValueError, TypeError):
+        return 0
+
 
 class SQLiteHandler(DatabaseInterface):
-    """SQLite3数据库实现"""
+    """
+    SQLite3数据库实现
+    使用长连接和WAL日志模式，每张表只建一次并缓存INSERT语句，
+    每次flush在一个事务内用executemany写入所有合约。
+    schema="ticks"时所有合约写入一张以(InstrumentID, epoch_ms, seq)为主键的WITHOUT ROWID表，
+    行按主键聚簇存储，主键即覆盖全部列的索引，按合约和时间范围查询任意列时只顺序读取范围内的行；
+    并维护合约目录表，支持按时间范围和最新N条查询
+    """
 
-    def __init__(self, db_path: str, db_name: str):
+    def __init__(self,
+                 db_path: str,
+                 db_name: str,
+                 journal_mode: str = "WAL",
+                 synchronous: str = "NORMAL",
+                 schema: str = SCHEMA_PER_INSTRUMENT):
         self.db_path = db_path
         os.makedirs(db_path, exist_ok=True)
         self.db_file = os.path.join(db_path, db_name)
+        synchronous = synchronous.upper()
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(
+                f"Unsupported synchronous mode: {synchronous}. "
+                f"Supported modes: {', '.join(SYNCHRONOUS_MODES)}")
+        schema = schema.lower()
+        if schema not in SCHEMAS:
+            raise ValueError(f"Unsupported schema: {schema}. "
+                             f"Supported schemas: {', '.join(SCHEMAS)}")
+        self.schema = schema
+        self.journal_mode = journal_mode.upper()
+        self.synchronous = synchronous
+        self._conn: Optional[sqlite3.Connection] = None
+        # 写线程和查询线程共用长连接，需要加锁
+        self._lock = threading.RLock()
+        # 表名 -> (列名列表, INSERT语句)
+        self._insert_cache: Dict[str, Tuple[List[str], str]] = {}
 
-    def save(self, data: List[Dict[str, Any]]) -> None:
-        if not data:
-            return
+    def _connect(self) -> sqlite3.Connection:
+        """获取长连接，首次使用时打开并设置PRAGMA"""
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_file,
+                                   check_same_thread=False,
+                                   cached_statements=512)
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            if self.schema == SCHEMA_TICKS:
+                try:
+                    self._create_ticks_tables(conn)
+                except Exception:
+                    conn.close()
+                    raise
+            self._conn = conn
+        return self._conn
 
-        # 按InstrumentID分组数据
-        data_by_instrument = {}
+    @staticmethod
+    def _table_columns(conn: sqlite3.Connection, table_name: str) -> List[str]:
+        return [
+            row[1]
+            for row in conn.execute(f'PRAGMA table_info("{table_name}")')
+        ]
+
+    def _create_ticks_tables(self, conn: sqlite3.Connection) -> None:
+        """创建按(InstrumentID, epoch_ms, seq)聚簇的ticks表和合约目录表"""
+        with conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {TICKS_TABLE} "
+                f"({_TICKS_COLUMN_DEFS}, "
+                f"PRIMARY KEY (InstrumentID, epoch_ms, {SEQ_COLUMN})) "
+                "WITHOUT ROWID")
+            (sql, ) = conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type='table' AND name=?",
+                (TICKS_TABLE, )).fetchone()
+            if "WITHOUT ROWID" not in sql.upper():
+                raise ValueError(
+                    f"{self.db_file}: existing {TICKS_TABLE} table is not a "
+                    "WITHOUT ROWID table clustered on (InstrumentID, epoch_ms)")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} ("
+                         "InstrumentID TEXT PRIMARY KEY, first_ms INTEGER, "
+                         "last_ms INTEGER, row_count INTEGER)")
+
+    def _prepare_table(self, conn: sqlite3.Connection, table_name: str,
+                       columns: List[str],
+                       sample: Any) -> Tuple[List[str], str]:
+        """确保表存在，返回表的列名和缓存的INSERT语句"""
+        cached = self._insert_cache.get(table_name)
+        if cached is not None:
+            return cached
+        existing = self._table_columns(conn, table_name)
+        if existing:
+            # 已存在的表（包括旧版本通过to_sql创建的表）沿用原有列
+            columns = existing
+        else:
+            column_defs = ", ".join(
+                f'"{column}" {_sqlite_type(column, value)}'
+                for column, value in zip(columns, sample))
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{table_name}" '
+                         f'({column_defs})')
+            if TIMESTAMP_COLUMN in columns:
+                conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS "idx_{table_name}_time" '
+                    f'ON "{table_name}" ({TIMESTAMP_COLUMN})')
+        placeholders = ", ".join("?" for _ in columns)
+        column_list = ", ".join(f'"{column}"' for column in columns)
+        insert_sql = (f'INSERT INTO "{table_name}" ({column_list}) '
+                      f'VALUES ({placeholders})')
+        self._insert_cache[table_name] = (columns, insert_sql)
+        return columns, insert_sql
+
+    def _group_rows(
+        self, data: Union[List[Any], TickBatch]
+    ) -> Dict[str, Tuple[List[str], List[Any]]]:
+        """按InstrumentID分组，返回合约 -> (列名, 行列表)"""
+        if isinstance(data, TickBatch):
+            columns = data.columns
+            return {
+                instrument_id: (columns, rows.tolist())
+                for instrument_id, rows in data.group_by_instrument().items()
+            }
+        grouped: Dict[str, Tuple[List[str], List[Any]]] = {}
         for item in data:
             # 检查InstrumentID是否存在
-            instrument_id = item.get("InstrumentID")
+            instrument_id = instrument_id_of(item)
             if not instrument_id:
                 main_logger.error("SQLiteHandler",
                                   f"缺失InstrumentID的记录: {item}")
                 continue
-            if instrument_id not in data_by_instrument:
-                data_by_instrument[instrument_id] = []
-            data_by_instrument[instrument_id].append(item)
-
-        # 每次操作创建新连接
-        conn = sqlite3.connect(self.db_file)
-        try:
-            # 为每个InstrumentID单独保存数据
-            for instrument_id, instrument_data in data_by_instrument.items():
-                df = pd.DataFrame(instrument_data)
-                # 写入数据，if_exists='append'表示追加
-                df.to_sql(instrument_id, conn, if_exists='append', index=False)
-        finally:
-            conn.close()
+            if instrument_id not in grouped:
+                columns = (list(Tick._fields)
+                           if isinstance(item, Tick) else list(item.keys()))
+                grouped[instrument_id] = (columns, [])
+            grouped[instrument_id][1].append(item)
+        return grouped
+
+    def _save_ticks(self, conn: sqlite3.Connection,
+                    data: Union[List[Any], TickBatch]) -> None:
+        """将所有合约写入ticks表并更新合约目录"""
+        rows = []
+        catalog: Dict[str, List[int]] = {}
+        for instrument_id, (columns, records) in self._group_rows(data).items():
+            index = {column: i for i, column in enumerate(columns)}
+            # 预先计算ticks表各列在记录中的位置，缺失的列写入NULL
+            positions = [index.get(column) for column in TICKS_COLUMNS[2:]]
+            day_positions = [
+                index[name] for name in ("ActionDay", "TradingDay")
+                if name in index
+            ]
+            time_position = index.get("UpdateTime")
+            millisec_position = index.get("UpdateMillisec")
+            epoch_position = index.get(TIMESTAMP_COLUMN)
+            # 写入序号接着该合约已有的行数
+            count = conn.execute(_CATALOG_COUNT_SQL,
+                                 (instrument_id, )).fetchone()
+            seq = count[0] if count else 0
+            epochs = []
+            for record in records:
+                if isinstance(record, dict):
+                    record = tuple(record.get(column) for column in columns)
+                # 优先使用收集器已计算（并修正夜盘日期）的时间戳
+                epoch_ms = (record[epoch_position]
+                            if epoch_position is not None else None)
+                if not epoch_ms:
+                    epoch_ms = _record_epoch_ms(record, day_positions,
+                                                time_position,
+                                                millisec_position)
+                if epoch_ms:
+                    epochs.append(epoch_ms)
+                rows.append((instrument_id, epoch_ms) + tuple(
+                    None if i is None else record[i]
+                    for i in positions) + (seq, ))
+                seq += 1
+            catalog[instrument_id] = [
+                min(epochs) if epochs else None,
+                max(epochs) if epochs else None,
+                len(records)
+            ]
+        conn.executemany(_TICKS_INSERT_SQL, rows)
+        conn.executemany(_CATALOG_UPSERT_SQL,
+                         [(instrument_id, *values)
+                          for instrument_id, values in catalog.items()])
+
+    def save(self, data: Union[List[Dict[str, Any]], TickBatch]) -> None:
+        if not len(data):
+            return
+
+        with self._lock:
+            conn = self._connect()
+            if self.schema == SCHEMA_TICKS:
+                with conn:
+                    self._save_ticks(conn, data)
+                return
+            # 一个事务内写入本次flush的所有合约
+            with conn:
+                for instrument_id, (columns,
+                                    rows) in self._group_rows(data).items():
+                    first = rows[0]
+                    sample = (first.values()
+                              if isinstance(first, dict) else first)
+                    table_columns, insert_sql = self._prepare_table(
+                        conn, instrument_id, columns, sample)
+                    if isinstance(first, dict):
+                        rows = [
+                            tuple(item.get(column) for column in table_columns)
+                            for item in rows
+                        ]
+                    elif table_columns != columns:
+                        index = {column: i for i, column in enumerate(columns)}
+                        rows = [
+                            tuple(row[index[column]] if column in index else
+                                  None for column in table_columns)
+                            for row in rows
+                        ]
+                    conn.executemany(insert_sql, rows)
 
     def load(self,
              table_name: str,
-             limit: Optional[int] = None) -> pd.DataFrame:
-        # 每次操作创建新连接
-        conn = sqlite3.connect(self.db_file)
-        try:
-            query = f"SELECT * FROM {table_name}"
+             limit: Optional[int] = None,
+             columns: Optional[List[str]] = None,
+             start_ms: Optional[int] = None,
+             end_ms: Optional[int] = None) -> pd.DataFrame:
+        if self.schema == SCHEMA_TICKS:
+            # 最新N条：按索引倒序取出后再恢复时间顺序
+            if limit:
+                df = self.query_range(table_name, start_ms, end_ms, columns,
+                                      limit=limit, latest=True)
+                return df.iloc[::-1].reset_index(drop=True)
+            return self.query_range(table_name, start_ms, end_ms, columns)
+        column_list = (", ".join(f'"{column}"' for column in columns)
+                       if columns else "*")
+        query = f'SELECT {column_list} FROM "{table_name}"'
+        with self._lock:
+            conn = self._connect()
+            conditions = []
+            params: List[Any] = []
+            if start_ms is not None or end_ms is not None:
+                # 有epoch_ms列的表直接按索引列过滤
+                epoch_ms = (TIMESTAMP_COLUMN if TIMESTAMP_COLUMN
+                            in self._table_columns(conn, table_name) else
+                            _EPOCH_MS_EXPR)
+                if start_ms is not None:
+                    conditions.append(f"{epoch_ms} >= ?")
+                    params.append(int(start_ms))
+                if end_ms is not None:
+                    conditions.append(f"{epoch_ms} < ?")
+                    params.append(int(end_ms))
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
             if limit:
-                query += f" LIMIT {limit}"
+                # 最新N条：按rowid倒序取出后再恢复写入顺序
+                query += " ORDER BY rowid DESC LIMIT ?"
+                params.append(int(limit))
+                df = pd.read_sql_query(query, conn, params=params)
+                return df.iloc[::-1].reset_index(drop=True)
+            return pd.read_sql_query(query, conn, params=params)
 
-            return pd.read_sql_query(query, conn)
-        finally:
-            conn.close()
+    def query_range(self,
+                    instrument_id: str,
+                    start_ms: Optional[int] = None,
+                    end_ms: Optional[int] = None,
+                    columns: Optional[List[str]] = None,
+                    limit: Optional[int] = None,
+                    latest: bool = False) -> pd.DataFrame:
+        """
+        按时间范围查询ticks表（仅schema="ticks"时可用）
+        :param instrument_id: 合约代码
+        :param start_ms: 起始epoch毫秒（含）
+        :param end_ms: 结束epoch毫秒（不含）
+        :param columns: 返回的列，默认全部
+        :param limit: 最多返回的行数
+        :param latest: True时按时间倒序返回
+        """
+        if self.schema != SCHEMA_TICKS:
+            raise ValueError("query_range requires schema='ticks'")
+        # 默认返回全部行情字段，不含写入序号
+        column_list = ", ".join(f'"{column}"'
+                                for column in (columns or TICKS_COLUMNS))
+        query = f"SELECT {column_list} FROM {TICKS_TABLE} WHERE InstrumentID = ?"
+        params: List[Any] = [instrument_id]
+        if start_ms is not None:
+            query += " AND epoch_ms >= ?"
+            params.append(int(start_ms))
+        if end_ms is not None:
+            query += " AND epoch_ms < ?"
+            params.append(int(end_ms))
+        query += (f" ORDER BY epoch_ms DESC, {SEQ_COLUMN} DESC"
+                  if latest else f" ORDER BY epoch_ms, {SEQ_COLUMN}")
+        if limit:
+            query += " LIMIT ?"
+            params.append(int(limit))
+        with self._lock:
+            conn = self._connect()
+            return pd.read_sql_query(query, conn, params=params)
 
     def get_tables(self) -> List[str]:
-        # 每次操作创建新连接
-        conn = sqlite3.connect(self.db_file)
-        try:
-            query = "SELECT name FROM sqlite_master WHERE type='table'"
+        with self._lock:
+            conn = self._connect()
+            if self.schema == SCHEMA_TICKS:
+                # 直接从合约目录表返回合约列表
+                query = (f"SELECT InstrumentID FROM {CATALOG_TABLE} "
+                         "ORDER BY InstrumentID")
+            else:
+                query = "SELECT name FROM sqlite_master WHERE type='table'"
             cursor = conn.cursor()
             cursor.execute(query)
             tables = [row[0] for row in cursor.fetchall()]
             return tables
-        finally:
-            conn.close()
 
     def close(self) -> None:
-        # 不需要关闭持久连接
-        pass
+        # 关闭长连接，之后的调用会重新打开
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._insert_cache.clear()
@@ -10,16 +10,32 @@ from datetime import datetime
 class DatabaseInterface(ABC):
     """数据库接口定义"""
 
+    # 是否允许多个写线程并发调用save（如每个合约独立文件的实现）
+    thread_safe = False
+
     @abstractmethod
-    def save(self, data: List[Dict[str, Any]]) -> None:
-        """保存数据到数据库"""
+    def save(self, data: List[Dict[str, Any]]) -> Optional[int]:
+        """
+        保存数据到数据库
+        会跳过记录的实现（如合约不在instrument.yml中）返回实际写入的记录数，None表示全部写入
+        """
         pass
 
     @abstractmethod
     def load(self,
              table_name: str,
-             limit: Optional[int] = None) -> pd.DataFrame:
-        """从数据库加载数据"""
+             limit: Optional[int] = None,
+             columns: Optional[List[str]] = None,
+             start_ms: Optional[int] = None,
+             end_ms: Optional[int] = None) -> pd.DataFrame:
+        """
+        从数据库加载数据，只读取需要的行和列
+        :param table_name: 表名（合约代码）
+        :param limit: 只返回最后N行
+        :param columns: 返回的列，默认全部
+        :param start_ms: 起始epoch毫秒（含）
+        :param end_ms: 结束epoch毫秒（不含）
+        """
         pass
 
     @abstractmethod
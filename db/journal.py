@@ -0,0 +1,211 @@
+import glob
+import os
+import struct
+import threading
+import numpy as np
+from typing import Any, Dict, Iterator, List, Tuple
+from db.buffer import TickBatch
+from db.handlers.memmap import RECORD_DTYPE, pack_records
+from model.market_data import MARKET_DATA_DTYPE
+from utils.logger import main_logger
+
+# 日志段文件头：魔数、版本号、记录长度，记录格式与MemmapHandler的定长记录一致
+JOURNAL_MAGIC = b"MYTJRNL1"
+JOURNAL_VERSION = 1
+_HEADER = struct.Struct("<8sII")
+FILE_EXTENSION = ".journal"
+
+
+def _segment_path(directory: str, name: str, segment_id: int) -> str:
+    return os.path.join(directory, f"{name}.{segment_id:012d}{FILE_EXTENSION}")
+
+
+def list_segments(directory: str, name: str) -> List[Tuple[int, str]]:
+    """目录中某个日志的全部段文件[(段号, 路径)]，按段号排序"""
+    segments = []
+    for path in glob.glob(os.path.join(directory,
+                                       f"{name}.*{FILE_EXTENSION}")):
+        segment_id = os.path.basename(path)[len(name) + 1:-len(FILE_EXTENSION)]
+        if segment_id.isdigit():
+            segments.append((int(segment_id), path))
+    return sorted(segments)
+
+
+def read_segment(path: str) -> np.ndarray:
+    """读取段文件中的完整记录，末尾写了一半的记录被忽略"""
+    with open(path, "rb") as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        magic, version, itemsize = _HEADER.unpack(header)
+        if (magic != JOURNAL_MAGIC or version != JOURNAL_VERSION
+                or itemsize != RECORD_DTYPE.itemsize):
+            raise ValueError(f"{path} is not a journal segment of the "
+                             f"current record format")
+        data = f.read()
+    count = len(data) // RECORD_DTYPE.itemsize
+    return np.frombuffer(data, dtype=RECORD_DTYPE, count=count)
+
+
+def unpack_records(packed: np.ndarray) -> TickBatch:
+    """定长记录转换回列式批次（字节串列解码为字符串）"""
+    data = np.empty(len(packed), dtype=MARKET_DATA_DTYPE)
+    for name in MARKET_DATA_DTYPE.names:
+        data[name] = packed[name]
+    return TickBatch(data)
+
+
+class _Segment:
+    """一个缓冲区对应的日志段"""
+
+    def __init__(self, segment_id: int, path: str):
+        self.segment_id = segment_id
+        self.path = path
+        self.file = None
+        # 尚未写入文件的记录
+        self.pending: List[Any] = []
+        # 缓冲区已被取出flush，之后不再追加
+        self.closed = False
+        # 缓冲区已成功写入数据库，可以删除
+        self.released = False
+
+
+class TickJournal:
+    """
+    缓冲行情的预写日志（只追加，崩溃后可恢复）
+    追加时只把记录放入内存列表，由后台线程每commit_interval秒把新记录打包为定长记录
+    一次写入并fsync（组提交）；每个缓冲区对应一个段文件，缓冲区成功写入数据库后删除该段。
+    启动时先通过replay()取出上次未写入数据库的段重新写入。
+    只保存行情字段，字典记录中的其他字段会被忽略
+    """
+
+    def __init__(self,
+                 directory: str,
+                 name: str,
+                 commit_interval: float = 0.01):
+        self.directory = directory
+        self.name = name
+        self.commit_interval = commit_interval
+        os.makedirs(directory, exist_ok=True)
+        existing = list_segments(directory, name)
+        self._next_id = existing[-1][0] + 1 if existing else 0
+        self._segments: Dict[int, _Segment] = {}
+        self._lock = threading.Lock()
+        self._current = self._new_segment()
+        self._stats = {"journaled_records": 0, "commits": 0}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name=f"TickJournal[{name}]",
+                                        daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def replay(directory: str,
+               name: str) -> Iterator[Tuple[str, TickBatch]]:
+        """
+        按顺序取出上次运行遗留的日志段[(路径, 批次)]
+        调用方写入数据库成功后删除该路径，失败时保留以便下次重放
+        """
+        for _, path in list_segments(directory, name):
+            packed = read_segment(path)
+            yield path, unpack_records(packed)
+
+    def _new_segment(self) -> _Segment:
+        segment = _Segment(self._next_id,
+                           _segment_path(self.directory, self.name,
+                                         self._next_id))
+        self._segments[segment.segment_id] = segment
+        self._next_id += 1
+        return segment
+
+    def append(self, record: Any) -> None:
+        """追加一条记录到当前段（行情线程调用，只做内存追加）"""
+        with self._lock:
+            self._current.pending.append(record)
+
+    def rotate(self) -> int:
+        """缓冲区被取出flush时调用：结束当前段并开始新段，返回结束的段号"""
+        with self._lock:
+            segment = self._current
+            segment.closed = True
+            self._current = self._new_segment()
+            return segment.segment_id
+
+    def release(self, segment_id: int) -> None:
+        """段对应的缓冲区已写入数据库，由后台线程删除该段（尚未写入文件的记录直接丢弃）"""
+        with self._lock:
+            segment = self._segments.get(segment_id)
+            if segment is not None:
+                segment.released = True
+
+    def _commit(self) -> None:
+        """把各段新追加的记录写入文件并fsync，删除已释放的段"""
+        with self._lock:
+            work = []
+            for segment in list(self._segments.values()):
+                pending, segment.pending = segment.pending, []
+                work.append((segment, pending))
+        written = []
+        records = 0
+        for segment, pending in work:
+            if segment.released:
+                self._remove(segment)
+                continue
+            if not pending:
+                continue
+            if segment.file is None:
+                segment.file = open(segment.path, "ab")
+                if segment.file.tell() == 0:
+                    segment.file.write(
+                        _HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION,
+                                     RECORD_DTYPE.itemsize))
+            segment.file.write(pack_records(pending).tobytes())
+            written.append(segment)
+            records += len(pending)
+        # 组提交：一次fsync覆盖本轮写入的全部记录
+        for segment in written:
+            segment.file.flush()
+            os.fsync(segment.file.fileno())
+        if written:
+            self._stats["journaled_records"] += records
+            self._stats["commits"] += 1
+        # 已结束的段不再追加，关闭文件句柄（rotate前最后追加的记录下一轮以追加方式重新打开写入）
+        for segment, _ in work:
+            if segment.closed and segment.file is not None:
+                segment.file.close()
+                segment.file = None
+
+    def _remove(self, segment: _Segment) -> None:
+        if segment.file is not None:
+            segment.file.close()
+            segment.file = None
+        if os.path.exists(segment.path):
+            os.remove(segment.path)
+        with self._lock:
+            self._segments.pop(segment.segment_id, None)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.commit_interval):
+            try:
+                self._commit()
+            except Exception as e:
+                main_logger.error(f"TickJournal[{self.name}]",
+                                  f"Failed to commit journal: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["journal_segments"] = len(self._segments)
+        return stats
+
+    def close(self) -> None:
+        """停止后台线程并做最后一次提交，未释放的段保留在磁盘上供下次启动重放"""
+        self._stop.set()
+        self._thread.join()
+        self._commit()
+        with self._lock:
+            segments = list(self._segments.values())
+        for segment in segments:
+            if segment.file is not None:
+                segment.file.close()
+                segment.file = None
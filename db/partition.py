@@ -0,0 +1,267 @@
+import os
+import re
+import threading
+import pandas as pd
+from typing import Any, Callable, Dict, List, Optional, Union
+from db.buffer import TickBatch, split_by_trading_day
+from db.interface import DatabaseInterface
+from model.market_data import DAY_MS, exchange_epoch_ms
+from utils.logger import main_logger
+
+
+def symbol_of(instrument_id: str) -> str:
+    """提取合约的品种前缀（字母部分），如 rb2601 -> rb"""
+    return ''.join([c for c in instrument_id if c.isalpha()])
+
+
+def exchange_of(instrument_id: str, component: str) -> Optional[str]:
+    """
+    获取合约对应的交易所，合约必须存在于instrument.yml中
+    找不到时记录错误并返回None
+    """
+    import controller.tools
+    # 确保contract_exchange_map已初始化
+    if controller.tools.contract_exchange_map is None:
+        controller.tools.init_contract_exchange_map()
+    exchange = controller.tools.contract_exchange_map.get(instrument_id)
+    if not exchange:
+        main_logger.error(component, f"合约{instrument_id}不在instrument.yml配置中")
+    return exchange
+
+
+# 交易日分区目录名，如 20251215；缺少TradingDay的记录写入unknown目录
+TRADING_DAY_PATTERN = re.compile(r"^\d{8}$")
+UNKNOWN_TRADING_DAY = "unknown"
+
+
+class _Partition:
+    """一个交易日分区的处理器及正在使用它的线程数"""
+
+    def __init__(self, trading_day: str, handler: DatabaseInterface):
+        self.trading_day = trading_day
+        self.handler = handler
+        self.users = 0
+        # 已被新交易日取代，最后一个使用者释放后在后台关闭
+        self.retired = False
+
+
+class TradingDayHandler(DatabaseInterface):
+    """
+    按交易日分区的处理器包装，用于单文件存储（CSV/SQLite3/HDF5）
+    每个交易日一个子目录（db_path/交易日/），由handler_factory(目录)创建该日的处理器。
+    收到更新交易日的行情时切换到新分区，旧分区在写入完成后由后台线程刷新并关闭，
+    不阻塞行情写入；夜盘行情按下一交易日分区（郑商所夜盘TradingDay为自然日，拆分批次时修正），
+    因此夜盘开始时即切换。
+    迟到的旧交易日行情和查询临时打开对应分区，用完即关闭
+    """
+
+    def __init__(self,
+                 handler_factory: Callable[[str], DatabaseInterface],
+                 db_path: str = "db",
+                 thread_safe: bool = False):
+        self.handler_factory = handler_factory
+        self.db_path = db_path
+        os.makedirs(db_path, exist_ok=True)
+        self.thread_safe = thread_safe
+        # 交易日 -> 打开的分区
+        self._partitions: Dict[str, _Partition] = {}
+        self._current: Optional[str] = None
+        # 交易日 -> 正在后台关闭该分区的线程
+        self._closers: Dict[str, threading.Thread] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def current_trading_day(self) -> Optional[str]:
+        return self._current
+
+    def _open(self, trading_day: str) -> _Partition:
+        """打开交易日分区（调用方持有锁，且该分区没有在后台关闭）"""
+        partition = _Partition(
+            trading_day,
+            self.handler_factory(os.path.join(self.db_path, trading_day)))
+        self._partitions[trading_day] = partition
+        return partition
+
+    def _close_async(self, partition: _Partition) -> None:
+        """在后台线程中刷新并关闭已切换掉的分区"""
+
+        def close():
+            try:
+                partition.handler.close()
+                main_logger.info(
+                    "TradingDayHandler",
+                    f"Closed partition {partition.trading_day} in {self.db_path}")
+            except Exception as e:
+                main_logger.error(
+                    "TradingDayHandler",
+                    f"Failed to close partition {partition.trading_day}: {e}")
+
+        thread = threading.Thread(
+            target=close,
+            name=f"TradingDayHandler-close-{partition.trading_day}",
+            daemon=True)
+        self._closers[partition.trading_day] = thread
+        thread.start()
+
+    def _acquire(self, trading_day: str, rollover: bool = True) -> _Partition:
+        """
+        获取交易日分区并登记使用
+        rollover为True时遇到更新的交易日切换当前分区（写入），否则只临时打开（查询）
+        """
+        while True:
+            with self._lock:
+                if not trading_day:
+                    # 缺少TradingDay的记录归入当前交易日
+                    trading_day = self._current or UNKNOWN_TRADING_DAY
+                partition = self._partitions.get(trading_day)
+                closer = None
+                if partition is None:
+                    closer = self._closers.get(trading_day)
+                    if closer is not None and not closer.is_alive():
+                        del self._closers[trading_day]
+                        closer = None
+                    if closer is None:
+                        partition = self._open(trading_day)
+                if closer is None:
+                    self._rollover(partition, rollover)
+                    partition.users += 1
+                    return partition
+            # 该分区仍在后台关闭，在锁外等待关闭完成后重新获取，不阻塞其他分区的写入
+            closer.join()
+
+    def _rollover(self, partition: _Partition, rollover: bool) -> None:
+        """遇到更新的交易日时切换当前分区，旧分区没有使用者时在后台关闭（调用方持有锁）"""
+        trading_day = partition.trading_day
+        if not (rollover and TRADING_DAY_PATTERN.match(trading_day) and
+                (self._current is None or trading_day > self._current)):
+            return
+        previous = self._partitions.get(self._current)
+        if self._current is not None:
+            main_logger.info(
+                "TradingDayHandler",
+                f"Trading day changed {self._current} -> {trading_day}, "
+                f"rolling over {self.db_path}")
+        self._current = trading_day
+        if previous is not None:
+            previous.retired = True
+            if previous.users == 0:
+                del self._partitions[previous.trading_day]
+                self._close_async(previous)
+
+    def _release(self, partition: _Partition) -> None:
+        """释放分区，非当前交易日的分区在最后一个使用者释放后关闭"""
+        with self._lock:
+            partition.users -= 1
+            if (partition.users or partition.trading_day == self._current
+                    or self._partitions.get(partition.trading_day)
+                    is not partition):
+                return
+            del self._partitions[partition.trading_day]
+            if partition.retired:
+                self._close_async(partition)
+                return
+        partition.handler.close()
+
+    def save(self, data: Union[List[Dict[str, Any]],
+                               TickBatch]) -> Optional[int]:
+        """返回各分区处理器实际写入的记录数之和，都全部写入时返回None"""
+        if not len(data):
+            return None
+        written, skipped = 0, False
+        for trading_day, part in split_by_trading_day(data):
+            partition = self._acquire(trading_day)
+            try:
+                count = partition.handler.save(part)
+            finally:
+                self._release(partition)
+            skipped = skipped or count is not None
+            written += len(part) if count is None else count
+        return written if skipped else None
+
+    def trading_days(self) -> List[str]:
+        """磁盘上已有的交易日分区，按交易日排序（unknown排在最前）"""
+        try:
+            names = os.listdir(self.db_path)
+        except FileNotFoundError:
+            return []
+        days = sorted(name for name in names
+                      if TRADING_DAY_PATTERN.match(name)
+                      and os.path.isdir(os.path.join(self.db_path, name)))
+        if os.path.isdir(os.path.join(self.db_path, UNKNOWN_TRADING_DAY)):
+            days.insert(0, UNKNOWN_TRADING_DAY)
+        return days
+
+    @staticmethod
+    def _may_contain(trading_day: str, start_ms: Optional[int],
+                     end_ms: Optional[int]) -> bool:
+        """
+        按交易日粗略判断分区是否可能包含时间范围内的行情
+        交易日D的行情不晚于D当天结束，不早于D前7天（长假前后的夜盘）
+        """
+        if not TRADING_DAY_PATTERN.match(trading_day):
+            return True
+        day_start = exchange_epoch_ms(trading_day, "00:00:00", 0)
+        if start_ms is not None and start_ms >= day_start + DAY_MS:
+            return False
+        if end_ms is not None and end_ms <= day_start - 7 * DAY_MS:
+            return False
+        return True
+
+    def load(self,
+             table_name: str,
+             limit: Optional[int] = None,
+             columns: Optional[List[str]] = None,
+             start_ms: Optional[int] = None,
+             end_ms: Optional[int] = None) -> pd.DataFrame:
+        days = [
+            day for day in self.trading_days()
+            if self._may_contain(day, start_ms, end_ms)
+        ]
+        frames = []
+        rows = 0
+        found = False
+        # 只取最后limit行时从最新的交易日向前读取
+        for trading_day in (reversed(days) if limit else days):
+            partition = self._acquire(trading_day, rollover=False)
+            try:
+                # 各处理器对不存在的表抛出的异常不同，先按表名筛选
+                if table_name not in partition.handler.get_tables():
+                    continue
+                df = partition.handler.load(table_name, limit, columns,
+                                            start_ms, end_ms)
+            finally:
+                self._release(partition)
+            found = True
+            frames.append(df)
+            rows += len(df)
+            if limit and rows >= limit:
+                break
+        if not found:
+            raise KeyError(f"Table {table_name} not found")
+        if limit:
+            frames.reverse()
+        df = pd.concat(frames, ignore_index=True)
+        return df.tail(limit).reset_index(drop=True) if limit else df
+
+    def get_tables(self) -> List[str]:
+        tables = set()
+        for trading_day in self.trading_days():
+            partition = self._acquire(trading_day, rollover=False)
+            try:
+                tables.update(partition.handler.get_tables())
+            finally:
+                self._release(partition)
+        return sorted(tables)
+
+    def close(self) -> None:
+        # 关闭所有打开的分区，并等待后台关闭的分区完成
+        with self._lock:
+            partitions = list(self._partitions.values())
+            self._partitions.clear()
+            self._current = None
+            closers = list(self._closers.values())
+            self._closers.clear()
+        for partition in partitions:
+            partition.handler.close()
+        for closer in closers:
+            closer.join()
@@ -0,0 +1,81 @@
+import os
+import threading
+import yaml
+from typing import Dict, Optional
+from db.partition import symbol_of
+from utils.logger import main_logger
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
+# 各品种最小变动价位（PriceTick）配置文件
+PRICE_TICK_FILE = os.path.join(_PROJECT_ROOT, "price_tick.yml")
+# 合约查询（OnRspQryInstrument）返回的合约级最小变动价位缓存，优先于品种配置
+PRICE_TICK_CACHE_FILE = os.path.join(_PROJECT_ROOT, "appfiles",
+                                     "price_tick_cache.yml")
+
+# 全局最小变动价位表（合约/品种 -> PriceTick），首次使用时加载
+_products: Optional[Dict[str, float]] = None
+_instruments: Dict[str, float] = {}
+# 合约缓存有尚未写入文件的变化
+_dirty = False
+_lock = threading.Lock()
+
+
+def _read_yaml(path: str) -> Dict[str, float]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {
+                str(name): float(value)
+                for name, value in (yaml.safe_load(f) or {}).items()
+            }
+    except FileNotFoundError:
+        return {}
+
+
+def load_price_ticks(path: str = PRICE_TICK_FILE,
+                     cache_path: str = PRICE_TICK_CACHE_FILE) -> None:
+    """从品种配置和合约缓存加载最小变动价位表，替换全局缓存"""
+    global _products, _instruments, _dirty
+    products = _read_yaml(path)
+    if not products:
+        main_logger.error("PriceTick", f"最小变动价位配置为空或不存在：{path}")
+    instruments = _read_yaml(cache_path)
+    with _lock:
+        _products, _instruments = products, instruments
+        _dirty = False
+
+
+def price_tick_of(instrument_id: str) -> Optional[float]:
+    """合约的最小变动价位：先查合约缓存，再查品种配置，找不到时返回None"""
+    if _products is None:
+        load_price_ticks()
+    price_tick = _instruments.get(instrument_id)
+    if price_tick is None:
+        price_tick = _products.get(symbol_of(instrument_id))
+    return price_tick
+
+
+def update_price_tick(instrument_id: str, price_tick: float) -> None:
+    """
+    记录合约查询返回的最小变动价位（只更新内存中的缓存）
+    合约查询逐条返回全部合约，查询结束后调用save_price_tick_cache一次写入文件
+    """
+    global _dirty
+    if _products is None:
+        load_price_ticks()
+    with _lock:
+        if _instruments.get(instrument_id) == price_tick:
+            return
+        _instruments[instrument_id] = float(price_tick)
+        _dirty = True
+
+
+def save_price_tick_cache(cache_path: str = PRICE_TICK_CACHE_FILE) -> None:
+    """合约缓存有变化时写入合约缓存文件"""
+    global _dirty
+    with _lock:
+        if not _dirty:
+            return
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "w", encoding="utf-8") as f:
+            yaml.safe_dump(dict(sorted(_instruments.items())), f)
+        _dirty = False
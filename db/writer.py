@@ -0,0 +1,505 @@
+import collections
+import os
+import pickle
+import queue
+import tempfile
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+from db.buffer import TickBatch, instrument_id_of
+from utils.logger import main_logger
+
+# 队列满时的背压策略
+BACKPRESSURE_BLOCK = "block"  # 阻塞生产者，直到写线程腾出空间
+BACKPRESSURE_DROP_OLDEST = "drop_oldest"  # 丢弃队列中最旧的批次
+BACKPRESSURE_SPILL = "spill"  # 溢写到本地临时文件，稍后按顺序回放
+BACKPRESSURE_POLICIES = (BACKPRESSURE_BLOCK, BACKPRESSURE_DROP_OLDEST,
+                         BACKPRESSURE_SPILL)
+
+
+class SpillFile:
+    """溢写文件：按顺序追加批次，并按写入顺序读回"""
+
+    def __init__(self, spill_dir: Optional[str] = None, prefix: str = "spill"):
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix=f"{prefix}_",
+                                         suffix=".spill",
+                                         dir=spill_dir)
+        self._file = os.fdopen(fd, "w+b")
+        self._read_pos = 0
+        self._write_pos = 0
+        self.pending = 0  # 尚未读回的批次数
+
+    def append(self, batch: Any) -> None:
+        """追加一个批次到文件末尾"""
+        self._file.seek(self._write_pos)
+        pickle.dump(batch, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.flush()
+        self._write_pos = self._file.tell()
+        self.pending += 1
+
+    def pop(self) -> Any:
+        """按写入顺序读回一个批次，全部读完后截断文件"""
+        self._file.seek(self._read_pos)
+        batch = pickle.load(self._file)
+        self._read_pos = self._file.tell()
+        self.pending -= 1
+        if self.pending == 0:
+            # 已全部回放，截断文件释放磁盘空间
+            self._file.seek(0)
+            self._file.truncate()
+            self._read_pos = self._write_pos = 0
+        return batch
+
+    def close(self) -> None:
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class MemoryBudget:
+    """
+    进程内所有收集器共享的内存预算
+    统计已flush但尚未写入数据库的批次占用的字节数，预留失败时由收集器把批次溢写到
+    spill_dir下的溢写文件，写入方空闲后再按顺序读回写入。
+    预算为空时总能预留一个批次，回放溢写批次时强制预留，因此超出预算的内存最多为每个收集器一个批次
+    """
+
+    def __init__(self, max_bytes: int, spill_dir: Optional[str] = None):
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self._lock = threading.Lock()
+        self._stats = {
+            "used_bytes": 0,
+            "peak_bytes": 0,
+            "spilled_records": 0,
+            "spilled_bytes": 0,  # 累计溢写的估算字节数
+            "spill_pending_bytes": 0,  # 尚未读回的溢写字节数
+        }
+
+    def reserve(self, nbytes: int, force: bool = False) -> bool:
+        """预留nbytes字节，超出预算时返回False（force为True时总是预留）"""
+        with self._lock:
+            used = self._stats["used_bytes"]
+            if not force and used and used + nbytes > self.max_bytes:
+                return False
+            self._stats["used_bytes"] = used + nbytes
+            self._stats["peak_bytes"] = max(self._stats["peak_bytes"],
+                                            used + nbytes)
+            return True
+
+    def release(self, nbytes: int) -> None:
+        """批次写完后归还预留的字节数"""
+        with self._lock:
+            self._stats["used_bytes"] -= nbytes
+
+    def spill_file(self, prefix: str) -> SpillFile:
+        return SpillFile(self.spill_dir, prefix)
+
+    def count_spill(self, records: int, nbytes: int) -> None:
+        """记录溢写（nbytes为正）或读回（nbytes为负）的批次"""
+        with self._lock:
+            if nbytes > 0:
+                self._stats["spilled_records"] += records
+                self._stats["spilled_bytes"] += nbytes
+            self._stats["spill_pending_bytes"] += nbytes
+
+    def stats(self) -> Dict[str, int]:
+        """返回预算、当前和峰值占用字节数以及溢写量"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+class _WriterShard:
+    """单个写线程及其有界队列、溢写文件"""
+
+    def __init__(self, writer: "AsyncWriter", index: int):
+        self.writer = writer
+        self.queue: queue.Queue = queue.Queue(maxsize=writer.queue_size)
+        self.lock = threading.Lock()
+        self.spill: Optional[SpillFile] = None
+        self.thread = threading.Thread(target=self._run,
+                                       name=f"{writer.name}-writer-{index}",
+                                       daemon=True)
+
+    def submit(self, batch: List[Any]) -> None:
+        writer = self.writer
+        if writer.backpressure == BACKPRESSURE_SPILL:
+            with self.lock:
+                # 溢写文件中仍有积压时，新批次也必须进入溢写文件，保证顺序
+                if self.spill is None or self.spill.pending == 0:
+                    try:
+                        self.queue.put_nowait(batch)
+                        return
+                    except queue.Full:
+                        pass
+                if self.spill is None:
+                    self.spill = SpillFile(writer.spill_dir, writer.name)
+                self.spill.append(batch)
+            writer._count("spilled_records", len(batch))
+        elif writer.backpressure == BACKPRESSURE_DROP_OLDEST:
+            while True:
+                try:
+                    self.queue.put_nowait(batch)
+                    return
+                except queue.Full:
+                    try:
+                        dropped = self.queue.get_nowait()
+                    except queue.Empty:
+                        continue
+                    writer._count("dropped_records", len(dropped))
+                    writer._count("queued_records", -len(dropped))
+                    main_logger.error(
+                        writer.name,
+                        f"Write queue full, dropped {len(dropped)} records")
+        else:
+            self.queue.put(batch)
+
+    def _next_batch(self) -> Optional[List[Any]]:
+        # 溢写文件有积压时新批次都进入溢写文件，队列中只剩开始溢写前的批次：
+        # 先取完队列再立即回放，不等待队列超时
+        with self.lock:
+            if self.spill is not None and self.spill.pending:
+                try:
+                    return self.queue.get_nowait()
+                except queue.Empty:
+                    return self.spill.pop()
+        try:
+            return self.queue.get(timeout=0.1)
+        except queue.Empty:
+            return None
+
+    def is_idle(self) -> bool:
+        with self.lock:
+            spilled = self.spill.pending if self.spill is not None else 0
+        return self.queue.empty() and spilled == 0
+
+    def _run(self) -> None:
+        writer = self.writer
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                if writer._closing.is_set() and self.is_idle():
+                    break
+                continue
+            writer._write(batch)
+
+    def close(self) -> None:
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+
+
+class AsyncWriter:
+    """
+    异步写入器
+    生产者线程只负责把批次放入有界队列，由后台写线程调用save_func落盘。
+    多个写线程时按InstrumentID分片，同一合约始终由同一线程写入，保证合约内顺序。
+    """
+
+    def __init__(self,
+                 save_func: Callable[[List[Any]], None],
+                 queue_size: int = 64,
+                 writer_threads: int = 1,
+                 backpressure: str = BACKPRESSURE_BLOCK,
+                 spill_dir: Optional[str] = None,
+                 thread_safe: bool = False,
+                 name: str = "AsyncWriter"):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(
+                f"Unsupported backpressure policy: {backpressure}. "
+                f"Supported policies: {', '.join(BACKPRESSURE_POLICIES)}")
+        if writer_threads < 1:
+            raise ValueError("writer_threads must be at least 1")
+        self.save_func = save_func
+        self.queue_size = queue_size
+        self.backpressure = backpressure
+        self.spill_dir = spill_dir
+        self.name = name
+        # 处理器非线程安全时，多个写线程串行调用save_func
+        self._save_lock = None if thread_safe else threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "queued_records": 0,
+            "written_records": 0,
+            "dropped_records": 0,
+            "spilled_records": 0,
+            "failed_records": 0,
+            "skipped_records": 0,  # 处理器跳过的记录（如合约不在instrument.yml中）
+        }
+        self._closing = threading.Event()
+        self._shard_cache: Dict[str, int] = {}
+        self._shards = [
+            _WriterShard(self, i) for i in range(writer_threads)
+        ]
+        for shard in self._shards:
+            shard.thread.start()
+
+    def _count(self, key: str, value: int) -> None:
+        with self._stats_lock:
+            self._stats[key] += value
+
+    def _shard_of(self, instrument_id: str) -> int:
+        shard = self._shard_cache.get(instrument_id)
+        if shard is None:
+            shard = zlib.crc32(str(instrument_id).encode()) % len(
+                self._shards)
+            self._shard_cache[instrument_id] = shard
+        return shard
+
+    def submit(self, batch: Any) -> None:
+        """提交一个批次（字典列表或TickBatch），按背压策略处理队列满的情况"""
+        if not len(batch):
+            return
+        if self._closing.is_set():
+            raise RuntimeError(f"{self.name} is closed")
+        if len(self._shards) == 1:
+            self._count("queued_records", len(batch))
+            self._shards[0].submit(batch)
+            return
+        # 按合约分片，保证同一合约的数据由同一写线程顺序写入
+        if isinstance(batch, TickBatch):
+            parts = batch.split(self._shard_of)
+        else:
+            parts: Dict[int, List[Any]] = {}
+            for item in batch:
+                shard = self._shard_of(instrument_id_of(item))
+                parts.setdefault(shard, []).append(item)
+        for shard, part in parts.items():
+            self._count("queued_records", len(part))
+            self._shards[shard].submit(part)
+
+    def _write(self, batch: List[Any]) -> None:
+        try:
+            if self._save_lock is None:
+                written = self.save_func(batch)
+            else:
+                with self._save_lock:
+                    written = self.save_func(batch)
+            written = len(batch) if written is None else written
+            self._count("written_records", written)
+            self._count("skipped_records", len(batch) - written)
+        except Exception as e:
+            self._count("failed_records", len(batch))
+            main_logger.error(self.name,
+                              f"Failed to write {len(batch)} records: {e}")
+        finally:
+            self._count("queued_records", -len(batch))
+
+    def stats(self) -> Dict[str, int]:
+        """返回队列深度、写入/丢弃/溢写记录数等计数器"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = sum(shard.queue.qsize()
+                                   for shard in self._shards)
+        stats["spill_depth"] = sum(shard.spill.pending
+                                   for shard in self._shards
+                                   if shard.spill is not None)
+        return stats
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """停止接收新批次，等待队列和溢写文件全部写完后退出写线程"""
+        self._closing.set()
+        for shard in self._shards:
+            shard.thread.join(timeout)
+            if shard.thread.is_alive():
+                main_logger.error(
+                    self.name,
+                    f"Writer thread {shard.thread.name} did not exit in time")
+            else:
+                shard.close()
+
+
+class PooledWriter:
+    """
+    共享写线程池中的一个写入队列（通常对应一个交易所的收集器）
+    与AsyncWriter接口一致；同一时刻最多一个池线程处理该队列，因此批次按提交顺序写入，
+    队列满时阻塞生产者
+    """
+
+    def __init__(self, pool: "WriterPool", save_func: Callable[[Any], None],
+                 queue_size: int, name: str):
+        self.pool = pool
+        self.save_func = save_func
+        self.queue_size = queue_size
+        self.name = name
+        self._batches: collections.deque = collections.deque()
+        self._cond = threading.Condition()
+        # 已在池的就绪队列中或正被池线程处理
+        self._scheduled = False
+        self._closing = False
+        self._stats = {
+            "queued_records": 0,
+            "written_records": 0,
+            "failed_records": 0,
+            "skipped_records": 0,
+            "flush_count": 0,
+            "flush_latency_ms": 0.0,  # 最近一次写入耗时
+            "max_flush_latency_ms": 0.0,
+            "total_flush_latency_ms": 0.0,
+        }
+
+    def submit(self, batch: Any) -> None:
+        """提交一个批次，队列已满时等待"""
+        if not len(batch):
+            return
+        with self._cond:
+            if self._closing:
+                raise RuntimeError(f"{self.name} is closed")
+            while len(self._batches) >= self.queue_size:
+                self._cond.wait()
+            self._batches.append(batch)
+            self._stats["queued_records"] += len(batch)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.pool._schedule(self)
+
+    def _run_one(self) -> None:
+        """由池线程调用：写入队首批次，队列中还有批次时重新排队"""
+        with self._cond:
+            batch = self._batches.popleft()
+            self._cond.notify_all()
+        start = time.perf_counter()
+        written = 0
+        try:
+            written = self.save_func(batch)
+            written = len(batch) if written is None else written
+            failed = False
+        except Exception as e:
+            failed = True
+            main_logger.error(self.name,
+                              f"Failed to write {len(batch)} records: {e}")
+        latency_ms = (time.perf_counter() - start) * 1000
+        with self._cond:
+            stats = self._stats
+            stats["queued_records"] -= len(batch)
+            if failed:
+                stats["failed_records"] += len(batch)
+            else:
+                stats["written_records"] += written
+                stats["skipped_records"] += len(batch) - written
+            stats["flush_count"] += 1
+            stats["flush_latency_ms"] = latency_ms
+            stats["max_flush_latency_ms"] = max(
+                stats["max_flush_latency_ms"], latency_ms)
+            stats["total_flush_latency_ms"] += latency_ms
+            reschedule = bool(self._batches)
+            if not reschedule:
+                self._scheduled = False
+                self._cond.notify_all()
+        if reschedule:
+            # 每次只写一个批次后重新排队，各交易所轮流使用池线程
+            self.pool._schedule(self)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回队列深度、写入记录数和写入耗时"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queue_depth"] = len(self._batches)
+        total = stats.pop("total_flush_latency_ms")
+        stats["avg_flush_latency_ms"] = (total / stats["flush_count"]
+                                         if stats["flush_count"] else 0.0)
+        return stats
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """停止接收新批次，等待队列中的批次全部写完"""
+        with self._cond:
+            self._closing = True
+            if not self._cond.wait_for(lambda: not self._scheduled, timeout):
+                main_logger.error(self.name,
+                                  "Pooled writer did not drain in time")
+        self.pool._unregister(self)
+
+
+class WriterPool:
+    """
+    进程内共享的写线程池
+    各交易所的收集器通过writer()获得各自的有界写入队列，池线程并发写入不同交易所的文件
+    （HDF5/SQLite等在C代码和I/O中释放GIL）；同一队列同时只由一个线程处理，保证交易所内顺序
+    """
+
+    def __init__(self,
+                 threads: int = 4,
+                 queue_size: int = 4,
+                 name: str = "WriterPool"):
+        if threads < 1:
+            raise ValueError("threads must be at least 1")
+        if queue_size < 1:
+            raise ValueError("queue_size must be at least 1")
+        self.queue_size = queue_size
+        self.name = name
+        # 有待写批次的写入队列
+        self._ready: queue.Queue = queue.Queue()
+        self._writers: List[PooledWriter] = []
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._threads = [
+            threading.Thread(target=self._run,
+                             name=f"{name}-{i}",
+                             daemon=True) for i in range(threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def writer(self,
+               save_func: Callable[[Any], None],
+               name: str,
+               queue_size: Optional[int] = None) -> PooledWriter:
+        """创建一个写入队列，queue_size默认为池的queue_size"""
+        writer = PooledWriter(self, save_func, queue_size or self.queue_size,
+                              name)
+        with self._lock:
+            self._writers.append(writer)
+        return writer
+
+    def _schedule(self, writer: PooledWriter) -> None:
+        self._ready.put(writer)
+
+    def _unregister(self, writer: PooledWriter) -> None:
+        with self._lock:
+            if writer in self._writers:
+                self._writers.remove(writer)
+
+    def _run(self) -> None:
+        while True:
+            writer = self._ready.get()
+            if writer is None:
+                break
+            with self._lock:
+                self._busy += 1
+            try:
+                writer._run_one()
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """返回线程数、忙碌线程数、待调度的写入队列数以及各写入队列的统计"""
+        with self._lock:
+            writers = list(self._writers)
+            busy = self._busy
+        return {
+            "threads": len(self._threads),
+            "busy_threads": busy,
+            "ready_writers": self._ready.qsize(),
+            "writers": {writer.name: writer.stats()
+                        for writer in writers},
+        }
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """等待所有写入队列写完后停止池线程"""
+        with self._lock:
+            writers = list(self._writers)
+        for writer in writers:
+            writer.close(timeout)
+        for _ in self._threads:
+            self._ready.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
@@ -1,5 +1,181 @@
 # -*- coding: utf-8 -*-
 """行情数据模型"""
+import datetime
+import operator
+import time
+from collections import namedtuple
+import numpy as np
+
+# 深度行情字段及其NumPy类型（与MarketData.to_dict的字段和顺序一致，
+# 整数统一使用int64，与字典经pandas推断出的类型保持一致，两种缓冲区模式可写入同一张表）
+MARKET_DATA_SCHEMA = [
+    ("InstrumentID", "U31"),
+    ("TradingDay", "U8"),
+    ("ActionDay", "U8"),
+    ("UpdateTime", "U8"),
+    ("UpdateMillisec", "i8"),
+    ("LastPrice", "f8"),
+    ("Volume", "i8"),
+    ("PreSettlementPrice", "f8"),
+    ("PreClosePrice", "f8"),
+    ("PreOpenInterest", "f8"),
+    ("OpenPrice", "f8"),
+    ("HighestPrice", "f8"),
+    ("LowestPrice", "f8"),
+    ("LimitUpPrice", "f8"),
+    ("LimitDownPrice", "f8"),
+    ("OpenInterest", "f8"),
+    ("Turnover", "f8"),
+    ("AveragePrice", "f8"),
+]
+for _level in range(1, 6):
+    MARKET_DATA_SCHEMA += [
+        (f"BidPrice{_level}", "f8"),
+        (f"BidVolume{_level}", "i8"),
+        (f"AskPrice{_level}", "f8"),
+        (f"AskVolume{_level}", "i8"),
+    ]
+
+# CTP行情对象上的字段
+CTP_FIELDS = [name for name, _ in MARKET_DATA_SCHEMA]
+
+# 采集时补充的时间戳：交易所时间（epoch毫秒，已修正夜盘日期，写入前由收集器批量计算）
+# 和本地接收时间（单调时钟纳秒，收到行情时记录）
+TIMESTAMP_COLUMN = "epoch_ms"
+RECEIVE_COLUMN = "recv_ns"
+MARKET_DATA_SCHEMA += [(TIMESTAMP_COLUMN, "i8"), (RECEIVE_COLUMN, "i8")]
+
+# 字段名列表
+MARKET_DATA_FIELDS = [name for name, _ in MARKET_DATA_SCHEMA]
+
+# 结构化数组类型，供列式缓冲区和二进制存储使用
+MARKET_DATA_DTYPE = np.dtype(MARKET_DATA_SCHEMA)
+
+# 交易所时间为北京时间（UTC+8），时间戳统一换算为epoch毫秒
+EXCHANGE_UTC_OFFSET_MS = 8 * 3600 * 1000
+DAY_MS = 86400000
+# 单调时钟到系统时钟的偏移，用于把接收时间换算为本地日期
+MONOTONIC_OFFSET_NS = time.time_ns() - time.monotonic_ns()
+_EPOCH_DATE = datetime.date(1970, 1, 1)
+# 日期字符串 -> 当日0点（交易所时间）的epoch毫秒
+_day_start_cache = {}
+
+
+def exchange_epoch_ms(action_day: str, update_time: str,
+                      update_millisec: int = 0) -> int:
+    """
+    将ActionDay/UpdateTime/UpdateMillisec换算为epoch毫秒
+    :param action_day: 业务日期，如 20251215
+    :param update_time: 最后修改时间，如 09:00:01
+    :param update_millisec: 最后修改毫秒
+    """
+    day_start = _day_start_cache.get(action_day)
+    if day_start is None:
+        day = datetime.date(int(action_day[:4]), int(action_day[4:6]),
+                            int(action_day[6:8]))
+        day_start = ((day - _EPOCH_DATE).days * 86400000 -
+                     EXCHANGE_UTC_OFFSET_MS)
+        _day_start_cache[action_day] = day_start
+    seconds = (int(update_time[:2]) * 3600 + int(update_time[3:5]) * 60 +
+               int(update_time[6:8]))
+    return day_start + seconds * 1000 + int(update_millisec)
+
+
+def _digits(values, width: int) -> np.ndarray:
+    """将定长数字字符串数组按字符拆成数字矩阵"""
+    codes = np.ascontiguousarray(np.asarray(values, dtype=f"U{width}"))
+    return codes.view(np.uint32).reshape(-1, width).astype(np.int64) - 48
+
+
+def exchange_epoch_ms_array(action_day, update_time,
+                            update_millisec) -> np.ndarray:
+    """
+    exchange_epoch_ms的向量化版本，返回int64的epoch毫秒数组
+    :param action_day: 业务日期数组，如 20251215
+    :param update_time: 最后修改时间数组，如 09:00:01
+    :param update_millisec: 最后修改毫秒数组
+    """
+    day = _digits(action_day, 8)
+    year = day[:, 0] * 1000 + day[:, 1] * 100 + day[:, 2] * 10 + day[:, 3]
+    month = day[:, 4] * 10 + day[:, 5]
+    mday = day[:, 6] * 10 + day[:, 7]
+    # 公历日期转1970-01-01起的天数（days_from_civil算法）
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + mday - 1
+    day_of_era = (year_of_era * 365 + year_of_era // 4 - year_of_era // 100 +
+                  day_of_year)
+    days = era * 146097 + day_of_era - 719468
+
+    clock = _digits(update_time, 8)
+    seconds = ((clock[:, 0] * 10 + clock[:, 1]) * 3600 +
+               (clock[:, 3] * 10 + clock[:, 4]) * 60 + clock[:, 6] * 10 +
+               clock[:, 7])
+    return (days * 86400000 - EXCHANGE_UTC_OFFSET_MS + seconds * 1000 +
+            np.asarray(update_millisec, dtype=np.int64))
+
+
+def tick_epoch_ms(action_day, update_time, update_millisec,
+                  recv_ns=None) -> np.ndarray:
+    """
+    计算行情的交易所时间戳（epoch毫秒），按接收时间向量化修正夜盘日期
+    夜盘的ActionDay不可靠（大商所填为下一交易日，郑商所TradingDay为自然日），
+    有接收时间的记录把日期修正为离本地接收时间最近的那一天，UpdateTime保持不变
+    :param recv_ns: 本地接收时间（单调时钟纳秒）数组，0或None表示没有接收时间
+    """
+    epoch_ms = exchange_epoch_ms_array(action_day, update_time,
+                                       update_millisec)
+    if recv_ns is None:
+        return epoch_ms
+    recv_ns = np.asarray(recv_ns, dtype=np.int64)
+    received = recv_ns != 0
+    if not received.any():
+        return epoch_ms
+    local_ms = (recv_ns + MONOTONIC_OFFSET_NS) // 1000000
+    days = np.rint((epoch_ms - local_ms) / DAY_MS).astype(np.int64)
+    return np.where(received, epoch_ms - days * DAY_MS, epoch_ms)
+
+
+# 一次性读取全部CTP字段的预编译提取器
+_extract_fields = operator.attrgetter(*CTP_FIELDS)
+# 字段缺失时使用的默认值
+_FIELD_DEFAULTS = tuple("" if kind == "U" else 0
+                        for kind in (np.dtype(t).kind
+                                     for _, t in MARKET_DATA_SCHEMA))
+
+
+class Tick(namedtuple("Tick", MARKET_DATA_FIELDS)):
+    """
+    紧凑的行情记录（热路径使用）
+    基于元组存储，字段顺序与MARKET_DATA_FIELDS一致，
+    可直接追加到列式缓冲区或批量构造DataFrame，无需逐条构造字典
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_ctp(cls, pDepthMarketData) -> "Tick":
+        """
+        从CTP行情对象一次性提取全部字段，并记录本地接收时间
+        epoch_ms留空（0），写入前由收集器批量计算
+        :param pDepthMarketData: CTP API返回的行情数据对象
+        """
+        recv_ns = time.monotonic_ns()
+        try:
+            fields = _extract_fields(pDepthMarketData)
+        except AttributeError:
+            # 个别字段缺失时回退到逐字段读取
+            fields = tuple(
+                getattr(pDepthMarketData, name, default)
+                for name, default in zip(CTP_FIELDS, _FIELD_DEFAULTS))
+        return tuple.__new__(cls, fields + (0, recv_ns))
+
+    def to_dict(self):
+        """
+        转换为字典格式（兼容旧接口，热路径上不要使用）
+        :return: 行情数据字典
+        """
+        return dict(zip(MARKET_DATA_FIELDS, self))
 
 
 class MarketData:
@@ -55,6 +231,10 @@ class MarketData:
         self.AskPrice5 = getattr(pDepthMarketData, "AskPrice5", 0)
         self.AskVolume5 = getattr(pDepthMarketData, "AskVolume5", 0)
 
+        # 采集时补充的时间戳
+        self.epoch_ms = 0
+        self.recv_ns = time.monotonic_ns()
+
     def to_dict(self):
         """
         转换为字典格式
@@ -99,4 +279,6 @@ class MarketData:
             "BidVolume5": self.BidVolume5,
             "AskPrice5": self.AskPrice5,
             "AskVolume5": self.AskVolume5,
+            "epoch_ms": self.epoch_ms,
+            "recv_ns": self.recv_ns,
         }
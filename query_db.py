@@ -23,7 +23,7 @@ def main():
                         '-d',
                         type=str,
                         default=DB_TYPE,
-                        help='数据库类型（CSV/SQLite3/HDF5）')
+                        help='数据库类型（CSV/SQLite3/HDF5/Parquet/Memmap/Splayed/Compressed）')
     args = parser.parse_args()
 
     try:
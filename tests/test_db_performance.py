@@ -34,11 +34,14 @@ class TestDBPerformance:
 
     def generate_test_data(self, num_records: int) -> list:
         """生成测试数据"""
+        from controller.tools import init_contract_exchange_map
+        # 按交易所分区的存储（如Parquet）只保存instrument.yml中配置的合约
+        instrument_ids = sorted(init_contract_exchange_map())
         test_data = []
 
         for i in range(num_records):
-            # 生成随机的合约代码
-            instrument_id = f"RB{random.randint(2501, 2612)}"
+            # 轮流使用已配置的合约代码
+            instrument_id = instrument_ids[i % len(instrument_ids)]
 
             # 生成随机的价格和成交量
             last_price = round(random.uniform(3000, 5000), 2)
@@ -140,9 +143,13 @@ class TestDBPerformance:
 
         return test_data
 
-    @pytest.mark.parametrize("db_type", ["CSV", "SQLite3", "HDF5"])
-    def test_write_performance(self, db_type):
-        """测试不同数据库的写入性能"""
+    @pytest.mark.parametrize("buffer_mode", ["list", "columnar"])
+    @pytest.mark.parametrize(
+        "db_type",
+        ["CSV", "SQLite3", "HDF5", "Memmap", "Splayed", "Compressed",
+         "Parquet"])
+    def test_write_performance(self, db_type, buffer_mode):
+        """测试不同数据库、不同缓冲区模式的写入性能"""
         # 生成少量测试数据用于单元测试
         num_records = 1000
         test_data = self.generate_test_data(num_records)
@@ -151,7 +158,8 @@ class TestDBPerformance:
         data_collector = create_data_collector(db_type=db_type,
                                                buffer_size=128,
                                                db_path=self.test_db_path,
-                                               db_name="test_db")
+                                               db_name="test_db",
+                                               buffer_mode=buffer_mode)
 
         try:
             # 测试写入性能
@@ -167,14 +175,18 @@ class TestDBPerformance:
             end_time = time.time()
 
             write_time = end_time - start_time
-            print(f"{db_type} 写入 {num_records} 条记录耗时: {write_time:.4f} 秒")
+            print(f"{db_type}({buffer_mode}) 写入 {num_records} 条记录耗时: "
+                  f"{write_time:.4f} 秒")
             assert write_time > 0  # 确保写入操作完成
 
         finally:
             # 关闭数据收集器
             data_collector.close()
 
-    @pytest.mark.parametrize("db_type", ["CSV", "SQLite3", "HDF5"])
+    @pytest.mark.parametrize(
+        "db_type",
+        ["CSV", "SQLite3", "HDF5", "Memmap", "Splayed", "Compressed",
+         "Parquet"])
     def test_read_performance(self, db_type):
         """测试不同数据库的读取性能"""
         # 生成少量测试数据用于单元测试
@@ -212,6 +224,272 @@ class TestDBPerformance:
             # 关闭数据收集器
             data_collector.close()
 
+    @pytest.mark.parametrize("keep_open", [False, True])
+    def test_hdf5_flush_latency(self, keep_open):
+        """
+        测试HDF5文件增长到100+合约节点时的flush延迟
+        同一交易日内keep_open省去每次flush打开、关闭文件的开销；TradingDay固定，避免随机的
+        交易日触发store切换
+        """
+        data_collector = create_data_collector(
+            db_type="HDF5",
+            buffer_size=64,
+            db_path=self.test_db_path,
+            db_name=f"test_flush_latency_{keep_open}",
+            db_options={"keep_open": keep_open})
+
+        try:
+            latencies = {}
+            for nodes in (10, 50, 120):
+                # 先让文件增长到nodes个合约节点
+                growth_data = self.generate_test_data(nodes)
+                for i, record in enumerate(growth_data):
+                    record["InstrumentID"] = f"IF{i:04d}"
+                    record["TradingDay"] = "20251215"
+                data_collector.save(growth_data)
+
+                # 再测量单个合约多次flush的平均延迟
+                flush_data = self.generate_test_data(64 * 10)
+                for record in flush_data:
+                    record["InstrumentID"] = "IF0000"
+                    record["TradingDay"] = "20251215"
+                start_time = time.time()
+                for i in range(10):
+                    data_collector.save(flush_data[i * 64:(i + 1) * 64])
+                latencies[nodes] = (time.time() - start_time) / 10
+
+            for nodes, latency in latencies.items():
+                print(f"HDF5(keep_open={keep_open}) {nodes} 个节点时 "
+                      f"flush 平均耗时: {latency * 1000:.2f} 毫秒")
+            assert all(latency > 0 for latency in latencies.values())
+
+        finally:
+            data_collector.close()
+
+    @pytest.mark.parametrize("complib", [None, "blosc", "zlib"])
+    def test_hdf5_compression(self, complib):
+        """测试HDF5压缩对文件大小和按时间范围选择性读取延迟的影响"""
+        import pandas as pd
+        db_name = f"test_compression_{complib}"
+        data_collector = create_data_collector(
+            db_type="HDF5",
+            buffer_size=1000,
+            db_path=self.test_db_path,
+            db_name=db_name,
+            db_options={
+                "complib": complib,
+                "complevel": 5,
+                "expected_rows": 20000,
+                "data_columns": ["epoch_ms"],
+            })
+
+        try:
+            # 单一合约按时间递增的20000条行情
+            test_data = self.generate_test_data(20000)
+            for i, record in enumerate(test_data):
+                record["InstrumentID"] = "IF0000"
+                record["UpdateTime"] = (
+                    f"{9 + i // 7200:02d}:{i // 120 % 60:02d}:{i // 2 % 60:02d}")
+                record["UpdateMillisec"] = i % 2 * 500
+            for record in test_data:
+                data_collector.add_data(record)
+            data_collector.flush()
+        finally:
+            data_collector.close()
+
+        db_file = os.path.join(self.test_db_path, f"{db_name}.h5")
+        file_size = os.path.getsize(db_file)
+        with pd.HDFStore(db_file, mode="r") as store:
+            start_time = time.time()
+            full = store.select("IF0000")
+            full_time = time.time() - start_time
+
+            # 选取中间约1%的时间范围，经由epoch_ms上的索引读取
+            start_ms = full["epoch_ms"].iloc[10000]
+            end_ms = full["epoch_ms"].iloc[10200]
+            start_time = time.time()
+            part = store.select(
+                "IF0000", where=f"epoch_ms >= {start_ms} & epoch_ms < {end_ms}")
+            part_time = time.time() - start_time
+
+        print(f"HDF5(complib={complib}) 文件大小: {file_size / 1024:.1f} KB, "
+              f"全量读取: {full_time * 1000:.2f} 毫秒, "
+              f"按时间范围读取 {len(part)} 条: {part_time * 1000:.2f} 毫秒")
+        assert len(full) == 20000
+        assert len(part) == 200
+
+    @pytest.mark.parametrize(
+        "db_type",
+        ["CSV", "SQLite3", "HDF5", "Memmap", "Splayed", "Compressed"])
+    def test_load_tail_latency(self, db_type):
+        """测试读取最后100条记录的耗时不随表大小增长"""
+        data_collector = create_data_collector(
+            db_type=db_type,
+            buffer_size=1000,
+            db_path=self.test_db_path,
+            db_name=f"test_load_tail_{db_type}")
+
+        instrument_id = "IF0000"
+        if db_type == "CSV":
+            # CSV只保存instrument.yml中配置的合约
+            from controller.tools import init_contract_exchange_map
+            instrument_id = next(iter(init_contract_exchange_map()))
+
+        try:
+            latencies = {}
+            total = 0
+            for rows in (5000, 50000):
+                # 先让同一合约的表增长到rows行
+                growth_data = self.generate_test_data(rows - total)
+                for record in growth_data:
+                    record["InstrumentID"] = instrument_id
+                for i in range(0, len(growth_data), 1000):
+                    data_collector.save(growth_data[i:i + 1000])
+                total = rows
+
+                start_time = time.time()
+                df = data_collector.load(instrument_id, 100,
+                                         columns=["UpdateTime", "LastPrice"])
+                latencies[rows] = time.time() - start_time
+                assert df.shape == (100, 2)
+
+            for rows, latency in latencies.items():
+                print(f"{db_type} 表 {rows} 行时读取最后100条耗时: "
+                      f"{latency * 1000:.2f} 毫秒")
+
+        finally:
+            data_collector.close()
+
+    @pytest.mark.parametrize("max_open_files", [16, 256])
+    def test_csv_append_throughput(self, max_open_files):
+        """测试CSV句柄池在不同句柄上限下的追加吞吐量和打开的文件数"""
+        from controller.tools import init_contract_exchange_map
+        # 使用instrument.yml中配置的前100个合约
+        instruments = list(init_contract_exchange_map())[:100]
+        data_collector = create_data_collector(
+            db_type="CSV",
+            buffer_size=500,
+            db_path=os.path.join(self.test_db_path,
+                                 f"csv_pool_{max_open_files}"),
+            db_options={"max_open_files": max_open_files})
+
+        try:
+            num_records = 20000
+            test_data = self.generate_test_data(num_records)
+            for i, record in enumerate(test_data):
+                record["InstrumentID"] = instruments[i % len(instruments)]
+
+            start_time = time.time()
+            for record in test_data:
+                data_collector.add_data(record)
+            data_collector.flush()
+            write_time = time.time() - start_time
+
+            open_files = data_collector.db_handler.open_files
+            print(f"CSV(max_open_files={max_open_files}) 写入 {num_records} 条"
+                  f"记录: {num_records / write_time:.0f} 条/秒, "
+                  f"打开文件数: {open_files}")
+            assert open_files <= max_open_files
+
+        finally:
+            data_collector.close()
+
+    @pytest.mark.parametrize("db_type", ["HDF5", "Parquet", "Memmap", "Splayed"])
+    def test_columnar_storage(self, db_type):
+        """测试列式分区存储与HDF5的磁盘占用和读取少量列的耗时"""
+        from controller.tools import init_contract_exchange_map
+        # Parquet按交易所分区，只保存instrument.yml中配置的合约
+        instrument_id = next(iter(init_contract_exchange_map()))
+        db_path = os.path.join(self.test_db_path, f"columnar_{db_type}")
+        data_collector = create_data_collector(db_type=db_type,
+                                               buffer_size=1000,
+                                               db_path=db_path,
+                                               db_name="test_columnar")
+
+        try:
+            num_records = 50000
+            test_data = self.generate_test_data(num_records)
+            for record in test_data:
+                record["InstrumentID"] = instrument_id
+                record["TradingDay"] = "20251215"
+            for record in test_data:
+                data_collector.add_data(record)
+            data_collector.flush()
+
+            start_time = time.time()
+            df = data_collector.load(instrument_id,
+                                     columns=["LastPrice", "Volume"])
+            read_time = time.time() - start_time
+        finally:
+            data_collector.close()
+
+        disk_size = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(db_path) for name in files)
+        print(f"{db_type} {num_records} 条记录磁盘占用: {disk_size / 1024:.1f} KB, "
+              f"读取2列耗时: {read_time * 1000:.2f} 毫秒")
+        assert df.shape == (num_records, 2)
+
+    @pytest.mark.parametrize("db_type,db_options", [
+        ("HDF5", None),
+        ("Memmap", None),
+        ("Memmap", {"schema": "compact"}),
+        ("Compressed", None),
+        ("Compressed", {"depth_delta": True}),
+    ])
+    def test_compressed_storage(self, db_type, db_options):
+        """测试随机游走行情在压缩存储、紧凑记录与定长存储下的磁盘占用和读取吞吐
+        每个tick只有少数盘口字段变化，盘口增量编码只保存变化的字段"""
+        label = db_type + ("(" + ",".join(f"{key}={value}"
+                                          for key, value in db_options.items()) +
+                           ")" if db_options else "")
+        db_path = os.path.join(self.test_db_path, f"compressed_{label}")
+        data_collector = create_data_collector(db_type=db_type,
+                                               buffer_size=1000,
+                                               db_path=db_path,
+                                               db_name="test_compressed",
+                                               db_options=db_options)
+
+        try:
+            num_records = 50000
+            # 价格按最小变动价位随机游走，时间每tick前进500毫秒，成交量单调递增
+            price = 4000.0
+            volume = 0
+            start = datetime(2025, 12, 15, 9, 0, 0)
+            book = {"BidVolume1": 100, "AskVolume1": 100}
+            for i in range(num_records):
+                price += random.choice((-1, 0, 0, 1))
+                volume += random.randint(0, 20)
+                book[random.choice(list(book))] = random.randint(1, 200)
+                timestamp = start + timedelta(milliseconds=500 * i)
+                data_collector.add_data({
+                    "InstrumentID": "rb2601",
+                    "TradingDay": "20251215",
+                    "ActionDay": timestamp.strftime("%Y%m%d"),
+                    "UpdateTime": timestamp.strftime("%H:%M:%S"),
+                    "UpdateMillisec": timestamp.microsecond // 1000,
+                    "LastPrice": price,
+                    "Volume": volume,
+                    "BidPrice1": price - 1,
+                    "AskPrice1": price + 1,
+                    **book
+                })
+            data_collector.flush()
+
+            start_time = time.time()
+            df = data_collector.load("rb2601")
+            read_time = time.time() - start_time
+        finally:
+            data_collector.close()
+
+        disk_size = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(db_path) for name in files)
+        print(f"{label} {num_records} 条记录磁盘占用: {disk_size / 1024:.1f} KB, "
+              f"每条 {disk_size / num_records:.1f} 字节, "
+              f"读取吞吐: {num_records / read_time:.0f} 条/秒")
+        assert len(df) == num_records
+
 
 def main():
     """主函数，用于独立运行性能测试"""
@@ -241,7 +519,9 @@ def main():
     print(f"测试数据生成完成")
 
     # 测试不同的数据库类型
-    db_types = ['CSV', 'SQLite3', 'HDF5']
+    db_types = [
+        'CSV', 'SQLite3', 'HDF5', 'Memmap', 'Splayed', 'Compressed', 'Parquet'
+    ]
 
     print("\n开始测试写入性能...")
     print("=" * 50)
@@ -254,7 +534,8 @@ def main():
         # 创建数据收集器实例
         data_collector = create_data_collector(db_type=db_type,
                                                buffer_size=args.buffer,
-                                               db_path=test.test_db_path)
+                                               db_path=test.test_db_path,
+                                               db_name="test_db")
 
         # 测试写入性能
         start_time = time.time()
@@ -286,7 +567,8 @@ def main():
         # 创建数据收集器实例
         data_collector = create_data_collector(db_type=db_type,
                                                buffer_size=1,
-                                               db_path=test.test_db_path)
+                                               db_path=test.test_db_path,
+                                               db_name="test_db")
 
         try:
             # 获取表名
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""行情数据模型转换性能测试脚本（MarketData.to_dict 与 Tick.from_ctp 对比）"""
+from model.market_data import MarketData, Tick, MARKET_DATA_FIELDS
+from db.buffer import ColumnarBuffer, iter_instrument_frames
+import random
+import time
+import sys
+# 添加项目根目录到Python路径
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).absolute().parents[2]))
+
+
+class FakeDepthMarketData:
+    """模拟CThostFtdcDepthMarketDataField的行情对象"""
+
+    def __init__(self, seq: int):
+        for name in MARKET_DATA_FIELDS:
+            setattr(self, name, random.uniform(3000, 5000))
+        self.InstrumentID = f"rb{2601 + seq % 4}"
+        self.TradingDay = "20251215"
+        self.ActionDay = "20251215"
+        self.UpdateTime = "09:00:00"
+        self.UpdateMillisec = seq % 1000
+        self.Volume = seq
+        for level in range(1, 6):
+            setattr(self, f"BidVolume{level}", random.randint(0, 1000))
+            setattr(self, f"AskVolume{level}", random.randint(0, 1000))
+
+
+def measure(func, ticks, repeat: int = 3) -> float:
+    """返回每条行情的平均耗时（微秒），取多次运行的最小值"""
+    best = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func(ticks)
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(ticks) * 1e6
+
+
+def convert_market_data(ticks):
+    """旧路径：MarketData逐字段getattr + to_dict"""
+    return [MarketData(tick).to_dict() for tick in ticks]
+
+
+def convert_tick(ticks):
+    """新路径：attrgetter一次性提取为Tick"""
+    return [Tick.from_ctp(tick) for tick in ticks]
+
+
+def flush_market_data(ticks):
+    """旧路径：字典列表 → DataFrame"""
+    return list(iter_instrument_frames(convert_market_data(ticks), "bench"))
+
+
+def flush_tick(ticks):
+    """新路径：Tick列表 → DataFrame"""
+    return list(iter_instrument_frames(convert_tick(ticks), "bench"))
+
+
+def flush_columnar(ticks):
+    """新路径：Tick写入列式缓冲区 → DataFrame"""
+    buffer = ColumnarBuffer(len(ticks))
+    for tick in ticks:
+        buffer.append(Tick.from_ctp(tick))
+    return list(iter_instrument_frames(buffer.take(), "bench"))
+
+
+class TestMarketDataPerformance:
+    """行情数据模型转换性能测试类"""
+
+    def test_tick_matches_market_data(self):
+        """测试Tick与MarketData.to_dict字段内容一致（接收时间各自记录）"""
+        tick = FakeDepthMarketData(1)
+        fast = Tick.from_ctp(tick).to_dict()
+        slow = MarketData(tick).to_dict()
+        assert fast.pop("recv_ns") > 0 and slow.pop("recv_ns") > 0
+        assert fast == slow
+
+    def test_conversion_performance(self):
+        """测试每条行情的转换耗时"""
+        ticks = [FakeDepthMarketData(i) for i in range(5000)]
+        before = measure(convert_market_data, ticks)
+        after = measure(convert_tick, ticks)
+        print(f"MarketData.to_dict: {before:.3f} 微秒/条, "
+              f"Tick.from_ctp: {after:.3f} 微秒/条")
+        assert before > 0 and after > 0
+
+    def test_conversion_and_flush_performance(self):
+        """测试转换+构造DataFrame的每条行情耗时"""
+        ticks = [FakeDepthMarketData(i) for i in range(5000)]
+        before = measure(flush_market_data, ticks)
+        after = measure(flush_tick, ticks)
+        columnar = measure(flush_columnar, ticks)
+        print(f"dict路径: {before:.3f} 微秒/条, Tick路径: {after:.3f} 微秒/条, "
+              f"列式路径: {columnar:.3f} 微秒/条")
+        assert before > 0 and after > 0 and columnar > 0
+
+
+def main():
+    """主函数，用于独立运行性能测试"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='行情数据模型转换性能测试脚本')
+    parser.add_argument('--records',
+                        '-r',
+                        type=int,
+                        default=20000,
+                        help='测试行情条数，默认20000条')
+    args = parser.parse_args()
+
+    ticks = [FakeDepthMarketData(i) for i in range(args.records)]
+    print("=" * 50)
+    print(f"{'转换路径':<24} {'微秒/条':<12}")
+    print("=" * 50)
+    for name, func in [("MarketData.to_dict", convert_market_data),
+                       ("Tick.from_ctp", convert_tick),
+                       ("dict → DataFrame", flush_market_data),
+                       ("Tick → DataFrame", flush_tick),
+                       ("Tick → 列式 → DataFrame", flush_columnar)]:
+        print(f"{name:<24} {measure(func, ticks):<12.3f}")
+
+
+if __name__ == "__main__":
+    # 如果作为脚本运行，执行主函数
+    main()
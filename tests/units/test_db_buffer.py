@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""测试列式行情缓冲区"""
+from db.buffer import (ColumnarBuffer, TickBatch, iter_instrument_frames,
+                       select_frames, stamp_epoch_ms)
+from db.collector import DataCollector
+from db.flush import AdaptiveBatchSizer, FlushPolicy, flush_timer
+from model.market_data import (DAY_MS, MARKET_DATA_FIELDS, MONOTONIC_OFFSET_NS,
+                               Tick, exchange_epoch_ms)
+import pandas as pd
+import sys
+import time
+import unittest
+import tempfile
+import shutil
+# 添加项目根目录到Python路径
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).absolute().parents[3]))
+
+
+def make_tick(instrument_id, seq):
+    """生成一条完整字段的行情记录"""
+    tick = {name: 0 for name in MARKET_DATA_FIELDS}
+    tick.update({
+        "InstrumentID": instrument_id,
+        "TradingDay": "20251215",
+        "ActionDay": "20251215",
+        "UpdateTime": "09:00:00",
+        "UpdateMillisec": seq % 1000,
+        "LastPrice": 3000.0 + seq,
+        "Volume": seq,
+    })
+    return tick
+
+
+class TestColumnarBuffer(unittest.TestCase):
+    """测试ColumnarBuffer和TickBatch"""
+
+    def test_append_and_take(self):
+        """测试追加后取出的批次与原始数据一致"""
+        buffer = ColumnarBuffer(4)
+        for i in range(6):
+            buffer.append(make_tick("rb2601" if i % 2 else "cu2601", i))
+        self.assertEqual(len(buffer), 6)
+        batch = buffer.take()
+        self.assertIsInstance(batch, TickBatch)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(list(batch.column("Volume")), list(range(6)))
+        groups = batch.group_by_instrument()
+        self.assertEqual(list(groups["rb2601"]["Volume"]), [1, 3, 5])
+        self.assertEqual(list(groups["cu2601"]["Volume"]), [0, 2, 4])
+
+    def test_take_does_not_alias_new_data(self):
+        """测试取出的批次不会被后续追加覆盖"""
+        buffer = ColumnarBuffer(2)
+        buffer.append(make_tick("rb2601", 1))
+        batch = buffer.take()
+        buffer.append(make_tick("rb2601", 2))
+        self.assertEqual(batch.column("Volume")[0], 1)
+
+    def test_restore_keeps_order(self):
+        """测试放回的批次排在缓冲区已有数据之前"""
+        buffer = ColumnarBuffer(2)
+        buffer.append(make_tick("rb2601", 0))
+        buffer.append(make_tick("rb2601", 1))
+        batch = buffer.take()
+        buffer.append(make_tick("rb2601", 2))
+        buffer.restore(batch)
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual(list(buffer.take().column("Volume")), [0, 1, 2])
+
+    def test_iter_instrument_frames(self):
+        """测试列式批次生成的DataFrame"""
+        buffer = ColumnarBuffer(8)
+        for i in range(4):
+            buffer.append(make_tick("rb2601", i))
+        frames = dict(iter_instrument_frames(buffer.take(), "test"))
+        df = frames["rb2601"]
+        self.assertEqual(list(df.columns), MARKET_DATA_FIELDS)
+        self.assertEqual(list(df["LastPrice"]), [3000.0, 3001.0, 3002.0,
+                                                 3003.0])
+
+    def test_tick_records(self):
+        """测试Tick可直接追加到列式缓冲区，也可按行构造DataFrame"""
+        ticks = [Tick(**make_tick("rb2601", i)) for i in range(3)]
+        buffer = ColumnarBuffer(4)
+        for tick in ticks:
+            buffer.append(tick)
+        batch = buffer.take()
+        self.assertEqual(list(batch.column("Volume")), [0, 1, 2])
+        frames = dict(iter_instrument_frames(ticks, "test"))
+        self.assertEqual(list(frames["rb2601"]["Volume"]), [0, 1, 2])
+        self.assertEqual(list(frames["rb2601"].columns), MARKET_DATA_FIELDS)
+
+    def test_select_frames(self):
+        """测试分块筛选时间范围、列和最后N行"""
+        df = pd.DataFrame([make_tick("rb2601", i) for i in range(10)])
+        chunks = [df.iloc[i:i + 3] for i in range(0, 10, 3)]
+        start_ms = exchange_epoch_ms("20251215", "09:00:00", 2)
+        end_ms = exchange_epoch_ms("20251215", "09:00:00", 8)
+        selected = select_frames(iter(chunks),
+                                 limit=4,
+                                 columns=["Volume"],
+                                 start_ms=start_ms,
+                                 end_ms=end_ms)
+        self.assertEqual(list(selected.columns), ["Volume"])
+        self.assertEqual(list(selected["Volume"]), [4, 5, 6, 7])
+        self.assertEqual(len(select_frames(iter(chunks), start_ms=end_ms * 2)),
+                         0)
+
+    def test_stamp_epoch_ms(self):
+        """测试批量计算时间戳，并按接收时间修正夜盘日期"""
+        expected = exchange_epoch_ms("20251215", "21:00:00", 500)
+        # 大商所夜盘ActionDay填为下一交易日，按接收时间修正回当天
+        night = make_tick("m2601", 0)
+        night.update({"ActionDay": "20251216", "UpdateTime": "21:00:00",
+                      "UpdateMillisec": 500,
+                      "recv_ns": (expected + 20) * 1000000 -
+                      MONOTONIC_OFFSET_NS})
+        # 没有接收时间的记录按ActionDay计算
+        plain = make_tick("rb2601", 1)
+        # 已有时间戳的记录保持不变
+        stamped = dict(make_tick("rb2601", 2), epoch_ms=123)
+
+        records = [dict(night), dict(plain), dict(stamped)]
+        stamp_epoch_ms(records)
+        self.assertEqual([row["epoch_ms"] for row in records],
+                         [expected, exchange_epoch_ms("20251215", "09:00:00",
+                                                      1), 123])
+
+        ticks = stamp_epoch_ms([Tick(**night), Tick(**plain)])
+        self.assertEqual(ticks[0].epoch_ms, expected)
+        self.assertEqual(ticks[1].epoch_ms, expected - 12 * 3600000 + 1 - 500)
+
+        buffer = ColumnarBuffer(4)
+        buffer.append(night)
+        buffer.append(stamped)
+        batch = stamp_epoch_ms(buffer.take())
+        self.assertEqual(list(batch.column("epoch_ms")), [expected, 123])
+        self.assertEqual(expected - exchange_epoch_ms("20251216", "21:00:00",
+                                                      500), -DAY_MS)
+
+
+class TestDataCollectorColumnarMode(unittest.TestCase):
+    """测试DataCollector列式缓冲区模式"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_columnar_collector_roundtrip(self):
+        """测试列式模式写入HDF5后可以完整读回"""
+        collector = DataCollector(db_type="hdf5",
+                                  buffer_size=16,
+                                  db_path=self.temp_dir,
+                                  db_name="test",
+                                  buffer_mode="columnar")
+        for i in range(50):
+            collector.add_data(make_tick("rb2601" if i % 2 else "cu2601", i))
+        collector.close()
+        df = collector.load("rb2601")
+        self.assertEqual(list(df["Volume"]), list(range(1, 50, 2)))
+        self.assertEqual(df["InstrumentID"].iloc[0], "rb2601")
+        # 收集器写入前计算交易所时间戳
+        self.assertEqual(
+            list(df["epoch_ms"]),
+            [exchange_epoch_ms("20251215", "09:00:00", i)
+             for i in range(1, 50, 2)])
+
+    def test_collector_partial_load(self):
+        """测试只读取最后N行和指定列"""
+        collector = DataCollector(db_type="hdf5",
+                                  buffer_size=16,
+                                  db_path=self.temp_dir,
+                                  db_name="test",
+                                  buffer_mode="columnar")
+        for i in range(50):
+            collector.add_data(make_tick("rb2601", i))
+        collector.close()
+        df = collector.load("rb2601", 5, columns=["Volume", "LastPrice"])
+        self.assertEqual(list(df.columns), ["Volume", "LastPrice"])
+        self.assertEqual(list(df["Volume"]), list(range(45, 50)))
+
+
+
+class TestFlushPolicy(unittest.TestCase):
+    """测试按记录数、字节数和存活时间刷新缓冲区"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_record_limit(self):
+        """测试记录数和字节数上限合并为单一阈值"""
+        self.assertEqual(FlushPolicy(100, 4096).record_limit(512), 8)
+        self.assertEqual(FlushPolicy(4, 4096).record_limit(512), 4)
+        self.assertIsNone(FlushPolicy(None, max_age=1.0).record_limit(512))
+        with self.assertRaises(ValueError):
+            FlushPolicy(max_age=0)
+
+    def test_max_age_flushes_idle_buffer(self):
+        """测试成交稀少的缓冲区由定时线程按存活时间刷新"""
+        collector = DataCollector(db_type="hdf5",
+                                  buffer_size=1000,
+                                  db_path=self.temp_dir,
+                                  db_name="test",
+                                  flush_policy=FlushPolicy(max_records=1000,
+                                                           max_age=0.05))
+        for i in range(3):
+            collector.add_data(make_tick("rb2601", i))
+        deadline = time.monotonic() + 5
+        while len(collector.buffer) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(collector.buffer), 0)
+        # 等待定时线程上正在进行的写入完成
+        collector.flush()
+        self.assertEqual(list(collector.load("rb2601")["Volume"]), [0, 1, 2])
+        collector.close()
+        self.assertNotIn(collector, flush_timer._collectors)
+
+    def test_adaptive_batch_sizer(self):
+        """测试按写入耗时调整批次大小，并受上下限、内存上限和到达速率限制"""
+        sizer = AdaptiveBatchSizer(min_records=8,
+                                   max_records=1000,
+                                   target_latency=0.01)
+        self.assertEqual(sizer.start(64, limit=500, max_age=None), 64)
+        # 写入很快时每次最多翻倍，直到内存上限
+        self.assertEqual(sizer.observe_save(64, 0.001), 128)
+        for _ in range(5):
+            sizer.observe_save(sizer.batch_size, 0.001)
+        self.assertEqual(sizer.batch_size, 500)
+        # 耗时在目标附近时保持不变
+        self.assertEqual(sizer.observe_save(500, 0.01), 500)
+        # 写入很慢时每次最多减半，不低于下限
+        self.assertEqual(sizer.observe_save(500, 0.1), 250)
+        for _ in range(10):
+            sizer.observe_save(sizer.batch_size, 0.1)
+        self.assertEqual(sizer.batch_size, 8)
+        # 定时刷新的小批次按比例外推，写入很快时不会缩小批次
+        sizer.start(256, limit=None, max_age=None)
+        self.assertEqual(sizer.observe_save(4, 0.0001), 400)
+        # 清淡的合约批次不超过max_age内能攒满的记录数
+        sizer.start(256, limit=None, max_age=1.0)
+        sizer.observe_arrival(20, 1.0)
+        self.assertEqual(sizer.observe_save(20, 0.0001), 21)
+        stats = sizer.stats()
+        self.assertEqual(stats["batch_size"], 21)
+        self.assertGreater(stats["batch_grows"], 0)
+        self.assertGreater(stats["batch_shrinks"], 0)
+
+    def test_adaptive_collector_stats(self):
+        """测试收集器暴露自适应批次大小的指标"""
+        collector = DataCollector(db_type="hdf5",
+                                  buffer_size=4,
+                                  db_path=self.temp_dir,
+                                  db_name="test",
+                                  batch_sizer=AdaptiveBatchSizer(
+                                      min_records=2,
+                                      max_records=64,
+                                      target_latency=10.0))
+        for i in range(20):
+            collector.add_data(make_tick("rb2601", i))
+        stats = collector.get_stats()
+        self.assertGreater(stats["batch_size"], 4)
+        self.assertGreater(stats["arrival_rate"], 0)
+        self.assertGreater(stats["flush_latency_ms"], 0)
+        collector.close()
+        self.assertEqual(len(collector.load("rb2601")), 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,13 +7,32 @@ from controller.tools import init_contract_exchange_map
 from db.handlers.hdf5 import HDF5Handler
 from db.handlers.sqlite import SQLiteHandler
 from db.handlers.csv import CSVHandler
+from db.handlers.parquet import ParquetHandler
+from db.handlers.memmap import (MemmapHandler, open_memmap, COMPACT_DTYPE,
+                                RECORD_DTYPE)
+from db.price_tick import (price_tick_of, save_price_tick_cache,
+                           update_price_tick)
+from db.handlers.splayed import (SplayedHandler,
+                                 default_max_open_instruments)
+from db.handlers.compressed import CompressedHandler, read_block_index
+from db.codec import CODEC_QUANTIZED_EXCEPTIONS, decode_column, encode_column
+from db.partition import TradingDayHandler
+from model.market_data import exchange_epoch_ms
+from utils.process import raise_file_limit
+import glob
+import numpy as np
 import sys
 import os
 import unittest
+from unittest import mock
 import tempfile
 import shutil
 import pandas as pd
 import sqlite3
+try:
+    import resource
+except ImportError:  # Windows没有resource模块
+    resource = None
 # 添加项目根目录到Python路径
 import pathlib
 
@@ -134,6 +153,35 @@ class TestDBHandlers(unittest.TestCase):
             # 确保文件中只有该合约的数据
             self.assertEqual(df["InstrumentID"].unique()[0], instrument_id)
 
+    def test_csv_handler_appends_to_pandas_file(self):
+        """测试追加到pandas写出的已有CSV文件时沿用表头和LF换行"""
+        instrument_id = f"ag{self.next_ym}"
+        symbol_path = os.path.join(self.temp_dir, "SHFE", "ag")
+        os.makedirs(symbol_path)
+        file_path = os.path.join(symbol_path, f"{instrument_id}.csv")
+        pd.DataFrame([self.test_data[3]]).to_csv(file_path, index=False)
+
+        csv_handler = CSVHandler(db_path=self.temp_dir)
+        csv_handler.save([self.test_data[4]])
+        csv_handler.close()
+
+        with open(file_path, "rb") as f:
+            content = f.read()
+        self.assertNotIn(b"\r", content)
+        self.assertEqual(
+            content, b"InstrumentID,Price,Volume\n"
+            + f"{instrument_id},5000.0,15\n".encode()
+            + f"{instrument_id},5010.0,25\n".encode())
+
+        # 新进程中合约映射尚未初始化时，load先初始化再查找交易所
+        import controller.tools
+        controller.tools.contract_exchange_map = None
+        with mock.patch(
+                "controller.tools.init_contract_exchange_map",
+                lambda: init_contract_exchange_map(self.instrument_yml)):
+            df = csv_handler.load(instrument_id)
+        self.assertEqual(list(df["Volume"]), [15, 25])
+
     def test_sqlite_handler_save(self):
         """测试SQLiteHandler的save方法"""
         # 创建SQLiteHandler实例
@@ -172,6 +220,91 @@ class TestDBHandlers(unittest.TestCase):
         # 显式关闭SQLiteHandler的连接
         sqlite_handler.close()
 
+    def test_sqlite_handler_persistent_wal(self):
+        """测试SQLiteHandler长连接、WAL模式及多次追加"""
+        sqlite_handler = SQLiteHandler(db_path=self.temp_dir,
+                                       db_name="test_market_data.db",
+                                       synchronous="OFF")
+        sqlite_handler.save(self.test_data)
+        sqlite_handler.save(self.test_data)
+
+        conn = sqlite3.connect(
+            os.path.join(self.temp_dir, "test_market_data.db"))
+        try:
+            journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+            self.assertEqual(journal_mode.lower(), "wal")
+            count = conn.execute(
+                f'SELECT COUNT(*) FROM "ad{self.next_ym}"').fetchone()[0]
+            self.assertEqual(count, 4)
+        finally:
+            conn.close()
+
+        df = sqlite_handler.load(f"ag{self.next_ym}")
+        self.assertEqual(list(df["Price"]), [5000.0, 5010.0, 5000.0, 5010.0])
+        sqlite_handler.close()
+
+    def test_sqlite_handler_ticks_schema(self):
+        """测试SQLiteHandler单表ticks结构的时间范围和最新N条查询"""
+        sqlite_handler = SQLiteHandler(db_path=self.temp_dir,
+                                       db_name="test_ticks.db",
+                                       schema="ticks")
+        instrument_id = f"ag{self.next_ym}"
+        ticks = [{
+            "InstrumentID": instrument_id,
+            "ActionDay": "20251215",
+            "UpdateTime": f"09:00:{i:02d}",
+            "UpdateMillisec": 500,
+            "LastPrice": 5000.0 + i,
+            "Volume": i
+        } for i in range(10)]
+        sqlite_handler.save(ticks[:6])
+        sqlite_handler.save(ticks[6:])
+
+        self.assertEqual(sqlite_handler.get_tables(), [instrument_id])
+        # 最新N条按时间顺序返回最后N条
+        df = sqlite_handler.load(instrument_id, 3)
+        self.assertEqual(list(df["Volume"]), [7, 8, 9])
+        # 时间范围查询
+        start_ms = df["epoch_ms"].iloc[0] - 5000
+        df = sqlite_handler.query_range(instrument_id,
+                                        start_ms=start_ms,
+                                        end_ms=start_ms + 2000,
+                                        columns=["epoch_ms", "LastPrice"])
+        self.assertEqual(list(df.columns), ["epoch_ms", "LastPrice"])
+        self.assertEqual(list(df["LastPrice"]), [5002.0, 5003.0])
+        # 按主键聚簇存储，任意列的范围查询和最新N条都不回表、不额外排序
+        conn = sqlite_handler._connect()
+        for query, params in (
+            ("SELECT LastPrice FROM ticks WHERE InstrumentID = ? "
+             "AND epoch_ms >= ? ORDER BY epoch_ms, seq", (instrument_id, 0)),
+            ("SELECT LastPrice FROM ticks WHERE InstrumentID = ? "
+             "ORDER BY epoch_ms DESC, seq DESC LIMIT 3", (instrument_id, ))):
+            plan = " ".join(
+                row[-1]
+                for row in conn.execute("EXPLAIN QUERY PLAN " + query, params))
+            self.assertIn("PRIMARY KEY", plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+
+        # ActionDay为空时按TradingDay计算时间，缺少日期的记录写入epoch_ms=0，不影响整个事务
+        sqlite_handler.save([
+            dict(ticks[0], ActionDay="", TradingDay="20251216", Volume=10),
+            dict(ticks[0], ActionDay="", Volume=11)
+        ])
+        df = sqlite_handler.query_range(instrument_id)
+        self.assertEqual(list(df["Volume"]), [11] + list(range(10)) + [10])
+        self.assertEqual(df["epoch_ms"].iloc[-1],
+                         df["epoch_ms"].iloc[1] + 86400000)
+        sqlite_handler.close()
+
+        # 不是按主键聚簇的ticks表拒绝使用
+        conn = sqlite3.connect(os.path.join(self.temp_dir, "rowid.db"))
+        conn.execute("CREATE TABLE ticks (InstrumentID TEXT, epoch_ms INTEGER)")
+        conn.close()
+        with self.assertRaises(ValueError):
+            SQLiteHandler(db_path=self.temp_dir,
+                          db_name="rowid.db",
+                          schema="ticks").get_tables()
+
     def test_hdf5_handler_save(self):
         """测试HDF5Handler的save方法"""
         # 创建HDF5Handler实例
@@ -202,6 +335,505 @@ class TestDBHandlers(unittest.TestCase):
                 # 确保表中只有该合约的数据
                 self.assertEqual(df["InstrumentID"].unique()[0], table)
 
+    def test_hdf5_handler_keep_open_rollover(self):
+        """测试HDF5Handler保持打开、交易日切换时重新打开"""
+        hdf5_handler = HDF5Handler(db_path=self.temp_dir,
+                                   db_name="test_keep_open.h5",
+                                   keep_open=True,
+                                   flush_records=1)
+        day1 = [dict(item, TradingDay="20251215") for item in self.test_data]
+        day2 = [dict(item, TradingDay="20251216") for item in self.test_data]
+        hdf5_handler.save(day1)
+        store = hdf5_handler._store
+        hdf5_handler.save(day1)
+        # 同一交易日复用同一个store
+        self.assertIs(hdf5_handler._store, store)
+        hdf5_handler.save(day2)
+        # 交易日切换后重新打开
+        self.assertIsNot(hdf5_handler._store, store)
+        self.assertFalse(store.is_open)
+        # 较早的TradingDay（如郑商所夜盘的自然日）不切换
+        store = hdf5_handler._store
+        hdf5_handler.save(day1)
+        self.assertIs(hdf5_handler._store, store)
+
+        df = hdf5_handler.load(f"ag{self.next_ym}")
+        self.assertEqual(len(df), 8)
+        hdf5_handler.close()
+        self.assertIsNone(hdf5_handler._store)
+        # 关闭后仍可直接从文件读取
+        self.assertIn(f"ag{self.next_ym}", hdf5_handler.get_tables())
+
+    def test_hdf5_handler_compression_data_columns(self):
+        """测试HDF5Handler压缩并在epoch_ms上建立索引"""
+        hdf5_handler = HDF5Handler(db_path=self.temp_dir,
+                                   db_name="test_compression.h5",
+                                   complib="blosc",
+                                   complevel=5,
+                                   expected_rows=1000,
+                                   data_columns=["epoch_ms"])
+        data = [
+            dict(item,
+                 ActionDay="20251215",
+                 UpdateTime=f"09:00:{i:02d}",
+                 UpdateMillisec=0) for i, item in enumerate(self.test_data)
+        ]
+        hdf5_handler.save(data)
+
+        table_name = f"ag{self.next_ym}"
+        # 追加时不建立索引，关闭时每个节点建立一次
+        with pd.HDFStore(hdf5_handler.db_file, mode='r') as store:
+            self.assertNotIn("epoch_ms",
+                             store.get_storer(table_name).table.colindexes)
+        hdf5_handler.close()
+        with pd.HDFStore(hdf5_handler.db_file, mode='r') as store:
+            table = store.get_storer(table_name).table
+            self.assertEqual(table.filters.complib, "blosc")
+            self.assertIn("epoch_ms", table.colindexes)
+            # 2025-12-15 09:00:04（UTC+8）之后的记录
+            df = store.select(table_name, where="epoch_ms >= 1765760404000")
+        self.assertEqual(df["Price"].tolist(), [5010.0])
+
+    def test_load_partial_reads(self):
+        """测试各处理器按时间范围、列和最后N行加载"""
+        data = [{
+            "InstrumentID": "ag" + self.next_ym,
+            "TradingDay": "20251215",
+            "ActionDay": "20251215",
+            "UpdateTime": f"09:00:{i:02d}",
+            "UpdateMillisec": 0,
+            "LastPrice": 5000.0 + i
+        } for i in range(30)]
+        # 2025-12-15 09:00:10 ~ 09:00:20（UTC+8），左闭右开
+        start_ms, end_ms = 1765760410000, 1765760420000
+        handlers = [
+            CSVHandler(db_path=os.path.join(self.temp_dir, "csv")),
+            SQLiteHandler(db_path=self.temp_dir, db_name="partial.db"),
+            HDF5Handler(db_path=self.temp_dir, db_name="partial.h5"),
+            HDF5Handler(db_path=self.temp_dir,
+                        db_name="partial_indexed.h5",
+                        data_columns=["epoch_ms"]),
+        ]
+        for handler in handlers:
+            with self.subTest(handler=type(handler).__name__):
+                handler.save(data)
+                table_name = "ag" + self.next_ym
+                df = handler.load(table_name, 3)
+                self.assertEqual(list(df["LastPrice"]),
+                                 [5027.0, 5028.0, 5029.0])
+                df = handler.load(table_name,
+                                  columns=["LastPrice"],
+                                  start_ms=start_ms,
+                                  end_ms=end_ms)
+                self.assertEqual(list(df.columns), ["LastPrice"])
+                self.assertEqual(list(df["LastPrice"]),
+                                 [5000.0 + i for i in range(10, 20)])
+                df = handler.load(table_name, 2, start_ms=start_ms,
+                                  end_ms=end_ms)
+                self.assertEqual(list(df["LastPrice"]), [5018.0, 5019.0])
+                handler.close()
+
+    def test_parquet_handler_partitions(self):
+        """测试ParquetHandler按exchange/symbol/trading_day分区写入并下推读取"""
+        parquet_handler = ParquetHandler(db_path=self.temp_dir,
+                                         row_group_size=4)
+        instrument_id = f"ag{self.next_ym}"
+        day1 = [{
+            "InstrumentID": instrument_id,
+            "TradingDay": "20251215",
+            "ActionDay": "20251215",
+            "UpdateTime": f"09:00:{i:02d}",
+            "UpdateMillisec": 0,
+            "LastPrice": 5000.0 + i
+        } for i in range(10)]
+        day2 = [dict(item, TradingDay="20251216") for item in day1]
+        parquet_handler.save(day1)
+        parquet_handler.save(day2)
+        parquet_handler.close()
+
+        partition = os.path.join(self.temp_dir, "exchange=SHFE", "symbol=ag")
+        self.assertEqual(sorted(os.listdir(partition)),
+                         ["trading_day=20251215", "trading_day=20251216"])
+        self.assertEqual(parquet_handler.get_tables(), [instrument_id])
+
+        df = parquet_handler.load(instrument_id,
+                                  3,
+                                  columns=["TradingDay", "LastPrice"])
+        self.assertEqual(list(df.columns), ["TradingDay", "LastPrice"])
+        self.assertEqual(list(df["LastPrice"]), [5007.0, 5008.0, 5009.0])
+        # 2025-12-15 09:00:08（UTC+8）起的记录，两个交易日各2条
+        df = parquet_handler.load(instrument_id, start_ms=1765760408000)
+        self.assertEqual(list(df["TradingDay"]),
+                         ["20251215", "20251215", "20251216", "20251216"])
+
+    def test_parquet_handler_compaction(self):
+        """测试ParquetHandler每次写入的文件立即可被其他实例读取，小文件合并后数据不变"""
+        parquet_handler = ParquetHandler(db_path=self.temp_dir,
+                                         compact_files=3)
+        instrument_id = f"ag{self.next_ym}"
+        data = [{
+            "InstrumentID": instrument_id,
+            "TradingDay": "20251215",
+            "ActionDay": "20251215",
+            "UpdateTime": f"09:00:{i:02d}",
+            "UpdateMillisec": 0,
+            "LastPrice": 5000.0 + i
+        } for i in range(10)]
+        partition = os.path.join(self.temp_dir, "exchange=SHFE", "symbol=ag",
+                                 "trading_day=20251215")
+        for i in range(0, 10, 2):
+            parquet_handler.save(data[i:i + 2])
+        # 第3个文件写出后合并前3个小文件
+        self.assertEqual(sorted(os.listdir(partition)), [
+            f"{instrument_id}.0000-0002.parquet",
+            f"{instrument_id}.0003.parquet", f"{instrument_id}.0004.parquet"
+        ])
+        # 未关闭时其他进程（另一个实例）即可读取全部数据
+        reader = ParquetHandler(db_path=self.temp_dir)
+        self.assertEqual(list(reader.load(instrument_id)["LastPrice"]),
+                         [5000.0 + i for i in range(10)])
+        parquet_handler.close()
+        self.assertEqual(os.listdir(partition),
+                         [f"{instrument_id}.0000-0004.parquet"])
+        self.assertEqual(list(reader.load(instrument_id, 3)["LastPrice"]),
+                         [5007.0, 5008.0, 5009.0])
+        # 列式缓冲区写出的文件多出recv_ns列，合并前也能与已有文件一起读取
+        writer = ParquetHandler(db_path=self.temp_dir)
+        writer.save([dict(data[-1], UpdateTime="09:00:10", recv_ns=1)])
+        df = reader.load(instrument_id)
+        self.assertEqual(len(df), 11)
+        self.assertEqual(list(df["recv_ns"].fillna(0).iloc[-2:]), [0, 1])
+
+    def test_memmap_handler_save(self):
+        """测试MemmapHandler按合约和交易日写入定长记录，并可直接映射读取"""
+        memmap_handler = MemmapHandler(db_path=self.temp_dir)
+        instrument_id = f"ag{self.next_ym}"
+        data = [{
+            "InstrumentID": instrument_id,
+            "TradingDay": "20251215",
+            "ActionDay": "20251215",
+            "UpdateTime": f"09:00:{i:02d}",
+            "UpdateMillisec": 500,
+            "LastPrice": 5000.0 + i,
+            "Volume": i
+        } for i in range(10)]
+        memmap_handler.save(data[:6])
+        memmap_handler.save(data[6:])
+        memmap_handler.close()
+
+        self.assertEqual(memmap_handler.get_tables(), [instrument_id])
+        records = open_memmap(
+            os.path.join(self.temp_dir, "20251215", f"{instrument_id}.ticks"))
+        self.assertEqual(len(records), 10)
+        self.assertEqual(list(records["Volume"]), list(range(10)))
+        self.assertEqual(records["epoch_ms"][0], 1765760400500)
+
+        df = memmap_handler.load(instrument_id,
+                                 2,
+                                 columns=["InstrumentID", "LastPrice"])
+        self.assertEqual(list(df["InstrumentID"]), [instrument_id] * 2)
+        self.assertEqual(list(df["LastPrice"]), [5008.0, 5009.0])
+        df = memmap_handler.load(instrument_id,
+                                 start_ms=1765760403000,
+                                 end_ms=1765760405000)
+        self.assertEqual(list(df["Volume"]), [3, 4])
+
+    def test_memmap_handler_compact_schema(self):
+        """测试紧凑记录按最小变动价位存储int32跳数，无效价格还原为NaN"""
+        instrument_id = f"ag{self.next_ym}"
+        self.assertEqual(price_tick_of(instrument_id), 1.0)
+        # 合约查询返回的最小变动价位优先于品种配置
+        update_price_tick(instrument_id, 0.5)
+        self.assertEqual(price_tick_of(instrument_id), 0.5)
+        cache_path = os.path.join(self.temp_dir, "price_tick_cache.yml")
+        save_price_tick_cache(cache_path)
+        import yaml
+        with open(cache_path, encoding="utf-8") as f:
+            self.assertEqual(yaml.safe_load(f)[instrument_id], 0.5)
+
+        memmap_handler = MemmapHandler(db_path=self.temp_dir,
+                                       schema="compact")
+        data = [{
+            "InstrumentID": instrument_id,
+            "TradingDay": "20251215",
+            "ActionDay": "20251215",
+            "UpdateTime": f"09:00:{i:02d}",
+            "LastPrice": 5000.0 + i / 2,
+            "AskPrice5": np.finfo(np.float64).max,
+            "AveragePrice": 5000.0 / 3,
+            "Volume": i
+        } for i in range(10)]
+        memmap_handler.save(data)
+        path = os.path.join(self.temp_dir, "20251215",
+                            f"{instrument_id}.ticks")
+        records = open_memmap(path)
+        self.assertEqual(records.dtype, COMPACT_DTYPE)
+        self.assertEqual(list(records["LastPrice"][:3]), [10000, 10001, 10002])
+        del records
+        self.assertTrue(memmap_handler.load(instrument_id)["AskPrice5"].isna().all())
+        # 价格不在最小变动价位上时不中断写入，文件改写为定长记录
+        memmap_handler.save([dict(data[9], LastPrice=5004.6)])
+        memmap_handler.close()
+        self.assertEqual(open_memmap(path).dtype, RECORD_DTYPE)
+        data.append(dict(data[9], LastPrice=5004.6))
+
+        df = memmap_handler.load(instrument_id)
+        self.assertEqual(list(df["LastPrice"]),
+                         [row["LastPrice"] for row in data])
+        # 改写为定长记录后无效价格保持CTP原值
+        self.assertTrue((df["AskPrice5"] == np.finfo(np.float64).max).all())
+        self.assertEqual(df["AveragePrice"][0], 5000.0 / 3)
+        self.assertEqual(df["Volume"].dtype, np.int64)
+        df = memmap_handler.load(instrument_id, 2, columns=["LastPrice"])
+        self.assertEqual(list(df["LastPrice"]), [5004.5, 5004.6])
+
+    def test_splayed_handler_save(self):
+        """测试SplayedHandler每列一个.npy文件，追加后可按列读取"""
+        splayed_handler = SplayedHandler(db_path=self.temp_dir,
+                                         db_name="SHFE")
+        # 默认按进程文件句柄上限计算同时打开的合约数
+        self.assertEqual(splayed_handler.max_open_instruments,
+                         default_max_open_instruments())
+        if resource is not None:
+            # 只读取句柄上限，提高上限由进程启动时的raise_file_limit完成
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (1024, hard))
+            try:
+                self.assertEqual(default_max_open_instruments(), 13)
+                self.assertEqual(
+                    resource.getrlimit(resource.RLIMIT_NOFILE)[0], 1024)
+                self.assertEqual(raise_file_limit(), hard)
+            finally:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+        instrument_id = f"ag{self.next_ym}"
+        data = [{
+            "InstrumentID": instrument_id,
+            "TradingDay": "20251215",
+            "ActionDay": "20251215",
+            "UpdateTime": f"09:00:{i:02d}",
+            "UpdateMillisec": 0,
+            "LastPrice": 5000.0 + i,
+            "Volume": i
+        } for i in range(10)]
+        splayed_handler.save(data[:4])
+        splayed_handler.save(data[4:])
+        splayed_handler.close()
+
+        directory = os.path.join(self.temp_dir, "SHFE.splayed", "20251215",
+                                 instrument_id)
+        self.assertEqual(list(np.load(os.path.join(directory, "Volume.npy"))),
+                         list(range(10)))
+        day = splayed_handler.read_day("20251215", ["LastPrice", "Volume"])
+        self.assertEqual(list(day), [instrument_id])
+        self.assertEqual(day[instrument_id]["LastPrice"][-1], 5009.0)
+
+        df = splayed_handler.load(instrument_id,
+                                  2,
+                                  columns=["InstrumentID", "Volume"])
+        self.assertEqual(list(df["InstrumentID"]), [instrument_id] * 2)
+        self.assertEqual(list(df["Volume"]), [8, 9])
+        df = splayed_handler.load(instrument_id,
+                                  columns=["Volume"],
+                                  start_ms=1765760403000,
+                                  end_ms=1765760405000)
+        self.assertEqual(list(df["Volume"]), [3, 4])
+
+    def test_compressed_handler_save(self):
+        """测试CompressedHandler按块压缩写入，解码后与原始数据一致"""
+        compressed_handler = CompressedHandler(db_path=self.temp_dir)
+        instrument_id = f"ag{self.next_ym}"
+        data = [{
+            "InstrumentID": instrument_id,
+            "TradingDay": "20251215",
+            "ActionDay": "20251215",
+            "UpdateTime": f"09:00:{i // 2:02d}",
+            "UpdateMillisec": 500 * (i % 2),
+            "LastPrice": 5000.0 + i % 3,
+            "AveragePrice": 5000.0 / (i + 1),
+            "Volume": i * 7
+        } for i in range(10)]
+        compressed_handler.save(data[:6])
+        compressed_handler.save(data[6:])
+        compressed_handler.close()
+
+        path = os.path.join(self.temp_dir, "20251215", f"{instrument_id}.tkz")
+        index = read_block_index(path)
+        self.assertEqual([block[2] for block in index], [6, 4])
+        self.assertEqual(index[1][3:5], (1765760403000, 1765760404500))
+
+        df = compressed_handler.load(instrument_id)
+        self.assertEqual(list(df["UpdateTime"]),
+                         [row["UpdateTime"] for row in data])
+        self.assertEqual(list(df["LastPrice"]),
+                         [row["LastPrice"] for row in data])
+        # 无法量化的浮点数按位异或编码，也必须无损
+        self.assertEqual(list(df["AveragePrice"]),
+                         [row["AveragePrice"] for row in data])
+        df = compressed_handler.load(instrument_id,
+                                     2,
+                                     columns=["InstrumentID", "Volume"])
+        self.assertEqual(list(df["InstrumentID"]), [instrument_id] * 2)
+        self.assertEqual(list(df["Volume"]), [56, 63])
+        df = compressed_handler.load(instrument_id,
+                                     columns=["Volume"],
+                                     start_ms=1765760402000,
+                                     end_ms=1765760403500)
+        self.assertEqual(list(df["Volume"]), [28, 35, 42])
+
+    def test_compressed_handler_depth_delta(self):
+        """测试盘口增量编码：只保存变化的盘口字段，读取时还原完整的五档盘口"""
+        compressed_handler = CompressedHandler(db_path=self.temp_dir,
+                                               depth_delta=True,
+                                               snapshot_interval=4)
+        instrument_id = f"ag{self.next_ym}"
+        data = [{
+            "InstrumentID": instrument_id,
+            "TradingDay": "20251215",
+            "ActionDay": "20251215",
+            "UpdateTime": f"09:00:{i:02d}",
+            "BidPrice1": 5000.0 + i // 3,
+            "BidVolume1": 10 + i % 2,
+            "AskPrice5": 5010.0,
+            "AskVolume5": 7 if i < 5 else 8
+        } for i in range(10)]
+        compressed_handler.save(data)
+        compressed_handler.close()
+
+        path = os.path.join(self.temp_dir, "20251215", f"{instrument_id}.tkz")
+        self.assertTrue(read_block_index(path)[0][5])
+        df = compressed_handler.load(instrument_id)
+        for name in ("BidPrice1", "BidVolume1", "AskPrice5", "AskVolume5"):
+            self.assertEqual(list(df[name]), [row[name] for row in data])
+        self.assertEqual(list(df["AskPrice1"]), [0.0] * 10)
+        df = compressed_handler.load(instrument_id, 3, columns=["AskVolume5"])
+        self.assertEqual(list(df["AskVolume5"]), [8, 8, 8])
+
+    def test_codec_quantizes_around_invalid_prices(self):
+        """测试价格列中的DBL_MAX（无效价格）作为例外值保存，其余值仍量化编码且无损"""
+        prices = 5000.0 + np.arange(1000) % 7
+        invalid = prices.copy()
+        invalid[::50] = np.finfo(np.float64).max
+        invalid[3] = np.nan
+        encoded = encode_column(invalid)
+        self.assertEqual(encoded[0], CODEC_QUANTIZED_EXCEPTIONS)
+        # 例外值只多占少量字节，不会整列退回异或编码
+        self.assertLess(len(encoded), len(encode_column(prices)) * 1.2)
+        decoded, _ = decode_column(encoded, 0, np.dtype(np.float64),
+                                   len(invalid))
+        self.assertEqual(decoded.tobytes(), invalid.tobytes())
+
+    def test_trading_day_handler_rollover(self):
+        """测试按交易日分区：夜盘开始时滚动到新分区，迟到的旧交易日行情写回原分区"""
+        handler = TradingDayHandler(
+            lambda path: SQLiteHandler(db_path=path, db_name="test.db"),
+            self.temp_dir)
+        instrument_id = f"ag{self.next_ym}"
+
+        def tick(trading_day, action_day, update_time, volume):
+            return {
+                "InstrumentID": instrument_id,
+                "TradingDay": trading_day,
+                "ActionDay": action_day,
+                "UpdateTime": update_time,
+                "UpdateMillisec": 0,
+                "Volume": volume
+            }
+
+        handler.save([tick("20251215", "20251215", "14:59:59", 1)])
+        old = handler._partitions["20251215"]
+        # 夜盘行情的TradingDay为下一交易日，同一批次中包含日盘最后一条
+        handler.save([
+            tick("20251215", "20251215", "15:00:00", 2),
+            tick("20251216", "20251215", "21:00:00", 3)
+        ])
+        self.assertEqual(handler.current_trading_day, "20251216")
+        self.assertNotIn("20251215", handler._partitions)
+        handler._closers["20251215"].join()
+        self.assertIsNone(old.handler._conn)
+        # 迟到的旧交易日行情临时打开原分区写入
+        handler.save([tick("20251215", "20251215", "15:00:01", 4)])
+        self.assertEqual(list(handler._partitions), ["20251216"])
+
+        for trading_day in ("20251215", "20251216"):
+            self.assertTrue(
+                os.path.exists(
+                    os.path.join(self.temp_dir, trading_day, "test.db")))
+        self.assertEqual(list(handler.load(instrument_id)["Volume"]),
+                         [1, 2, 4, 3])
+        self.assertEqual(list(handler.load(instrument_id, 2)["Volume"]),
+                         [4, 3])
+        self.assertEqual(handler.get_tables(), [instrument_id])
+        with self.assertRaises(KeyError):
+            handler.load(f"ad{self.next_ym}")
+        handler.close()
+
+    def test_trading_day_handler_night_natural_date(self):
+        """测试郑商所式夜盘（TradingDay为自然日）按下一交易日分区，周五夜盘归入下周一"""
+        handler = TradingDayHandler(
+            lambda path: SQLiteHandler(db_path=path, db_name="test.db"),
+            self.temp_dir)
+        instrument_id = f"ag{self.next_ym}"
+
+        def tick(trading_day, action_day, update_time, volume):
+            return {
+                "InstrumentID": instrument_id,
+                "TradingDay": trading_day,
+                "ActionDay": action_day,
+                "UpdateTime": update_time,
+                "UpdateMillisec": 0,
+                "Volume": volume,
+                "epoch_ms": exchange_epoch_ms(action_day, update_time)
+            }
+
+        handler.save([
+            tick("20251219", "20251219", "14:59:59", 1),
+            tick("20251219", "20251219", "21:00:00", 2)
+        ])
+        self.assertEqual(handler.current_trading_day, "20251222")
+        handler.save([tick("20251220", "20251220", "01:00:00", 3)])
+        handler.save([tick("20251222", "20251222", "09:00:00", 4)])
+        # 没有迟到的旧交易日行情，不会重新打开20251219分区
+        self.assertEqual(list(handler._partitions), ["20251222"])
+        self.assertEqual(handler.trading_days(), ["20251219", "20251222"])
+        self.assertEqual(list(handler.load(instrument_id)["Volume"]),
+                         [1, 2, 3, 4])
+        handler.close()
+
+    def test_self_partitioned_handlers_night_natural_date(self):
+        """测试自行按交易日分区的处理器与TradingDayHandler一致：郑商所式周五夜盘归入下周一"""
+        instrument_id = f"ag{self.next_ym}"
+        data = [{
+            "InstrumentID": instrument_id,
+            "TradingDay": "20251212",
+            "ActionDay": "20251212",
+            "UpdateTime": "21:30:00",
+            "UpdateMillisec": 0,
+            "LastPrice": 5000.0,
+            "Volume": 1,
+            "epoch_ms": exchange_epoch_ms("20251212", "21:30:00")
+        }]
+        factories = {
+            "memmap": MemmapHandler,
+            "splayed": lambda path: SplayedHandler(db_path=path,
+                                                   db_name="SHFE"),
+            "compressed": CompressedHandler,
+            "parquet": ParquetHandler,
+        }
+        for name, factory in factories.items():
+            with self.subTest(handler=name):
+                db_path = os.path.join(self.temp_dir, name)
+                handler = factory(db_path)
+                handler.save(data)
+                handler.close()
+                paths = [
+                    os.path.relpath(path, db_path) for path in glob.glob(
+                        os.path.join(db_path, "**", "*"), recursive=True)
+                ]
+                self.assertTrue(any("20251215" in path for path in paths))
+                self.assertFalse(any("20251212" in path for path in paths))
+                self.assertEqual(list(handler.load(instrument_id)["Volume"]),
+                                 [1])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,594 @@
+# -*- coding: utf-8 -*-
+"""测试异步写入器及DataCollector异步模式"""
+from controller.tools import init_contract_exchange_map
+from db.collector import DataCollector
+from db.fanout import FanoutHandler
+from db.handlers import CSVHandler
+from db.interface import DatabaseInterface
+from db.journal import TickJournal, list_segments
+from db.writer import AsyncWriter, MemoryBudget, WriterPool
+from model.market_data import MARKET_DATA_DTYPE
+import datetime
+import os
+import sys
+import threading
+import time
+import unittest
+import tempfile
+import shutil
+import yaml
+# 添加项目根目录到Python路径
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).absolute().parents[3]))
+
+
+def make_records(instrument_id, start, count):
+    """生成测试记录"""
+    return [{
+        "InstrumentID": instrument_id,
+        "Seq": i
+    } for i in range(start, start + count)]
+
+
+class TestAsyncWriter(unittest.TestCase):
+    """测试AsyncWriter"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.saved = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def save(self, batch):
+        self.gate.wait()
+        self.saved.extend(batch)
+
+    def test_block_preserves_order(self):
+        """测试阻塞策略下所有数据按顺序写入"""
+        writer = AsyncWriter(self.save, queue_size=2)
+        for i in range(10):
+            writer.submit(make_records("rb2601", i * 5, 5))
+        writer.close()
+        self.assertEqual([r["Seq"] for r in self.saved], list(range(50)))
+        stats = writer.stats()
+        self.assertEqual(stats["written_records"], 50)
+        self.assertEqual(stats["queued_records"], 0)
+        self.assertEqual(stats["dropped_records"], 0)
+
+    def test_drop_oldest(self):
+        """测试队列满时丢弃最旧批次并计数"""
+        self.gate.clear()
+        writer = AsyncWriter(self.save, queue_size=2,
+                             backpressure="drop_oldest")
+        for i in range(6):
+            writer.submit(make_records("rb2601", i * 5, 5))
+        stats = writer.stats()
+        self.assertGreater(stats["dropped_records"], 0)
+        self.gate.set()
+        writer.close()
+        stats = writer.stats()
+        self.assertEqual(stats["written_records"] + stats["dropped_records"],
+                         30)
+        # 保留下来的数据仍然有序
+        seqs = [r["Seq"] for r in self.saved]
+        self.assertEqual(seqs, sorted(seqs))
+        self.assertEqual(seqs[-1], 29)
+
+    def test_spill_preserves_order(self):
+        """测试溢写策略下不丢数据且顺序不变"""
+        self.gate.clear()
+        writer = AsyncWriter(self.save, queue_size=1, backpressure="spill",
+                             spill_dir=self.temp_dir)
+        for i in range(8):
+            writer.submit(make_records("rb2601", i * 5, 5))
+        self.assertGreater(writer.stats()["spilled_records"], 0)
+        self.gate.set()
+        writer.close()
+        self.assertEqual([r["Seq"] for r in self.saved], list(range(40)))
+        self.assertEqual(writer.stats()["spill_depth"], 0)
+
+    def test_spill_drains_without_queue_timeout(self):
+        """测试回放溢写批次时不等待空队列超时"""
+        writer = AsyncWriter(self.save,
+                             queue_size=1,
+                             backpressure="spill",
+                             spill_dir=self.temp_dir)
+        self.gate.clear()
+        for i in range(30):
+            writer.submit(make_records("rb2601", i, 1))
+        self.assertGreaterEqual(writer.stats()["spill_depth"], 28)
+        start = time.monotonic()
+        self.gate.set()
+        writer.close()
+        # 每个批次等待0.1秒超时时需要约3秒
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual([r["Seq"] for r in self.saved], list(range(30)))
+
+    def test_sharded_writers_keep_instrument_order(self):
+        """测试多写线程按合约分片，合约内顺序不变"""
+        writer = AsyncWriter(self.save, queue_size=4, writer_threads=3)
+        for i in range(20):
+            batch = (make_records("rb2601", i * 3, 3) +
+                     make_records("cu2601", i * 3, 3) +
+                     make_records("ag2601", i * 3, 3))
+            writer.submit(batch)
+        writer.close()
+        for instrument_id in ("rb2601", "cu2601", "ag2601"):
+            seqs = [
+                r["Seq"] for r in self.saved
+                if r["InstrumentID"] == instrument_id
+            ]
+            self.assertEqual(seqs, list(range(60)))
+
+    def test_failed_save_is_counted(self):
+        """测试写入失败不会终止写线程"""
+        def failing_save(batch):
+            raise IOError("disk full")
+
+        writer = AsyncWriter(failing_save)
+        writer.submit(make_records("rb2601", 0, 5))
+        writer.close()
+        self.assertEqual(writer.stats()["failed_records"], 5)
+
+
+class TestWriterPool(unittest.TestCase):
+    """测试共享写线程池"""
+
+    def test_writers_run_concurrently_in_order(self):
+        """测试不同写入队列并发写入，同一队列按提交顺序写入"""
+        pool = WriterPool(threads=2, queue_size=8)
+        both_running = threading.Barrier(2, timeout=5)
+        saved = {"SHFE": [], "DCE": []}
+
+        def saver(name):
+            def save(batch):
+                if batch[0]["Seq"] == 0:
+                    # 两个交易所的第一个批次必须同时在写才能通过
+                    both_running.wait()
+                saved[name].extend(record["Seq"] for record in batch)
+            return save
+
+        writers = {
+            name: pool.writer(saver(name), name=name)
+            for name in saved
+        }
+        for start in range(0, 40, 4):
+            for writer in writers.values():
+                writer.submit(make_records("rb2601", start, 4))
+        pool.close()
+        for name, writer in writers.items():
+            self.assertEqual(saved[name], list(range(40)))
+            stats = writer.stats()
+            self.assertEqual(stats["written_records"], 40)
+            self.assertEqual(stats["flush_count"], 10)
+            self.assertEqual(stats["queue_depth"], 0)
+            self.assertGreaterEqual(stats["max_flush_latency_ms"],
+                                    stats["avg_flush_latency_ms"])
+
+    def test_queue_depth_blocks_producer(self):
+        """测试写入队列满时提交等待，写入失败只计数"""
+        pool = WriterPool(threads=1, queue_size=1)
+        gate = threading.Event()
+
+        def save(batch):
+            gate.wait()
+            if batch[0]["Seq"] == 4:
+                raise IOError("disk full")
+
+        writer = pool.writer(save, name="SHFE")
+        writer.submit(make_records("rb2601", 0, 4))
+        # 等待第一个批次被池线程取走，再填满队列
+        while writer.stats()["queue_depth"]:
+            time.sleep(0.01)
+        writer.submit(make_records("rb2601", 4, 4))
+        blocked = threading.Thread(
+            target=writer.submit, args=(make_records("rb2601", 8, 4), ))
+        blocked.start()
+        blocked.join(0.2)
+        self.assertTrue(blocked.is_alive())
+        self.assertEqual(pool.stats()["busy_threads"], 1)
+        gate.set()
+        blocked.join()
+        pool.close()
+        stats = writer.stats()
+        self.assertEqual(stats["written_records"], 8)
+        self.assertEqual(stats["failed_records"], 4)
+
+
+class TestMemoryBudget(unittest.TestCase):
+    """测试进程内共享的内存预算"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_reserve_and_release(self):
+        """测试超出预算时预留失败，预算为空时总能预留一个批次"""
+        budget = MemoryBudget(100)
+        self.assertTrue(budget.reserve(150))
+        self.assertFalse(budget.reserve(10))
+        self.assertTrue(budget.reserve(10, force=True))
+        budget.release(160)
+        self.assertTrue(budget.reserve(60))
+        self.assertFalse(budget.reserve(60))
+        stats = budget.stats()
+        self.assertEqual(stats["used_bytes"], 60)
+        self.assertEqual(stats["peak_bytes"], 160)
+        self.assertEqual(stats["max_bytes"], 100)
+
+    def test_collectors_spill_over_budget(self):
+        """测试写入阻塞时超出预算的批次溢写到本地文件，恢复后按顺序写入"""
+        spill_dir = os.path.join(self.temp_dir, "spill")
+        budget = MemoryBudget(8 * MARKET_DATA_DTYPE.itemsize,
+                              spill_dir=spill_dir)
+        pool = WriterPool(threads=2, queue_size=2)
+        gate = threading.Event()
+        collectors = {}
+        for exch in ("SHFE", "DCE"):
+            collector = DataCollector(db_type="sqlite3",
+                                      buffer_size=8,
+                                      db_path=self.temp_dir,
+                                      db_name=f"{exch}.db",
+                                      writer_pool=pool,
+                                      memory_budget=budget)
+            save = collector.db_handler.save
+
+            def slow_save(batch, save=save):
+                gate.wait()
+                save(batch)
+
+            collector.db_handler.save = slow_save
+            collectors[exch] = collector
+        # 写入阻塞时行情线程不等待，每个交易所只有一个批次占用内存
+        for record in make_records("rb2601", 0, 100):
+            for collector in collectors.values():
+                collector.add_data(record)
+        stats = budget.stats()
+        self.assertEqual(stats["used_bytes"], 16 * MARKET_DATA_DTYPE.itemsize)
+        # 12个批次中SHFE第1个直接写入；DCE第1个超出预算溢写后立即回放
+        self.assertEqual(stats["spilled_records"], 88 + 96)
+        self.assertGreater(stats["spill_pending_bytes"], 0)
+        self.assertEqual(len(os.listdir(spill_dir)), 2)
+        for collector in collectors.values():
+            self.assertEqual(collector.get_stats()["budget_spill_depth"], 11)
+        gate.set()
+        for collector in collectors.values():
+            collector.close()
+            df = collector.load("rb2601")
+            self.assertEqual(list(df["Seq"]), list(range(100)))
+        stats = budget.stats()
+        self.assertEqual(stats["used_bytes"], 0)
+        self.assertEqual(stats["spill_pending_bytes"], 0)
+        self.assertEqual(os.listdir(spill_dir), [])
+        pool.close()
+
+
+class TestDataCollectorAsyncMode(unittest.TestCase):
+    """测试DataCollector异步模式"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_async_collector_writes_all_records(self):
+        """测试异步模式下close后所有数据落盘"""
+        collector = DataCollector(db_type="sqlite3",
+                                  buffer_size=8,
+                                  db_path=self.temp_dir,
+                                  db_name="test.db",
+                                  async_mode=True)
+        for record in make_records("rb2601", 0, 100):
+            collector.add_data(record)
+        collector.close()
+        self.assertEqual(collector.get_stats()["written_records"], 100)
+        df = collector.load("rb2601")
+        self.assertEqual(list(df["Seq"]), list(range(100)))
+
+    def test_collectors_share_writer_pool(self):
+        """测试多个交易所收集器共用写线程池，close后全部落盘"""
+        pool = WriterPool(threads=2, queue_size=2)
+        collectors = {
+            exch: DataCollector(db_type="sqlite3",
+                                buffer_size=8,
+                                db_path=self.temp_dir,
+                                db_name=f"{exch}.db",
+                                writer_pool=pool)
+            for exch in ("SHFE", "DCE")
+        }
+        for record in make_records("rb2601", 0, 100):
+            for collector in collectors.values():
+                collector.add_data(record)
+        for collector in collectors.values():
+            collector.close()
+            self.assertEqual(collector.get_stats()["written_records"], 100)
+            df = collector.load("rb2601")
+            self.assertEqual(list(df["Seq"]), list(range(100)))
+        self.assertEqual(pool.stats()["writers"], {})
+        # 在写缓冲区数由写线程池决定，不能同时指定buffer_count
+        with self.assertRaises(ValueError):
+            DataCollector(db_type="sqlite3",
+                          db_path=self.temp_dir,
+                          db_name="CFFEX.db",
+                          buffer_count=2,
+                          writer_pool=pool)
+        pool.close()
+
+    def test_double_buffered_flush(self):
+        """测试双缓冲：flush只交换缓冲区，在写缓冲区数有上限，写入顺序不变"""
+        collector = DataCollector(db_type="sqlite3",
+                                  buffer_size=4,
+                                  db_path=self.temp_dir,
+                                  db_name="test.db",
+                                  buffer_count=2)
+        gate = threading.Event()
+        save = collector.db_handler.save
+
+        def slow_save(batch):
+            gate.wait()
+            save(batch)
+
+        collector.db_handler.save = slow_save
+        # 第一个满缓冲区交给写线程后，行情线程继续写入另一个缓冲区
+        for record in make_records("rb2601", 0, 7):
+            collector.add_data(record)
+        self.assertEqual(len(collector.buffer), 3)
+        # 唯一的在写名额被占用，下一次flush等待写线程
+        blocked = threading.Thread(target=collector.flush)
+        blocked.start()
+        blocked.join(0.2)
+        self.assertTrue(blocked.is_alive())
+        gate.set()
+        blocked.join()
+        for record in make_records("rb2601", 7, 11):
+            collector.add_data(record)
+        collector.close()
+        df = collector.load("rb2601")
+        self.assertEqual(list(df["Seq"]), list(range(18)))
+        self.assertEqual(collector.get_stats()["written_records"], 18)
+
+    def test_sync_flush_keeps_batch_on_failure(self):
+        """测试单缓冲同步写入失败时批次放回缓冲区，下次flush重试"""
+        collector = DataCollector(db_type="sqlite3",
+                                  buffer_size=100,
+                                  db_path=self.temp_dir,
+                                  db_name="test.db")
+        save = collector.db_handler.save
+
+        def failing_save(batch):
+            raise IOError("disk full")
+
+        collector.db_handler.save = failing_save
+        for record in make_records("rb2601", 0, 4):
+            collector.add_data(record)
+        with self.assertRaises(IOError):
+            collector.flush()
+        self.assertEqual([r["Seq"] for r in collector.buffer], list(range(4)))
+        collector.db_handler.save = save
+        for record in make_records("rb2601", 4, 2):
+            collector.add_data(record)
+        collector.close()
+        df = collector.load("rb2601")
+        self.assertEqual(list(df["Seq"]), list(range(6)))
+
+
+
+class ListHandler(DatabaseInterface):
+    """把批次保存在内存列表中的测试处理器，gate未打开时save阻塞"""
+
+    def __init__(self):
+        self.saved = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.closed = False
+
+    def save(self, data):
+        self.gate.wait()
+        self.saved.extend(data)
+
+    def load(self, table_name, limit=None, columns=None, start_ms=None,
+             end_ms=None):
+        return self.saved
+
+    def get_tables(self):
+        return []
+
+    def close(self):
+        self.closed = True
+
+
+class TestFanoutHandler(unittest.TestCase):
+    """测试扇出写入"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_slow_sink_lag_is_bounded(self):
+        """测试慢副本只在落后超过max_lag个批次时阻塞主处理器，spill时不阻塞"""
+        primary, sink = ListHandler(), ListHandler()
+        sink.gate.clear()
+        fanout = FanoutHandler(primary, {"slow": sink}, max_lag=2)
+        # 副本写线程取走1个批次后阻塞，队列中还能容纳max_lag个批次
+        for i in range(3):
+            fanout.save(make_records("rb2601", i * 4, 4))
+        self.assertEqual(len(primary.saved), 12)
+        blocked = threading.Thread(
+            target=fanout.save, args=(make_records("rb2601", 12, 4), ))
+        blocked.start()
+        blocked.join(0.2)
+        self.assertTrue(blocked.is_alive())
+        self.assertEqual(fanout.stats()["slow"]["queue_depth"], 2)
+        sink.gate.set()
+        blocked.join()
+        fanout.close()
+        self.assertEqual(sink.saved, primary.saved)
+        self.assertTrue(sink.closed and primary.closed)
+
+        primary, sink = ListHandler(), ListHandler()
+        sink.gate.clear()
+        fanout = FanoutHandler(primary, {"slow": sink},
+                               max_lag=2,
+                               backpressure="spill",
+                               spill_dir=self.temp_dir)
+        for i in range(10):
+            fanout.save(make_records("rb2601", i * 4, 4))
+        self.assertEqual(len(primary.saved), 40)
+        self.assertGreater(fanout.stats()["slow"]["spilled_records"], 0)
+        sink.gate.set()
+        fanout.close()
+        self.assertEqual(sink.saved, primary.saved)
+
+    def test_collector_writes_to_all_sinks(self):
+        """测试收集器把同一批次写入主数据库和副本，从主数据库读取"""
+        # CSV按instrument.yml中的交易所分目录，合约代码使用下一个月份
+        instrument_yml = os.path.join(self.temp_dir, "instrument.yml")
+        with open(instrument_yml, "w") as f:
+            yaml.dump({"SHFE": {"products": ["ag#白银期货"]}}, f)
+        init_contract_exchange_map(instrument_yml)
+        today = datetime.date.today()
+        next_month = datetime.date(today.year + today.month // 12,
+                                   today.month % 12 + 1, 1)
+        instrument_id = f"ag{next_month:%y%m}"
+        csv_path = os.path.join(self.temp_dir, "csv")
+        collector = DataCollector(db_type="sqlite3",
+                                  buffer_size=8,
+                                  db_path=self.temp_dir,
+                                  db_name="test.db",
+                                  buffer_count=2,
+                                  sinks=[{
+                                      "db_type": "CSV",
+                                      "db_path": csv_path
+                                  }],
+                                  sink_max_lag=1)
+        for record in make_records(instrument_id, 0, 100):
+            collector.add_data(record)
+        # 不在instrument.yml中的合约被CSV副本跳过，计入skipped_records
+        for record in make_records("zz0000", 0, 4):
+            collector.add_data(record)
+        collector.close()
+        self.assertEqual(list(collector.load(instrument_id)["Seq"]),
+                         list(range(100)))
+        sink_stats = collector.get_stats()["sinks"]["csv"]
+        self.assertEqual(sink_stats["written_records"], 100)
+        self.assertEqual(sink_stats["skipped_records"], 4)
+        sink = CSVHandler(csv_path)
+        self.assertEqual(list(sink.load(instrument_id)["Seq"]),
+                         list(range(100)))
+        sink.close()
+        with self.assertRaises(ValueError):
+            DataCollector(db_type="sqlite3",
+                          db_path=self.temp_dir,
+                          db_name="test.db",
+                          sinks=[{"db_type": "sqlite3",
+                                  "db_path": csv_path,
+                                  "db_name": "test.db"}])
+
+
+def make_ticks(instrument_id, start, count):
+    """生成带行情字段的测试记录（预写日志只保存行情字段）"""
+    return [{
+        "InstrumentID": instrument_id,
+        "TradingDay": "20251215",
+        "ActionDay": "20251215",
+        "UpdateTime": "09:00:00",
+        "UpdateMillisec": i,
+        "Volume": i
+    } for i in range(start, start + count)]
+
+
+class TestTickJournal(unittest.TestCase):
+    """测试缓冲行情的预写日志"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.journal_dir = os.path.join(self.temp_dir, "journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_collector(self, buffer_size=1000):
+        return DataCollector(db_type="sqlite3",
+                             buffer_size=buffer_size,
+                             db_path=self.temp_dir,
+                             db_name="test.db",
+                             journal_dir=self.journal_dir,
+                             journal_commit_interval=0.005)
+
+    def wait_journaled(self, collector, records):
+        deadline = time.monotonic() + 5
+        while (collector.journal.stats()["journaled_records"] < records
+               and time.monotonic() < deadline):
+            time.sleep(0.005)
+        self.assertEqual(collector.journal.stats()["journaled_records"],
+                         records)
+
+    def test_replay_after_crash(self):
+        """测试进程崩溃时缓冲区中的行情在重启后从日志重放"""
+        collector = self.make_collector()
+        for record in make_ticks("rb2601", 0, 10):
+            collector.add_data(record)
+        self.wait_journaled(collector, 10)
+        # 模拟崩溃：只停止日志线程，不flush也不close
+        collector.journal._stop.set()
+        collector.journal._thread.join()
+        collector.db_handler.close()
+
+        collector = self.make_collector()
+        self.assertEqual(list_segments(self.journal_dir, "test.db"), [])
+        df = collector.load("rb2601")
+        self.assertEqual(list(df["Volume"]), list(range(10)))
+        self.assertEqual(df["InstrumentID"].iloc[0], "rb2601")
+        collector.close()
+
+    def test_flushed_segments_are_removed(self):
+        """测试缓冲区写入数据库后删除对应日志段，写入失败的批次重试成功后一并删除"""
+        collector = self.make_collector(buffer_size=4)
+        save = collector.db_handler.save
+        failures = []
+
+        def flaky_save(batch):
+            if not failures:
+                failures.append(len(batch))
+                raise IOError("disk full")
+            save(batch)
+
+        collector.db_handler.save = flaky_save
+        with self.assertRaises(IOError):
+            for record in make_ticks("rb2601", 0, 4):
+                collector.add_data(record)
+        # 写入失败的批次放回缓冲区，日志段保留到写入成功
+        self.assertEqual(len(collector.buffer), 4)
+        for record in make_ticks("rb2601", 4, 6):
+            collector.add_data(record)
+        collector.close()
+        self.assertEqual(list_segments(self.journal_dir, "test.db"), [])
+
+        # 重启后没有需要重放的日志，数据不重复
+        collector = self.make_collector()
+        self.assertEqual(list(collector.load("rb2601")["Volume"]),
+                         list(range(10)))
+        collector.close()
+
+    def test_journal_requires_ordered_writes(self):
+        """测试多写线程的异步模式不能使用预写日志"""
+        with self.assertRaises(ValueError):
+            DataCollector(db_type="sqlite3",
+                          db_path=self.temp_dir,
+                          db_name="test.db",
+                          async_mode=True,
+                          writer_threads=2,
+                          journal_dir=self.journal_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
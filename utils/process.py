@@ -119,6 +119,9 @@ class ProcessManager:
             # 动态修改日志文件路径
             main_logger.set_log_file(collector_log_file)
             main_logger.set_log_level(LOG_CONFIG["log_level"])
+            # 存储按文件句柄上限确定同时打开的文件数，先提高到硬上限
+            file_limit = raise_file_limit()
+            main_logger.info("Main", f"File handle limit: {file_limit}")
             # 开发测试模式：60秒后自动终止
             if dev_test:
                 # 启动自动退出线程
@@ -162,6 +165,25 @@ class ProcessManager:
             main_logger.set_log_file(LOG_CONFIG["log_file"])
 
 
+def raise_file_limit():
+    """
+    把进程的文件句柄软上限提高到硬上限，在收集器进程启动时调用一次。
+    Splayed等按句柄上限确定同时打开文件数的存储读取的是提高后的上限
+    :return: 提高后的软上限，没有resource模块（Windows）时返回None
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError) as e:
+            main_logger.error("Main", f"Failed to raise file limit: {e}")
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
 def _auto_exit(sec=5):
     main_logger.info("Main", f"Dev test mode: Auto exit in {sec} seconds...")
     time.sleep(sec)
@@ -3,7 +3,6 @@
 import signal
 import threading
 import time
-import sys
 
 # 全局退出标志（线程安全）
 EXIT_FLAG = threading.Event()
@@ -12,15 +11,17 @@ background_threads = []
 
 
 def signal_handler(signum, frame):
-    """信号处理函数：捕获Ctrl+C/SIGTERM，确保只处理一次"""
+    """
+    信号处理函数：捕获Ctrl+C/SIGTERM，确保只处理一次
+    只设置退出标志，由主线程从wait_for_exit返回后停止控制器、关闭数据收集器，
+    保证缓冲区和写入队列中的数据落盘（不能在这里sys.exit跳过清理）
+    """
     if not EXIT_FLAG.is_set():
         print(
             f"\nReceived signal {signum} (SIGINT/SIGTERM), "
             f"exiting gracefully..."
         )
         EXIT_FLAG.set()
-        # 立即终止主程序，避免重复处理信号
-        sys.exit(0)
 
 
 def register_signals():